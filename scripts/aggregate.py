@@ -0,0 +1,31 @@
+import polars as pl
+
+from relevance import fold, fold_expr
+
+
+def term_column(term):
+    return f"{term}_videos"
+
+
+def with_term_indicators(lf, terms):
+    # desc is lower-cased and folded once, all terms are matched in one Aho-Corasick pass over it,
+    # then each term gets a boolean column from the list of matches
+    folded = [fold(term) for term in terms]
+    hits = fold_expr(pl.col('desc')).str.extract_many(list(dict.fromkeys(folded)), overlapping=True)
+    return lf.with_columns(hits.alias('__hits')).with_columns([
+        pl.col('__hits').list.contains(f).fill_null(False).alias(term_column(term))
+        for term, f in zip(terms, folded)
+    ]).drop('__hits')
+
+
+def rollup(df, by):
+    counts = [c for c in df.columns if c.endswith('_videos')]
+    return df.group_by(by).agg(pl.col(counts).sum()).sort(by)
+
+
+def by_country(df):
+    return rollup(df.drop_nulls('country'), 'country').sort('total_videos', descending=True)
+
+
+def by_day(df):
+    return rollup(df.drop_nulls('day'), 'day')
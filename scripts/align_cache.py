@@ -0,0 +1,92 @@
+import collections
+import gc
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def model_bytes(model):
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+    except AttributeError:
+        return 0
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class AlignModelCache:
+    # keeps alignment models for recently seen languages, evicting the least recently used once
+    # their combined size passes max_bytes (the most recent model is always kept)
+    def __init__(self, device, max_bytes=4e9, load=None):
+        if load is None:
+            import whisperx
+            load = whisperx.load_align_model
+        self.device = device
+        self.max_bytes = max_bytes
+        self.load = load
+        self.models = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, language_code):
+        with self._lock:
+            if language_code in self.models:
+                self.models.move_to_end(language_code)
+                self.hits += 1
+                model, metadata, _ = self.models[language_code]
+                return model, metadata
+
+            self.misses += 1
+            model, metadata = self.load(language_code=language_code, device=self.device)
+            size = model_bytes(model)
+            self.models[language_code] = (model, metadata, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.models) > 1:
+                evicted, (_, _, evicted_size) = self.models.popitem(last=False)
+                self.total_bytes -= evicted_size
+                logger.info(f"Evicted alignment model for '{evicted}'")
+            gc.collect()
+            return model, metadata
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+class LanguageGroupedQueue(queue.Queue):
+    # a bounded queue that hands out items in the language it last handed out while any are waiting,
+    # so consecutive alignments reuse the cached model. Items key() can't place (like end-of-stream
+    # markers) only come out once nothing else is left.
+    def __init__(self, maxsize, key):
+        self.key = key
+        self.last_language = None
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = collections.deque()
+
+    def _language(self, item):
+        try:
+            return self.key(item)
+        except (KeyError, TypeError):
+            return None
+
+    def _get(self):
+        fallback = None
+        for i, item in enumerate(self.queue):
+            language = self._language(item)
+            if language is None:
+                continue
+            if language == self.last_language:
+                fallback = i
+                break
+            if fallback is None:
+                fallback = i
+        if fallback is None:
+            return self.queue.popleft()
+        item = self.queue[fallback]
+        del self.queue[fallback]
+        self.last_language = self._language(item)
+        return item
@@ -1,29 +1,22 @@
-import os
-
 import polars as pl
 
-def concat(a_df, b_df):
-    try:
-        return pl.concat([a_df, b_df], how='diagonal_relaxed')
-    except (pl.exceptions.SchemaError, pl.exceptions.PanicException):
-        return pl.DataFrame(a_df.to_dicts() + b_df.to_dicts(), infer_schema_length=len(a_df) + len(b_df))
+from inverted_index import InvertedIndex
+from schema import VIDEO_SCHEMA
+from store import FragmentStore
 
 def main():
-    # df = pl.DataFrame()
-    # for filename in os.listdir('./data'):
-    #     if filename.endswith('.parquet.zstd'):
-    #         try:
-    #             df = concat(df, pl.read_parquet(f'./data/{filename}'))
-    #         except Exception as e:
-    #             print(f"Error processing file {filename}: {e}")
-
-    df = pl.read_parquet('./data/fetched_election_videos.parquet.zstd')
+    store = FragmentStore('./data/fetched_election_videos', schema=VIDEO_SCHEMA)
+    df = store.read(columns=['id', 'locationCreated', 'author', 'authorStats'])
 
     df = df.unique('id')
-    df = df.with_columns(pl.col('desc').str.extract_all(r'#(?P<hashtag>[a-zA-Z0-9_]+)').alias('hashtags'))
+
+    # hashtags come from the inverted index, which only reads fragments added since it was last updated
+    index = InvertedIndex(store)
+    index.update()
+    hashtag_df = index.term_counts(hashtags_only=True)
     
     # country list
-    country_df = df.select(['locationCreated']).drop_nulls()['locationCreated'].value_counts().sort('count')
+    country_df = df.select(['locationCreated']).drop_nulls()['locationCreated'].value_counts().sort('count', descending=True)
 
     # author list
     author_df = df.select([
@@ -32,10 +25,15 @@ def main():
         pl.col('authorStats').struct.field('followerCount')
         ])\
         .unique('uniqueId')\
-        .sort('followerCount')
-    
-    pass
+        .sort('followerCount', descending=True)
+
+    print("Top hashtags:")
+    print(hashtag_df.head(20))
+    print("\nVideos per country:")
+    print(country_df.head(20))
+    print("\nAuthors with the most followers:")
+    print(author_df.head(20))
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,95 @@
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+def _ffmpeg_decode(input_args, sr, stdin_bytes=None):
+    cmd = [
+        'ffmpeg', '-nostdin', '-threads', '0', '-loglevel', 'error',
+        *input_args,
+        '-vn', '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sr), '-',
+    ]
+    if stdin_bytes is not None:
+        cmd.remove('-nostdin')
+    proc = subprocess.run(cmd, input=stdin_bytes, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode(errors='replace').strip())
+    return proc.stdout
+
+def decode_audio(video_bytes, sr=SAMPLE_RATE):
+    # mono float32 PCM at sr, the same thing whisperx.load_audio gives for a file, or None when
+    # the video has no usable audio track
+    try:
+        pcm = _ffmpeg_decode(['-i', 'pipe:0'], sr, stdin_bytes=video_bytes)
+    except RuntimeError:
+        # mp4s with the moov atom at the end can't be read from a pipe since ffmpeg has to seek,
+        # so those go through a file in shared memory instead
+        tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        with tempfile.NamedTemporaryFile(suffix='.mp4', dir=tmp_dir) as f:
+            f.write(video_bytes)
+            f.flush()
+            try:
+                pcm = _ffmpeg_decode(['-i', f.name], sr)
+            except RuntimeError as e:
+                logger.debug(f"Could not decode audio: {e}")
+                return None
+    if len(pcm) == 0:
+        return None
+    return np.frombuffer(pcm, np.int16).flatten().astype(np.float32) / 32768.0
+
+def prefetch(items, load, num_threads=4, max_ahead=8):
+    # yields (item, load(item)) in order while up to max_ahead later items are loading in threads,
+    # so fetching and decoding overlaps with whatever the caller does with each result
+    items = iter(items)
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as pool:
+        pending = collections.deque((item, pool.submit(load, item)) for item in itertools.islice(items, max_ahead))
+        while pending:
+            item, future = pending.popleft()
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, pool.submit(load, next_item)))
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to load {item}: {e}")
+                result = None
+            yield item, result
+
+def transcribe_packed(audios, model, batch_size, chunk_seconds=30):
+    # short clips are transcribed together as one audio, so whisper fills its batches with segments
+    # from several clips, then segments are mapped back by time. whisperx's VAD merges speech into
+    # chunks of up to chunk_seconds across any silence, so clips are kept apart by more silence than
+    # that and no chunk spans two clips. A call is decoded in one language, so each clip's language
+    # is detected on its own and only clips in the same language are packed together
+    languages = [model.detect_language(audio) for audio in audios]
+    gap = np.zeros(int((chunk_seconds + 1) * SAMPLE_RATE), dtype=np.float32)
+    results = [{'segments': [], 'language': language} for language in languages]
+    for language in dict.fromkeys(languages):
+        indices = [i for i, clip_language in enumerate(languages) if clip_language == language]
+        offsets = []
+        pieces = []
+        position = 0
+        for i in indices:
+            offsets.append(position / SAMPLE_RATE)
+            pieces.extend([audios[i], gap])
+            position += len(audios[i]) + len(gap)
+        packed_result = model.transcribe(np.concatenate(pieces), batch_size=batch_size, language=language, chunk_size=chunk_seconds)
+
+        for segment in packed_result['segments']:
+            j = max(int(np.searchsorted(offsets, segment['start'], side='right')) - 1, 0)
+            i = indices[j]
+            duration = len(audios[i]) / SAMPLE_RATE
+            results[i]['segments'].append({
+                **segment,
+                'start': max(segment['start'] - offsets[j], 0.0),
+                'end': min(segment['end'] - offsets[j], duration),
+            })
+    return results
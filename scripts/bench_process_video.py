@@ -0,0 +1,62 @@
+import argparse
+import glob
+import json
+import os
+import time
+import types
+
+from download_videos import ProcessVideo
+
+# Compares parsing saved TikTok video pages the old way (whole page, one find, json.loads) against
+# the streaming ProcessVideo fed in network-sized chunks, e.g.
+#   python bench_process_video.py ./fixtures/html --chunk-size 16384
+
+def parse_whole(html):
+    json_start = '"webapp.video-detail":'
+    start = html.find(json_start) + len(json_start)
+    end = html.find(',"webapp.a-b":', start)
+    return json.loads(html[start:end])
+
+def parse_streaming(html, chunk_size):
+    processor = ProcessVideo(types.SimpleNamespace(status_code=200, encoding='utf-8'))
+    for i in range(0, len(html), chunk_size):
+        if processor.process_chunk(html[i:i + chunk_size]) == 'break':
+            break
+    processor.process_response()
+    return processor.num_chars
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixture_dir')
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.fixture_dir, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+    if not pages:
+        raise ValueError(f"No .html fixtures in {args.fixture_dir}")
+
+    total_chars = sum(len(html) for html in pages)
+    read_chars = sum(parse_streaming(html, args.chunk_size) for html in pages)
+
+    start_time = time.perf_counter()
+    for _ in range(args.repeats):
+        for html in pages:
+            parse_whole(html)
+    whole_time = (time.perf_counter() - start_time) / (args.repeats * len(pages))
+
+    start_time = time.perf_counter()
+    for _ in range(args.repeats):
+        for html in pages:
+            parse_streaming(html, args.chunk_size)
+    streaming_time = (time.perf_counter() - start_time) / (args.repeats * len(pages))
+
+    print(f"{len(pages)} pages, {total_chars / len(pages) / 1e3:.0f}k chars on average")
+    print(f"whole page:  {whole_time * 1e3:.2f} ms/page, 100% of page transferred")
+    print(f"streaming:   {streaming_time * 1e3:.2f} ms/page, {100 * read_chars / total_chars:.0f}% of page transferred")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import time
+
+import numpy as np
+import polars as pl
+
+from relevance import ROMANIA_KEYWORDS, RelevanceClassifier
+
+# Compares the crawlers' old filter_romanian against RelevanceClassifier on a synthetic corpus of
+# descriptions with Romanian words, diacritics and a few keywords mixed in, e.g.
+#   python bench_relevance.py --rows 5000000
+
+WORDS = [
+    'si', 'la', 'de', 'pe', 'cu', 'în', 'românia', 'vot', 'fyp', 'foryou', 'viral', 'ziua', 'țara',
+    'oameni', 'mâine', 'astăzi', 'președinte', 'guvern', 'partid', 'muzica', 'dans', 'iubire',
+    'fotbal', 'vacanta', 'mare', 'munte', 'familie', 'prieteni', 'haha', 'tiktok',
+]
+KEYWORD_SPELLINGS = ['Georgescu', 'Lasconi', 'BUCUREȘTI', 'bucuresti', 'Iohannis', 'Șoșoacă', 'Şoşoacă', 'Ciolacu', 'Simion', 'Nicușor Dan', 'alegeri', 'Ponta']
+
+
+def synthetic_corpus(num_rows, words_per_desc=12, keyword_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(WORDS + KEYWORD_SPELLINGS)
+    # keywords are drawn keyword_rate of the time, the rest uniformly from the plain words
+    probabilities = np.concatenate([
+        np.full(len(WORDS), (1 - keyword_rate) / len(WORDS)),
+        np.full(len(KEYWORD_SPELLINGS), keyword_rate / len(KEYWORD_SPELLINGS)),
+    ])
+    tokens = vocabulary[rng.choice(len(vocabulary), size=(num_rows, words_per_desc), p=probabilities)]
+    df = pl.DataFrame({f"w{i}": tokens[:, i] for i in range(words_per_desc)})
+    subtitle = pl.struct(pl.lit('ron-RO').alias('LanguageCodeName'))
+    return df.select(
+        pl.concat_str(pl.all(), separator=' ').alias('desc'),
+        pl.Series('textLanguage', rng.choice(['ro', 'en', 'un', 'es'], size=num_rows, p=[0.3, 0.4, 0.2, 0.1])),
+        # one in seven videos has Romanian subtitles
+        pl.struct(
+            pl.when(pl.int_range(pl.len()) % 7 == 0).then(pl.concat_list(subtitle)).otherwise(pl.concat_list(subtitle).list.head(0)).alias('subtitleInfos')
+        ).alias('video'),
+    )
+
+
+def filter_romanian(df, keywords):
+    # the version the crawlers used, with its keyword list typo
+    df = df.with_columns(pl.col('video').struct.field('subtitleInfos').list.eval(pl.element().struct.field('LanguageCodeName')).alias('subtitleLanguages'))
+    df = df.with_columns(pl.sum_horizontal([pl.col('desc').str.to_lowercase().str.contains(k, literal=True) for k in keywords]).cast(pl.Int64).alias('keywordScore'))
+    return df.filter(
+        pl.col('desc').str.to_lowercase().str.contains_any(keywords)
+        | (pl.col('textLanguage') == 'ro')
+        | ((pl.col('subtitleLanguages').list.contains('ron-RO')) & (pl.col('subtitleLanguages').list.len() < 5))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    df = synthetic_corpus(args.rows)
+    old_keywords = [
+        'romania', 'bucharest', 'georgescu', 'lasconi', 'bucuresti', 'iohannis', 'hurezeanu', 'sosoaca', 'ciolacu'
+        'simion', 'nicusor dan', 'bolojan', 'crin antonescu', 'potra', 'ponta', 'mariustuca', 'alegeri'
+    ]
+    classifier = RelevanceClassifier(ROMANIA_KEYWORDS, use_language=True)
+
+    def timed(fn):
+        best = float('inf')
+        for _ in range(args.repeats):
+            start_time = time.perf_counter()
+            out = fn()
+            best = min(best, time.perf_counter() - start_time)
+        return out, best
+
+    old_df, old_time = timed(lambda: filter_romanian(df, old_keywords))
+    new_df, new_time = timed(lambda: classifier.filter(df))
+    annotated = classifier.annotate(df)
+    # the classifier run on only the newest 1% of rows, as the crawlers do with each fetch
+    new_rows = annotated.with_columns(
+        pl.when(pl.int_range(pl.len()) >= int(len(df) * 0.99)).then(None).otherwise(pl.col('keywordHits')).alias('keywordHits')
+    )
+    _, incremental_time = timed(lambda: classifier.annotate(new_rows))
+
+    print(f"{len(df):,} rows")
+    print(f"filter_romanian:      {old_time:.2f}s, {len(df) / old_time / 1e6:.2f}M rows/s, {len(old_df):,} relevant, {(old_df['keywordScore'] > 0).sum():,} with keywords")
+    print(f"RelevanceClassifier:  {new_time:.2f}s, {len(df) / new_time / 1e6:.2f}M rows/s, {len(new_df):,} relevant, {(new_df['keywordScore'] > 0).sum():,} with keywords")
+    print(f"incremental, 1% new:  {incremental_time:.2f}s")
+
+if __name__ == '__main__':
+    main()
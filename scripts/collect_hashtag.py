@@ -1,63 +1,65 @@
+import argparse
 import asyncio
-import datetime
-import json
-import os
+import logging
+import time
 
 import polars as pl
-from pytok.tiktok import PyTok
-from TikTokApi import TikTokApi
-from tqdm import tqdm
-
-from utils import concat
-
-class ApiWrapper:
-    def __init__(self, lib):
-        self.lib = lib
-        self.api = None
-
-    async def __aenter__(self):
-        if self.lib == 'pytok':
-            self.api = PyTok(manual_captcha_solves=True)
-            await self.api.__aenter__()
-        elif self.lib == 'tiktokapi':
-            self.api = TikTokApi()
-            await self.api.__aenter__()
-            await self.api.create_sessions(ms_tokens=[None], num_sessions=1, sleep_after=3, browser=os.getenv("TIKTOK_BROWSER", "chromium"))
-        return self
-    
-    async def get_hashtag_videos(self, hashtag_name):
-        hashtag = self.api.hashtag(name=hashtag_name)
-
-        videos = []
-        async for video in hashtag.videos(count=1000):
-            video_info = video.as_dict
-            videos.append(video_info)
-
-        return videos
-
-    async def __aexit__(self, exc_type, exc, tb):
-        await self.api.__aexit__(exc_type, exc, tb)
-
-async def main():
+
+from crawl import ApiWrapper, DeltaWriter, write_report
+from schema import VIDEO_SCHEMA
+from store import FragmentStore
+from watermarks import WatermarkStore
+
+logger = logging.getLogger(__name__)
+
+async def collect_hashtag(api, hashtag_name, watermarks, args):
+    # the old single file ./data/hashtag_<name>.parquet.zstd is read as part of the store
+    store = FragmentStore(f'./data/hashtag_{hashtag_name}', schema=VIDEO_SCHEMA)
+    watermark = watermarks.get('hashtag', hashtag_name)
+    if watermark is None and store.exists():
+        watermarks.seed('hashtag', store.scan(columns=['id', 'createTime']).select(
+            pl.lit(hashtag_name).alias('name'), 'createTime', 'id',
+        ).collect())
+        watermark = watermarks.get('hashtag', hashtag_name)
+    if args.full:
+        watermark = None
+
+    writer = DeltaWriter(store)
+    row = {'name': hashtag_name, 'videos': 0, 'new_videos': 0, 'seconds': 0.0, 'error': None}
+    try:
+        stats = await api.get_hashtag_videos(hashtag_name, writer, watermark=watermark, stop_after_known=args.stop_after_known)
+        watermarks.advance('hashtag', hashtag_name, [stats['newest']] if stats['newest'] else [])
+        row.update(videos=stats['videos'], seconds=stats['seconds'])
+    except Exception as e:
+        # the videos saved before the failure stay, the watermark doesn't move so they're checked again next time
+        logger.warning(f"Failed to collect #{hashtag_name}: {e}")
+        row['error'] = str(e)
+    finally:
+        store.close()
+    row['new_videos'] = writer.num_new
+    print(f'Saved {writer.num_new} new videos for #{hashtag_name}')
+    return row
+
+async def main(args):
     hashtags = ['romania', 'bucharest', 'georgescu', 'lasconi', 'bucuresti', 'iohannis', 'hurezeanu', 'sosoaca', 'ciolacu',\
                 'alegeriprezidențiale2025', 'alegeriprezidențiale2024', 'elenalasconi', 'diaconescu', 'dandiaconescu', 'mariustuca',\
                 'alegeriprezidențiale', 'alegeri', 'stiri', 'alegeri2025', 'romaniaelection', 'călingeorgescu'
         ]
     hashtags.reverse()
 
-    async with ApiWrapper('pytok') as api:
-        for hashtag_name in tqdm(hashtags):
-            videos = await api.get_hashtag_videos(hashtag_name)
-
-            df = pl.DataFrame(videos)
-            df = df.with_columns(pl.lit(datetime.datetime.today()).alias('scrape_date'))
-            file_path = f'./data/hashtag_{hashtag_name}.parquet.zstd'
-            print(f'Saving {len(df)} new videos to {file_path}')
-            if os.path.exists(file_path):
-                existing_df = pl.read_parquet(file_path)
-                df = concat(existing_df, df)
-            df = df.unique('id')
-            df.write_parquet(file_path, compression='zstd')
+    start_time = time.perf_counter()
+    watermarks = WatermarkStore()
+    # every hashtag is its own task, they take turns on the pool's sessions so a slow one only holds up its own
+    async with ApiWrapper('pytok', num_sessions=args.sessions, videos_per_min=args.videos_per_min, session_delay=args.session_delay) as api:
+        rows = await asyncio.gather(*[collect_hashtag(api, hashtag_name, watermarks, args) for hashtag_name in hashtags])
+    watermarks.close()
+    write_report('collect_hashtag', rows, time.perf_counter() - start_time)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--videos-per-min', type=float, default=None, help='budget shared by all sessions')
+    parser.add_argument('--session-delay', type=float, default=5.0, help='seconds between starting sessions')
+    parser.add_argument('--stop-after-known', type=int, default=100, help='stop paging a hashtag after this many videos in a row older than its watermark')
+    parser.add_argument('--full', action='store_true', help='ignore watermarks and page through every hashtag')
+    asyncio.run(main(parser.parse_args()))
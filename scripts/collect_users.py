@@ -1,55 +1,74 @@
+import argparse
 import asyncio
 import datetime
+import functools
 import json
-import os
 
 import polars as pl
-from pytok.tiktok import PyTok
 from tqdm import tqdm
 
-hashtag_name = 'romania'
+from crawl import CrawlEngine, fetch_author_timeline, pytok_session
+from loader import load_hashtag_videos
+from schema import USER_SCHEMA, VIDEO_SCHEMA, normalize
+from store import FragmentStore
+from watermarks import WatermarkStore
 
-async def main():
-    hashtag_df = pl.DataFrame()
-    for filename in os.listdir('./data'):
-        if filename.endswith('.parquet.zstd') and filename.startswith('hashtag_'):
-            hashtag_df = pl.concat([hashtag_df, pl.read_parquet(f'./data/{filename}')], how='diagonal_relaxed')
+hashtag_name = 'romania'
 
-    hashtag_df = hashtag_df.with_columns(pl.col('author').struct.field('uniqueId').alias('author_id'))
+async def main(args):
+    hashtag_df = load_hashtag_videos(columns=[pl.col('author').struct.field('uniqueId').alias('author_id')])
     author_df = hashtag_df.unique('author_id').sort('author_id').drop_nulls('author_id')
 
-    video_path = f'./data/user_videos.parquet.zstd'
-    user_path = f'./data/users.parquet.zstd'
-    if os.path.exists(video_path):
-        video_df = pl.read_parquet(video_path)
-        user_df = pl.read_parquet(user_path)
-        author_df = author_df.filter(~pl.col('author_id').is_in(user_df['uniqueId']))
-    else:
-        video_df = pl.DataFrame()
-        user_df = pl.DataFrame()
-
-    pbar = tqdm(total=len(author_df))
-    async with PyTok(manual_captcha_solves=True) as api:
-        for author in author_df['author_id'].to_list():
-            user = api.user(username=author)
-            user_info = await user.info()
-
-            videos = []
-            async for video in user.videos(count=1000):
-                video_info = await video.info()
-                create_date = datetime.datetime.fromtimestamp(video_info['createTime'])
-                if create_date < datetime.datetime(2024, 1, 1):
-                    break
-                videos.append(video_info)
-
-            try:
-                video_df = pl.concat([video_df, pl.DataFrame(videos)], how='diagonal_relaxed')
-            except (pl.exceptions.SchemaError, pl.exceptions.PanicException):
-                video_df = pl.DataFrame(video_df.to_dicts() + videos, infer_schema_length=len(video_df) + len(videos))
-            user_df = pl.concat([user_df, pl.DataFrame([user_info])], how='diagonal_relaxed')
-            pbar.update(1)
-            video_df.write_parquet(video_path, compression='zstd')
-            user_df.write_parquet(user_path, compression='zstd')
+    # the old single files ./data/user_videos.parquet.zstd and ./data/users.parquet.zstd are still read
+    video_store = FragmentStore('./data/user_videos', schema=VIDEO_SCHEMA)
+    user_store = FragmentStore('./data/users', schema=USER_SCHEMA, unique_key='uniqueId')
+
+    # authors are re-crawled for their new videos only, from the newest one saved for them
+    watermarks = WatermarkStore()
+    if not watermarks.all('author') and video_store.exists():
+        num_seeded = watermarks.seed('author', video_store.scan(columns=['id', 'createTime', 'author']).select(
+            pl.col('author').struct.field('uniqueId').alias('name'), 'createTime', 'id',
+        ).collect())
+        print(f"Seeded watermarks for {num_seeded} authors from saved videos")
+    author_ids = watermarks.due('author', author_df['author_id'].to_list(), datetime.timedelta(hours=args.refresh_hours))
+    known = {} if args.full else watermarks.all('author')
+
+    since = datetime.datetime.fromisoformat(args.since) if args.since else None
+    num_videos = 0
+    pbar = tqdm(total=len(author_ids))
+
+    def on_result(item, result):
+        nonlocal num_videos
+        user_info, videos = result
+        # each author is appended as it finishes, nothing already written is rewritten
+        video_store.append(normalize(videos))
+        user_store.append(normalize([user_info], schema=USER_SCHEMA))
+        watermarks.advance('author', item['author_id'], videos)
+        num_videos += len(videos)
+        pbar.update(1)
+        pbar.set_postfix(videos=num_videos, authors_per_min=f"{engine.throughput():.1f}")
+
+    # every session works through its own author at a time, so authors per minute grows with --sessions
+    engine = CrawlEngine(
+        functools.partial(fetch_author_timeline, since=since, max_videos=args.max_videos),
+        on_result,
+        session_factory=functools.partial(pytok_session, manual_captcha_solves=args.manual_captcha_solves, headless=not args.manual_captcha_solves),
+        num_sessions=args.sessions,
+        videos_per_min=args.authors_per_min,
+        session_delay=args.session_delay,
+    )
+    await engine.run({'author_id': author_id, 'watermark': known.get(author_id)} for author_id in author_ids)
+    pbar.close()
+    watermarks.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--authors-per-min', type=float, default=None)
+    parser.add_argument('--session-delay', type=float, default=1.0)
+    parser.add_argument('--since', default='2024-01-01', help='stop listing an author at videos created before this date')
+    parser.add_argument('--refresh-hours', type=float, default=24, help='skip authors crawled more recently than this')
+    parser.add_argument('--full', action='store_true', help='ignore watermarks and page back to --since')
+    parser.add_argument('--max-videos', type=int, default=1000)
+    parser.add_argument('--manual-captcha-solves', action='store_true', help='open visible browsers to solve captchas by hand')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import time
+
+import polars as pl
+
+from frontier import PriorityFrontier
+from scheduler import POLICIES, CrawlMetrics, summarize_metrics
+from schema import VIDEO_SCHEMA, normalize
+from store import FragmentStore
+from utils import RateLimiter, concat
+from watermarks import is_known, video_key
+
+logger = logging.getLogger(__name__)
+
+
+def pytok_session(**kwargs):
+    from pytok.tiktok import PyTok
+    return PyTok(**{'manual_captcha_solves': False, 'headless': True, **kwargs})
+
+
+async def fetch_related(api, item):
+    video = api.video(username=item['author_id'], id=item['id'])
+    video_info = await video.info()
+    video_info['scrape_date'] = datetime.datetime.today()
+    related_videos = []
+    async for related_info in video.related_videos():
+        related_info['scrape_date'] = datetime.datetime.today()
+        related_videos.append(related_info)
+    return video_info, related_videos
+
+
+# fields a user's video listing has to carry for the video page not to be fetched as well
+LISTING_FIELDS = ['id', 'desc', 'createTime', 'author', 'stats', 'video']
+
+
+async def fetch_author_timeline(api, item, since=None, max_videos=1000, required_fields=LISTING_FIELDS):
+    # the listing already has most of each video's fields, so the video page is only fetched when
+    # some are missing. Videos come newest first and the listing stops at the first one created
+    # before since, or already seen by the crawl that left item['watermark'], except for pinned
+    # videos, which sit at the top whatever their age
+    watermark = item.get('watermark')
+    user = api.user(username=item['author_id'])
+    user_info = await user.info()
+    scrape_date = datetime.datetime.today()
+    videos = []
+    async for video in user.videos(count=max_videos):
+        video_info = getattr(video, 'as_dict', None) or {}
+        pinned = video_info.get('isPinnedItem')
+        if video_info.get('createTime') is None:
+            video_info = await video.info()
+        create_time = video_info.get('createTime')
+        too_old = since is not None and create_time is not None and datetime.datetime.fromtimestamp(int(create_time)) < since
+        if too_old or is_known(watermark, video_info):
+            if pinned:
+                continue
+            break
+        if any(video_info.get(field) is None for field in required_fields):
+            video_info = await video.info()
+        video_info['scrape_date'] = scrape_date
+        videos.append(video_info)
+    return user_info, videos
+
+
+class CrawlEngine:
+    # N long-lived sessions pull items from a shared frontier queue. fetch(api, item) does the
+    # network work and on_result(item, result) records it, and may put newly discovered items.
+    # Anything with an async context manager session and a matching fetch can be crawled, so a
+    # local fake server works as well as TikTok. A failed item is put back for another session up to
+    # max_retries times before on_error gives up on it, it may only have failed because its session broke.
+    def __init__(
+            self,
+            fetch,
+            on_result,
+            session_factory=pytok_session,
+            num_sessions=4,
+            videos_per_min=None,
+            session_delay=0.0,
+            max_failures=3,
+            max_retries=2,
+            restart_delay=5.0,
+            frontier=None,
+        ):
+        self.fetch = fetch
+        self.on_result = on_result
+        self.session_factory = session_factory
+        self.num_sessions = num_sessions
+        self.max_failures = max_failures
+        self.max_retries = max_retries
+        self.restart_delay = restart_delay
+        self.session_delay = session_delay
+        self.rate_limiter = RateLimiter(per_minute=videos_per_min)
+        self.frontier = frontier if frontier is not None else asyncio.Queue()
+        self.num_fetched = 0
+        self.num_failed = 0
+        self.num_retries = 0
+        self.num_restarts = 0
+        self.start_time = None
+        self._retries = {}
+
+    def put(self, item):
+        self.frontier.put_nowait(item)
+
+    def on_error(self, item, e):
+        logger.warning(f"Failed to fetch {item}: {e}")
+
+    def throughput(self):
+        if self.start_time is None:
+            return 0.0
+        return self.num_fetched / max(time.monotonic() - self.start_time, 1e-9) * 60
+
+    async def _process(self, api, session_limiter):
+        item = await self.frontier.get()
+        key = item['id'] if isinstance(item, dict) else item
+        try:
+            await self.rate_limiter.wait()
+            await session_limiter.wait()
+            result = await self.fetch(api, item)
+            self.num_fetched += 1
+            self._retries.pop(key, None)
+            self.on_result(item, result)
+            return True
+        except Exception as e:
+            retries = self._retries.get(key, 0)
+            if retries < self.max_retries:
+                # items are already in the frontier's seen index, so they go back on the queue directly
+                self._retries[key] = retries + 1
+                self.num_retries += 1
+                self.frontier.put_nowait(item)
+            else:
+                self._retries.pop(key, None)
+                self.num_failed += 1
+                self.on_error(item, e)
+            return False
+        finally:
+            # a Frontier keeps fetched items in flight until here, so a checkpoint doesn't drop them
+            finish = getattr(self.frontier, 'finish', None)
+            if finish is not None:
+                finish(item)
+            self.frontier.task_done()
+
+    async def _session_worker(self, worker_id):
+        session_limiter = RateLimiter(min_interval=self.session_delay)
+        while True:
+            try:
+                async with self.session_factory() as api:
+                    failures = 0
+                    # a session that keeps failing is most likely blocked or crashed, so replace it
+                    while failures < self.max_failures:
+                        if await self._process(api, session_limiter):
+                            failures = 0
+                        else:
+                            failures += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Session {worker_id} failed: {e}")
+            self.num_restarts += 1
+            logger.info(f"Restarting session {worker_id}")
+            await asyncio.sleep(self.restart_delay)
+
+    async def run(self, items=()):
+        for item in items:
+            self.put(item)
+        self.start_time = time.monotonic()
+        workers = [asyncio.create_task(self._session_worker(i)) for i in range(self.num_sessions)]
+        try:
+            await self.frontier.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logger.info(f"Fetched {self.num_fetched} videos ({self.num_failed} failed, {self.num_retries} retries, {self.num_restarts} session restarts) at {self.throughput():.1f} videos/min")
+
+
+class ApiWrapper:
+    # A pool of num_sessions sessions of lib ('pytok' or 'tiktokapi') shared by concurrent listings,
+    # e.g. one task per hashtag. A listing borrows a session until it's done paging, and every video
+    # of every listing draws on the one videos_per_min budget of the pool. Like CrawlEngine's, a session
+    # a listing failed on is closed, and a new one is opened for the next listing that needs it.
+    def __init__(self, lib='pytok', num_sessions=1, videos_per_min=None, session_delay=0.0, manual_captcha_solves=True, restart_delay=5.0):
+        self.lib = lib
+        self.num_sessions = num_sessions
+        self.session_delay = session_delay
+        self.manual_captcha_solves = manual_captcha_solves
+        self.restart_delay = restart_delay
+        self.rate_limiter = RateLimiter(per_minute=videos_per_min)
+        self.apis = []
+        self.num_restarts = 0
+        self._pool = asyncio.Queue()
+
+    async def _open_session(self):
+        if self.lib == 'pytok':
+            api = pytok_session(manual_captcha_solves=self.manual_captcha_solves, headless=not self.manual_captcha_solves)
+            await api.__aenter__()
+        elif self.lib == 'tiktokapi':
+            from TikTokApi import TikTokApi
+            api = TikTokApi()
+            await api.__aenter__()
+            await api.create_sessions(ms_tokens=[None], num_sessions=1, sleep_after=3, browser=os.getenv("TIKTOK_BROWSER", "chromium"))
+        return api
+
+    async def __aenter__(self):
+        for i in range(self.num_sessions):
+            # browsers are started one after the other, a burst of new sessions is more likely to get a captcha
+            if i > 0:
+                await asyncio.sleep(self.session_delay)
+            api = await self._open_session()
+            self.apis.append(api)
+            self._pool.put_nowait(api)
+        return self
+
+    async def _close_session(self, api, exc):
+        self.apis.remove(api)
+        try:
+            await api.__aexit__(type(exc), exc, exc.__traceback__)
+        except Exception as e:
+            logger.warning(f"Failed to close session: {e}")
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        # None in the pool stands for a session that was closed and not reopened yet
+        api = await self._pool.get()
+        try:
+            if api is None:
+                await asyncio.sleep(self.restart_delay)
+                self.num_restarts += 1
+                logger.info("Restarting session")
+                api = await self._open_session()
+                self.apis.append(api)
+            yield api
+        except Exception as e:
+            if api is not None:
+                await self._close_session(api, e)
+            api = None
+            raise
+        finally:
+            self._pool.put_nowait(api)
+
+    async def _collect(self, videos, on_batch, watermark=None, stop_after_known=None, batch_size=100, full_info=False):
+        # hands videos to on_batch batch_size at a time, so they're saved while the listing goes on
+        start_time = time.perf_counter()
+        batch = []
+        num_videos = 0
+        num_known = 0
+        newest = None
+        async for video in videos:
+            await self.rate_limiter.wait()
+            video_info = await video.info() if full_info else video.as_dict
+            batch.append(video_info)
+            num_videos += 1
+            if video_info.get('createTime') is not None and (newest is None or video_key(video_info) > video_key(newest)):
+                newest = video_info
+            if len(batch) >= batch_size:
+                on_batch(batch)
+                batch = []
+            # listings that aren't in creation order only stop after a run of videos that are all no
+            # newer than the last crawl's newest
+            num_known = num_known + 1 if is_known(watermark, video_info) else 0
+            if stop_after_known and num_known >= stop_after_known:
+                break
+        if batch:
+            on_batch(batch)
+        return {'videos': num_videos, 'seconds': time.perf_counter() - start_time, 'newest': newest}
+
+    async def get_hashtag_videos(self, hashtag_name, on_batch, watermark=None, stop_after_known=None, batch_size=100):
+        async with self.session() as api:
+            hashtag = api.hashtag(name=hashtag_name)
+            return await self._collect(hashtag.videos(count=1000), on_batch, watermark=watermark, stop_after_known=stop_after_known, batch_size=batch_size)
+
+    async def get_search_videos(self, term, on_batch, batch_size=100):
+        # search results only carry part of each video, so every video's page is fetched as well
+        async with self.session() as api:
+            search = api.search(term)
+            return await self._collect(search.videos(count=1000), on_batch, batch_size=batch_size, full_info=True)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for api in self.apis:
+            await api.__aexit__(exc_type, exc, tb)
+
+
+class DeltaWriter:
+    # on_batch for ApiWrapper listings, appends the videos store doesn't have yet as new fragments.
+    # Only the store's ids are read, once, to tell them apart
+    def __init__(self, store):
+        self.store = store
+        self.seen = set(store.read(columns=['id'])['id'].to_list()) if store.exists() else set()
+        self.num_new = 0
+
+    def __call__(self, videos):
+        df = normalize(videos)\
+            .with_columns(pl.lit(datetime.datetime.today()).alias('scrape_date'))\
+            .unique('id', keep='last', maintain_order=True)
+        df = df.filter(~pl.col('id').is_in(list(self.seen)))
+        self.seen.update(df['id'].to_list())
+        self.store.append(df)
+        self.num_new += len(df)
+
+
+def write_report(name, rows, wall_seconds, report_dir='./data/reports'):
+    # rows have the listing's name, videos fetched, new_videos saved and the seconds it held a session for
+    report_df = pl.DataFrame(rows, schema={'name': pl.String, 'videos': pl.Int64, 'new_videos': pl.Int64, 'seconds': pl.Float64, 'error': pl.String})\
+        .with_columns((pl.col('videos') / pl.col('seconds')).round(2).alias('videos_per_sec'))\
+        .sort('seconds', descending=True)
+    total_videos = report_df['videos'].sum()
+    with pl.Config(tbl_rows=-1):
+        print(report_df)
+    print(f"{total_videos} videos ({report_df['new_videos'].sum()} new) in {wall_seconds:.1f}s, {total_videos / max(wall_seconds, 1e-9):.2f} videos/sec overall")
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f"{name}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump({'wall_seconds': wall_seconds, 'videos': total_videos, 'listings': report_df.to_dicts()}, f, indent=2)
+    return report_df
+
+
+# columns of the hashtag and related videos the related crawl ranks and filters seeds on
+SEED_COLUMNS = ['id', 'desc', 'author', 'stats', 'video', 'textLanguage']
+
+
+def related_items(df, depth):
+    return df.select(
+        pl.col('author').struct.field('uniqueId').alias('author_id'),
+        pl.col('id'),
+        pl.lit(depth).alias('depth'),
+        pl.col('keywordScore').alias('keyword_score'),
+        pl.col('stats').struct.field('playCount').alias('play_count'),
+    ).to_dicts()
+
+
+def related_crawl_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--videos-per-min', type=float, default=None)
+    parser.add_argument('--session-delay', type=float, default=1.0)
+    parser.add_argument('--checkpoint-every', type=int, default=10)
+    parser.add_argument('--policy', choices=list(POLICIES), default='weighted')
+    return parser
+
+
+def related_frontier(frontier_path, policy, video_store, related_store, hashtag_df, relevance):
+    if os.path.exists(frontier_path):
+        frontier = PriorityFrontier.load(frontier_path, policy=policy)
+    else:
+        # first run with a frontier index, so build it from what the stores already hold
+        frontier = PriorityFrontier(policy)
+        if video_store.exists():
+            frontier.seen.update(video_store.read(columns=['id'])['id'].to_list())
+
+    # related videos are stored before they're queued, so the ones stored after the last checkpoint
+    # aren't in its seen index, and are queued again with the seeds
+    seed_df = hashtag_df
+    if related_store.exists():
+        unseen = frontier.seen.unseen(related_store.read(columns=['id'])['id'].to_list())
+        if unseen:
+            seed_df = concat(seed_df, related_store.scan(columns=SEED_COLUMNS).filter(pl.col('id').is_in(unseen)).collect())
+
+    # seeds are filtered once here, discovered videos once when they are found
+    seed_df = relevance.filter(seed_df)
+    for item in related_items(seed_df, depth=0):
+        frontier.push(item)
+    return frontier
+
+
+async def crawl_related(crawler, hashtag_df, relevance, video_path, related_path, frontier_path, args, metrics_path='./data/crawl_discovery.jsonl'):
+    # Follows the related videos of the relevant videos in hashtag_df. The relevant fetched videos are
+    # appended to the store at video_path, the relevant related ones to the store at related_path, and
+    # the frontier is checkpointed to frontier_path.
+    video_store = FragmentStore(video_path, schema=VIDEO_SCHEMA)
+    related_store = FragmentStore(related_path, schema=VIDEO_SCHEMA)
+    policy = POLICIES[args.policy]()
+    metrics = CrawlMetrics(crawler, policy.name, metrics_path)
+    frontier = related_frontier(frontier_path, policy, video_store, related_store, hashtag_df, relevance)
+
+    from tqdm import tqdm
+    num_videos = 0
+    num_related = 0
+    pbar = tqdm()
+
+    def on_result(item, result):
+        nonlocal num_videos, num_related
+        video_info, related_videos = result
+
+        # filter to only videos and related videos that contain keywords in the description
+        new_video_df = relevance.filter(normalize([video_info]))
+        # only this step's new rows are written, the stores are never rewritten
+        video_store.append(new_video_df)
+        num_videos += len(new_video_df)
+
+        related_videos = [v for v in related_videos if v['id'] not in frontier.seen]
+        num_discovered = 0
+        if related_videos:
+            new_related_df = relevance.filter(normalize(related_videos))
+            related_store.append(new_related_df)
+            num_related += len(new_related_df)
+            for related_item in related_items(new_related_df, depth=item.get('depth', 0) + 1):
+                num_discovered += frontier.push(related_item)
+            # the ones that failed the filter are seen too, so they aren't filtered again when they come back
+            for v in related_videos:
+                frontier.seen.add(v['id'])
+        metrics.record(num_discovered)
+
+        pbar.update(1)
+        if engine.num_fetched % args.checkpoint_every == 0:
+            frontier.save(frontier_path)
+        print(f"Number videos: {num_videos}, Number related videos: {num_related}, Number to fetch: {frontier.qsize()}, Videos/min: {engine.throughput():.1f}, New relevant per 100 fetches: {metrics.discovered_per_100():.1f}")
+
+    engine = CrawlEngine(
+        fetch_related,
+        on_result,
+        num_sessions=args.sessions,
+        videos_per_min=args.videos_per_min,
+        session_delay=args.session_delay,
+        frontier=frontier,
+    )
+    try:
+        await engine.run()
+    finally:
+        frontier.save(frontier_path)
+        metrics.close()
+    if os.path.exists(metrics_path):
+        print(summarize_metrics(metrics_path, crawler=crawler))
@@ -1,19 +1,33 @@
+import argparse
 import asyncio
 import datetime
+import hashlib
 import json
 import logging
 import os
 import re
+import time
 import traceback
 
 import boto3
 import dotenv
+import httpx
 import hydra
 import requests
 import tqdm
 
 import polars as pl
 
+try:
+    import orjson as fast_json
+except ImportError:
+    fast_json = json
+
+from manifest import DownloadManifest
+from schema import VIDEO_SCHEMA
+from store import FragmentStore
+from utils import RateLimiter
+
 logger = logging.getLogger(__name__)
 
 def get_video_data(token, endpoint, start_date_str, end_date_str):
@@ -85,30 +99,45 @@ class ProcessVideo:
         self.json_start_len = len(self.json_start)
         self.end = -1
         self.json_end = ',"webapp.a-b":'
+        # before the start marker only a marker-length window is kept, after it the JSON is
+        # collected as parts, with the last few chars held back in case the end marker straddles chunks
+        self.window = ""
+        self.parts = []
+        self.tail = ""
+        self.num_chars = 0
     
     def process_chunk(self, text_chunk):
-        self.text += text_chunk
-        if len(self.text) < self.json_start_len:
-            return 'continue'
+        self.num_chars += len(text_chunk)
         if self.start == -1:
-            self.start = self.text.find(self.json_start)
-            if self.start != -1:
-                self.text = self.text[self.start + self.json_start_len:]
-                self.start = 0
-        if self.start != -1:
-            self.end = self.text.find(self.json_end)
-            if self.end != -1:
-                self.text = self.text[:self.end]
-                return 'break'
+            window = self.window + text_chunk
+            start = window.find(self.json_start)
+            if start == -1:
+                self.window = window[-(self.json_start_len - 1):]
+                return 'continue'
+            self.start = self.num_chars - len(window) + start
+            self.window = ""
+            text_chunk = window[start + self.json_start_len:]
+        window = self.tail + text_chunk
+        end = window.find(self.json_end)
+        if end != -1:
+            self.parts.append(window[:end])
+            self.text = "".join(self.parts)
+            self.end = self.start + self.json_start_len + len(self.text)
+            return 'break'
+        keep = len(self.json_end) - 1
+        if len(window) > keep:
+            self.parts.append(window[:-keep])
+            window = window[-keep:]
+        self.tail = window
         return 'continue'
             
     def process_response(self):
         if self.start == -1 or self.end == -1:
             raise InvalidResponseException(
                 "Could not find normal JSON section in returned HTML.",
-                json.dumps({'text': self.text, 'encoding': self.r.encoding}),
+                json.dumps({'text': self.window or "".join(self.parts) + self.tail, 'encoding': self.r.encoding}),
             )
-        video_detail = json.loads(self.text)
+        video_detail = fast_json.loads(self.text)
         if video_detail.get("statusCode", 0) != 0: # assume 0 if not present
             # TODO retry when status indicates server error
             return video_detail
@@ -119,115 +148,221 @@ class ProcessVideo:
             )
         return video_info
 
-async def pytok_bytes(videos, logger, headless, request_delay):
-    video_bytes = {}
-    for video_data in videos:
-        try:
-            video_id = video_data['id']
-            url = f"https://www.tiktok.com/@{video_data['author']['uniqueId']}/video/{video_id}"
-            headers = get_headers()
-            
-            info_res = requests.get(url, headers=headers)
-            video_processor = ProcessVideo(info_res)
-            text_chunk = info_res.text
-            do = video_processor.process_chunk(text_chunk)
-
-            bytes_headers = {
-                'sec-ch-ua': '"HeadlessChrome";v="123", "Not:A-Brand";v="8", "Chromium";v="123"', 
-                'referer': 'https://www.tiktok.com/', 
-                'accept-encoding': 'identity;q=1, *;q=0', 
-                'sec-ch-ua-mobile': '?0', 
-                'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.6312.4 Safari/537.36', 
-                'range': 'bytes=0-', 
-                'sec-ch-ua-platform': '"Windows"'
-            }
+def get_bytes_headers():
+    bytes_headers = {
+        'sec-ch-ua': '"HeadlessChrome";v="123", "Not:A-Brand";v="8", "Chromium";v="123"', 
+        'referer': 'https://www.tiktok.com/', 
+        'accept-encoding': 'identity;q=1, *;q=0', 
+        'sec-ch-ua-mobile': '?0', 
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.6312.4 Safari/537.36', 
+        'range': 'bytes=0-', 
+        'sec-ch-ua-platform': '"Windows"'
+    }
+    return bytes_headers
 
-            video_d = video_processor.process_response()
+def parse_content_range(content_range):
+    # 'bytes 100-199/1000' -> (100, 199, 1000), 'bytes */1000' -> (None, None, 1000)
+    if not content_range:
+        return None
+    match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)', content_range)
+    if match is None or match.group(3) == '*':
+        return None
+    start, end, total = match.groups()
+    return (int(start) if start else None, int(end) if end else None, int(total))
 
-            if 'video' not in video_d:
-                continue
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
 
-            cookies = {c.name: c.value for c in info_res.cookies}
-            bytes_res = requests.get(video_d['video']['downloadAddr'], headers=bytes_headers, cookies=cookies)
-            if 200 <= bytes_res.status_code < 300:
-                video_bytes[video_data['id']] = bytes_res.content
-        except:
-            continue
+class HostRateLimiter:
+    # one RateLimiter per host, so page fetches and CDN fetches are paced independently
+    def __init__(self, request_delay):
+        self.request_delay = request_delay
+        self.limiters = {}
 
-    return video_bytes
+    async def wait(self, url):
+        host = httpx.URL(url).host
+        if host not in self.limiters:
+            self.limiters[host] = RateLimiter(min_interval=self.request_delay)
+        await self.limiters[host].wait()
 
 class VideoBytesScraper:
-    def __init__(self, logger, data_dir_path, headless=True, request_delay=3):
+    def __init__(self, logger, data_dir_path, manifest, concurrency=8, request_delay=1, chunk_size=1 << 16):
         self.logger = logger
-        self.headless = headless
         self.data_dir_path = data_dir_path
-        self.request_delay = request_delay
+        self.manifest = manifest
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.rate_limiter = HostRateLimiter(request_delay)
+        self.num_saved = 0
+        self.num_bytes = 0
 
-    async def get_video_bytes_batch(self, videos):
-        
+    async def get_video_info(self, client, video_data):
+        url = f"https://www.tiktok.com/@{video_data['author']['uniqueId']}/video/{video_data['id']}"
+        await self.rate_limiter.wait(url)
+        async with client.stream('GET', url, headers=get_headers()) as info_res:
+            video_processor = ProcessVideo(info_res)
+            async for text_chunk in info_res.aiter_text():
+                if video_processor.process_chunk(text_chunk) == 'break':
+                    # leaving the stream early closes the connection, the rest of the page is never sent
+                    break
+        return video_processor.process_response()
+
+    async def _fetch_bytes(self, client, video_id, download_addr, tmp_path, offset, resume):
+        # returns ('done', total_bytes), ('restart', None) when the .part file can't be continued, or ('failed', None)
+        bytes_headers = get_bytes_headers()
+        bytes_headers['range'] = f"bytes={offset}-"
+        if resume is not None and resume['etag']:
+            # the range is only honoured if the object is still the one the .part file came from,
+            # downloadAddr is signed again on every page fetch and can point at another encode
+            bytes_headers['if-range'] = resume['etag']
+        await self.rate_limiter.wait(download_addr)
+        async with client.stream('GET', download_addr, headers=bytes_headers) as bytes_res:
+            content_range = parse_content_range(bytes_res.headers.get('content-range'))
+            etag = bytes_res.headers.get('etag')
+            if bytes_res.status_code == 416 and offset:
+                if content_range and content_range[2] == offset == resume['total_bytes']:
+                    return 'done', offset
+                return 'restart', None
+            if not 200 <= bytes_res.status_code < 300:
+                self.manifest.mark_failed(video_id, offset)
+                return 'failed', None
+            if bytes_res.status_code == 206:
+                # the body has to start where the .part file ends, and be part of an object the same size
+                if content_range is None or content_range[0] != offset:
+                    return 'restart', None
+                if resume is not None and content_range[2] != resume['total_bytes']:
+                    return 'restart', None
+                total_bytes = content_range[2]
+                if offset:
+                    self.manifest.mark_partial(video_id, offset, total_bytes, etag)
+                else:
+                    self.manifest.mark_started(video_id, total_bytes, etag)
+            else:
+                # a 200 is the whole object, either the range was ignored or If-Range didn't match
+                offset = 0
+                total_bytes = int(bytes_res.headers['content-length']) if 'content-length' in bytes_res.headers else None
+                self.manifest.mark_started(video_id, total_bytes, etag)
+            # the body goes to disk a chunk at a time, so memory stays flat whatever the video size
+            with open(tmp_path, 'ab' if offset else 'wb') as f:
+                async for chunk in bytes_res.aiter_bytes(self.chunk_size):
+                    f.write(chunk)
+                    self.num_bytes += len(chunk)
+        return 'done', total_bytes
+
+    async def save_video_bytes(self, client, video_id, download_addr):
+        bytes_file_path = os.path.join(self.data_dir_path, f"{video_id}.mp4")
+        tmp_path = f"{bytes_file_path}.part"
+        # whatever a previous attempt left on disk is kept, and only the rest is requested, as long as
+        # the manifest knows the size of the object it is part of
+        offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+        resume = self.manifest.get(video_id) if offset else None
+        if resume is None or resume['total_bytes'] is None or offset > resume['total_bytes']:
+            offset, resume = 0, None
         try:
-            # if self.lib == 'tiktokapi':
-            #     video_bytes = await tiktokapi_bytes(videos, self.logger, self.request_delay)
-            # elif self.lib == 'pytok':
-            video_bytes = await pytok_bytes(videos, self.logger, self.headless, self.request_delay)
-
-        except Exception as e:
-            self.logger.error(f"Error getting batch: {e}")
-            self.logger.error(f"Trackback: {traceback.format_exc()}")
-
-        return video_bytes
-
-    def save_data(self, data):
-        video_bytes = data
-        for video_id, byte_data in video_bytes.items():
-            bytes_file = f"{video_id}.mp4"
-            bytes_file_path = os.path.join(self.data_dir_path, bytes_file)
-            with open(bytes_file_path, 'wb') as f:
-                f.write(byte_data)
+            status, total_bytes = await self._fetch_bytes(client, video_id, download_addr, tmp_path, offset, resume)
+            if status == 'restart':
+                # nothing of the response was written, the download starts over without a range
+                status, total_bytes = await self._fetch_bytes(client, video_id, download_addr, tmp_path, 0, None)
+                if status == 'restart':
+                    self.manifest.mark_failed(video_id, 0)
+                    return False
+            if status == 'failed':
+                return False
+        except Exception:
+            self.manifest.mark_partial(video_id, os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0)
+            raise
+
+        size = os.path.getsize(tmp_path)
+        if total_bytes is not None and size != total_bytes:
+            self.manifest.mark_partial(video_id, size, total_bytes)
+            return False
+        # only complete files ever get the .mp4 name
+        os.replace(tmp_path, bytes_file_path)
+        self.manifest.mark_complete(video_id, size, await asyncio.to_thread(file_sha256, bytes_file_path))
+        return True
+
+    async def download(self, client, video_data):
+        video_d = await self.get_video_info(client, video_data)
+        if 'video' not in video_d:
+            return False
+        return await self.save_video_bytes(client, video_data['id'], video_d['video']['downloadAddr'])
+
+    async def _worker(self, queue, pbar):
+        # each worker has its own client, so its cookie jar only ever holds what TikTok set on the page
+        # fetch of the video it's downloading, and the byte fetch sends those. With one shared client
+        # the page fetches in flight would overwrite each other's tt_chain_token
+        async with httpx.AsyncClient(follow_redirects=True, timeout=60) as client:
+            while True:
+                video_data = await queue.get()
+                try:
+                    client.cookies.clear()
+                    if await self.download(client, video_data):
+                        self.num_saved += 1
+                except Exception as e:
+                    self.logger.error(f"Error getting video {video_data['id']}: {e}")
+                    self.logger.debug(f"Traceback: {traceback.format_exc()}")
+                finally:
+                    pbar.update(1)
+                    queue.task_done()
+
+    async def run(self, videos):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        pbar = tqdm.tqdm(desc="Getting video bytes")
+        workers = [asyncio.create_task(self._worker(queue, pbar)) for _ in range(self.concurrency)]
+        for video_data in videos:
+            await queue.put(video_data)
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        pbar.close()
     
 
-async def get_tiktok_video_bytes():
+async def get_tiktok_video_bytes(concurrency, request_delay):
     data_dir_path = './data/mp4s'
     os.makedirs(data_dir_path, exist_ok=True)
-    headless = True
-    request_delay = 1
-    batch_delay = 1
 
+    manifest = DownloadManifest(os.path.join(data_dir_path, 'manifest.sqlite'))
     scraper = VideoBytesScraper(
         logger, 
         data_dir_path, 
-        headless=headless,
+        manifest,
+        concurrency=concurrency,
         request_delay=request_delay
     )
 
-    saved_video_ids = os.listdir(data_dir_path)
+    # files downloaded before there was a manifest count as complete
+    saved_video_ids = manifest.completed_ids()
+    for file_name in os.listdir(data_dir_path):
+        video_id = file_name.removesuffix('.mp4')
+        if file_name.endswith('.mp4') and video_id not in saved_video_ids:
+            manifest.mark_complete(video_id, os.path.getsize(os.path.join(data_dir_path, file_name)), None)
+            saved_video_ids.add(video_id)
 
     logger.info("Getting video df")
-    video_path = f'./data/fetched_election_videos.parquet.zstd'
-    video_df = pl.read_parquet(video_path)
+    video_df = FragmentStore('./data/fetched_election_videos', schema=VIDEO_SCHEMA).scan().unique('id').collect()
 
     # scrape video bytes
 
     logger.info("Starting video bytes scrape")
-    pbar = tqdm.tqdm(desc="Getting video bytes")
-    for video_data in video_df.to_dicts():
-        pbar.update(1)
-        if video_data['id'] in saved_video_ids:
-            continue
-        try:
-            data = await scraper.get_video_bytes_batch([video_data])
-            # waiting to ensure the data is saved before moving on
-            scraper.save_data(data)
-        except Exception:
-            continue
-
-        # sleep to avoid rate limiting
-        await asyncio.sleep(batch_delay)
-
-    pbar.close()
+    start_time = time.monotonic()
+    videos = (video_data for video_data in video_df.iter_rows(named=True) if video_data['id'] not in saved_video_ids)
+    await scraper.run(videos)
+    manifest.close()
+    elapsed = time.monotonic() - start_time
+    logger.info(f"Saved {scraper.num_saved} videos ({scraper.num_bytes / 1e6:.1f} MB) in {elapsed:.0f}s")
 
 def main():
-    asyncio.run(get_tiktok_video_bytes())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--request-delay', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(get_tiktok_video_bytes(args.concurrency, args.request_delay))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import os
+
+import numpy as np
+import polars as pl
+
+
+class SeenIndex:
+    # video ids are numeric strings that fit in a uint64, so the bulk of the index is a sorted
+    # uint64 array (8 bytes an id) with a small set for recent additions that is merged in periodically
+    def __init__(self, ids=None, merge_threshold=100_000):
+        self.merge_threshold = merge_threshold
+        self._sorted = np.unique(np.asarray(ids, dtype=np.uint64)) if ids is not None else np.empty(0, dtype=np.uint64)
+        self._recent = set()
+
+    def _merge(self):
+        if self._recent:
+            recent = np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent))
+            self._sorted = np.union1d(self._sorted, recent)
+            self._recent = set()
+
+    def __contains__(self, video_id):
+        video_id = int(video_id)
+        if video_id in self._recent:
+            return True
+        i = np.searchsorted(self._sorted, np.uint64(video_id))
+        return i < len(self._sorted) and self._sorted[i] == video_id
+
+    def __len__(self):
+        self._merge()
+        return len(self._sorted)
+
+    def add(self, video_id):
+        self._recent.add(int(video_id))
+        if len(self._recent) >= self.merge_threshold:
+            self._merge()
+
+    def unseen(self, video_ids):
+        self._merge()
+        ids = np.asarray([int(i) for i in video_ids], dtype=np.uint64)
+        return [str(i) for i in ids[~np.isin(ids, self._sorted)]]
+
+    def update(self, video_ids):
+        self._merge()
+        self._sorted = np.union1d(self._sorted, np.asarray([int(i) for i in video_ids], dtype=np.uint64))
+
+    def save(self, path):
+        self._merge()
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, self._sorted)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        index._sorted = np.load(path)
+        return index
+
+
+class Frontier(asyncio.Queue):
+    # FIFO crawl queue that only accepts ids it has never seen before. The seen index covers
+    # both queued and fetched ids, so each discovered video is checked and filtered exactly once.
+    # Items taken off the queue stay in flight until finish(), and are saved with the pending ones,
+    # so a crash between get() and finish() doesn't lose them.
+    def __init__(self, seen=None, maxsize=0):
+        self.seen = seen if seen is not None else SeenIndex()
+        self.in_flight = {}
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = collections.deque()
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        self.in_flight[item['id']] = item
+        return item
+
+    def finish(self, item):
+        self.in_flight.pop(item['id'], None)
+
+    def push(self, item):
+        if item['id'] in self.seen:
+            return False
+        self.seen.add(item['id'])
+        self.put_nowait(item)
+        return True
+
+    def pending(self):
+        return list(self._queue)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.seen.save(os.path.join(path, 'seen.npy'))
+        pending_path = os.path.join(path, 'pending.parquet.zstd')
+        pl.DataFrame(list(self.in_flight.values()) + self.pending()).write_parquet(f"{pending_path}.tmp", compression='zstd')
+        os.replace(f"{pending_path}.tmp", pending_path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        frontier = cls(seen=SeenIndex.load(os.path.join(path, 'seen.npy')), **kwargs)
+        for item in pl.read_parquet(os.path.join(path, 'pending.parquet.zstd')).to_dicts():
+            frontier.put_nowait(item)
+        return frontier
+
+
+class PriorityFrontier(Frontier):
+    # same dedup as Frontier, but items come out highest policy.score first, ties in arrival order
+    def __init__(self, policy, seen=None, maxsize=0):
+        self.policy = policy
+        self._counter = itertools.count()
+        super().__init__(seen=seen, maxsize=maxsize)
+
+    def _init(self, maxsize):
+        self._queue = []
+
+    def _put(self, item):
+        self.policy.observe(item)
+        heapq.heappush(self._queue, (-self.policy.score(item), next(self._counter), item))
+
+    def _get(self):
+        return heapq.heappop(self._queue)[2]
+
+    def pending(self):
+        return [entry[2] for entry in self._queue]
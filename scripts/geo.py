@@ -0,0 +1,127 @@
+import concurrent.futures
+import hashlib
+import itertools
+import os
+
+import geopandas as gpd
+import numpy as np
+import polars as pl
+
+SHAPEFILE = './23686383/Europe/Europe_merged.shp'
+# the maps join country values on GADM's alpha-3 code
+BASE_COLUMNS = ['GID_0', 'geometry']
+
+# ISO 3166-1 alpha-2 codes followed by their alpha-3 code, the same table pycountry ships
+ISO_3166 = """
+ADAND AEARE AFAFG AGATG AIAIA ALALB AMARM AOAGO AQATA ARARG ASASM ATAUT AUAUS AWABW AXALA AZAZE
+BABIH BBBRB BDBGD BEBEL BFBFA BGBGR BHBHR BIBDI BJBEN BLBLM BMBMU BNBRN BOBOL BQBES BRBRA BSBHS
+BTBTN BVBVT BWBWA BYBLR BZBLZ CACAN CCCCK CDCOD CFCAF CGCOG CHCHE CICIV CKCOK CLCHL CMCMR CNCHN
+COCOL CRCRI CUCUB CVCPV CWCUW CXCXR CYCYP CZCZE DEDEU DJDJI DKDNK DMDMA DODOM DZDZA ECECU EEEST
+EGEGY EHESH ERERI ESESP ETETH FIFIN FJFJI FKFLK FMFSM FOFRO FRFRA GAGAB GBGBR GDGRD GEGEO GFGUF
+GGGGY GHGHA GIGIB GLGRL GMGMB GNGIN GPGLP GQGNQ GRGRC GSSGS GTGTM GUGUM GWGNB GYGUY HKHKG HMHMD
+HNHND HRHRV HTHTI HUHUN IDIDN IEIRL ILISR IMIMN ININD IOIOT IQIRQ IRIRN ISISL ITITA JEJEY JMJAM
+JOJOR JPJPN KEKEN KGKGZ KHKHM KIKIR KMCOM KNKNA KPPRK KRKOR KWKWT KYCYM KZKAZ LALAO LBLBN LCLCA
+LILIE LKLKA LRLBR LSLSO LTLTU LULUX LVLVA LYLBY MAMAR MCMCO MDMDA MEMNE MFMAF MGMDG MHMHL MKMKD
+MLMLI MMMMR MNMNG MOMAC MPMNP MQMTQ MRMRT MSMSR MTMLT MUMUS MVMDV MWMWI MXMEX MYMYS MZMOZ NANAM
+NCNCL NENER NFNFK NGNGA NINIC NLNLD NONOR NPNPL NRNRU NUNIU NZNZL OMOMN PAPAN PEPER PFPYF PGPNG
+PHPHL PKPAK PLPOL PMSPM PNPCN PRPRI PSPSE PTPRT PWPLW PYPRY QAQAT REREU ROROU RSSRB RURUS RWRWA
+SASAU SBSLB SCSYC SDSDN SESWE SGSGP SHSHN SISVN SJSJM SKSVK SLSLE SMSMR SNSEN SOSOM SRSUR SSSSD
+STSTP SVSLV SXSXM SYSYR SZSWZ TCTCA TDTCD TFATF TGTGO THTHA TJTJK TKTKL TLTLS TMTKM TNTUN TOTON
+TRTUR TTTTO TVTUV TWTWN TZTZA UAUKR UGUGA UMUMI USUSA UYURY UZUZB VAVAT VCVCT VEVEN VGVGB VIVIR
+VNVNM VUVUT WFWLF WSWSM YEYEM YTMYT ZAZAF ZMZMB ZWZWE
+"""
+
+
+def _alpha2_index(code):
+    return (ord(code[0]) - ord('A')) * 26 + ord(code[1]) - ord('A')
+
+
+# alpha-3 code at the index of every possible alpha-2 code, None where there is no country
+ALPHA3 = np.full(26 * 26, None, dtype=object)
+for pair in ISO_3166.split():
+    ALPHA3[_alpha2_index(pair[:2])] = pair[2:]
+# TikTok reports Kosovo as XK, which isn't in ISO 3166-1, and GADM (the shapefile's GID_0) calls it XKO
+ALPHA3[_alpha2_index('XK')] = 'XKO'
+
+
+def alpha3(code):
+    if code is None or len(code) != 2:
+        return None
+    code = code.upper()
+    if not ('A' <= code[0] <= 'Z' and 'A' <= code[1] <= 'Z'):
+        return None
+    return ALPHA3[_alpha2_index(code)]
+
+
+def with_alpha3(df, column='country', alias='country_code'):
+    mapping = {code: alpha3(code) for code in df[column].unique().to_list() if code is not None}
+    return df.with_columns(pl.col(column).replace_strict(mapping, default=None, return_dtype=pl.String).alias(alias))
+
+
+def load_base_layer(shapefile=SHAPEFILE, cache_dir='./data/.cache', tolerance=0.01):
+    # the shapefile is read once and kept as simplified GeoParquet, keyed on the file and the tolerance
+    stat = os.stat(shapefile)
+    key = hashlib.sha1(f"{os.path.abspath(shapefile)}:{stat.st_mtime_ns}:{stat.st_size}:{tolerance}".encode()).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(shapefile))[0]}-{key}.parquet")
+    if os.path.exists(cache_path):
+        base = gpd.read_parquet(cache_path)
+        # a layer cached by something else is rebuilt rather than trusted
+        if all(c in base.columns for c in BASE_COLUMNS):
+            return base
+    base = gpd.read_file(shapefile)
+    if 'GID_0' not in base.columns:
+        raise ValueError(f"{shapefile} has no GID_0 column to join countries on")
+    base = base[BASE_COLUMNS]
+    # at map scale the full-resolution coastlines only cost time to draw
+    base['geometry'] = base.geometry.simplify(tolerance, preserve_topology=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    base.to_parquet(f"{cache_path}.tmp")
+    os.replace(f"{cache_path}.tmp", cache_path)
+    return base
+
+
+_worker = {}
+
+
+def _init_render_worker(shapefile, cache_dir, tolerance):
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker['base'] = load_base_layer(shapefile, cache_dir, tolerance)
+
+
+def _panels(spec):
+    # a spec is either one map or a figure with several maps side by side under 'panels'
+    return spec.get('panels', [spec])
+
+
+def _render(spec, values):
+    import matplotlib.pyplot as plt
+    country_map = _worker['base'].merge(values, left_on='GID_0', right_on='country_code', how='left', validate='many_to_one')
+    panels = _panels(spec)
+    fig, axes = plt.subplots(1, len(panels), figsize=spec.get('figsize', (6 * len(panels), 6)), squeeze=False)
+    for panel, ax in zip(panels, axes[0]):
+        country_map.plot(column=panel['column'], cmap=panel['cmap'], legend=True, legend_kwds={'label': panel['label']}, ax=ax)
+        ax.set_title(panel['title'])
+        ax.set_axis_off()
+    fig.tight_layout()
+    fig.savefig(spec['path'], dpi=spec.get('dpi', 300))
+    plt.close(fig)
+    return spec['path']
+
+
+def render_choropleths(country_df, specs, workers=None, shapefile=SHAPEFILE, cache_dir='./data/.cache', tolerance=0.01):
+    # every spec (column, cmap, label, title, path) is drawn on the same base layer, one map per
+    # worker process; each process reads the cached layer once and only the per-country values,
+    # a few kilobytes, are sent with each map
+    missing = sorted({panel['column'] for spec in specs for panel in _panels(spec)} - set(country_df.columns))
+    if missing:
+        raise ValueError(f"country_df has no column {', '.join(missing)} to map")
+    load_base_layer(shapefile, cache_dir, tolerance)
+    # countries without an alpha-3 code can't be drawn, and would all join on the same null key
+    values = with_alpha3(country_df).drop_nulls('country_code').to_pandas()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or min(len(specs), os.cpu_count() or 1),
+        initializer=_init_render_worker,
+        initargs=(shapefile, cache_dir, tolerance),
+    ) as pool:
+        return list(pool.map(_render, specs, itertools.repeat(values)))
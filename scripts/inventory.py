@@ -0,0 +1,108 @@
+import bisect
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_SCHEMA = pl.Schema({
+    'key': pl.String,
+    'last_modified': pl.Datetime('us', 'UTC'),
+    'etag': pl.String,
+    'size': pl.Int64,
+})
+
+
+class MediaInventory:
+    # A cached listing of everything under a prefix of a stage source (S3Source or LocalSource).
+    # The key space is cut into ranges that are listed concurrently, and later refreshes only list
+    # each range from the newest key already in the snapshot. Video ids grow with time so new
+    # downloads mostly land at the end of a range, anything older is picked up by the periodic
+    # full listing.
+    def __init__(self, source, prefix, snapshot_path, num_shards=32, num_threads=16, full_every_hours=24.0):
+        self.source = source
+        self.prefix = prefix
+        self.snapshot_path = snapshot_path
+        self.meta_path = snapshot_path.split('.parquet')[0] + '.json'
+        self.num_shards = num_shards
+        self.num_threads = num_threads
+        self.full_every_hours = full_every_hours
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        return meta if meta.get('prefix') == self.prefix else {}
+
+    def snapshot(self):
+        if not os.path.exists(self.snapshot_path) or not self._read_meta():
+            return pl.DataFrame(schema=INVENTORY_SCHEMA)
+        return pl.read_parquet(self.snapshot_path)
+
+    def _boundaries(self, keys):
+        # range i is (boundaries[i - 1], boundaries[i]], the first is open below and the last above
+        if len(keys) >= self.num_shards:
+            # equal-sized ranges of what was there last time
+            step = len(keys) // self.num_shards
+            return keys.gather(list(range(step, len(keys) - 1, step))[:self.num_shards - 1]).to_list()
+        # media keys are <video_id>.mp4, so the first two digits split the space evenly enough
+        return [f"{self.prefix}{i:02d}" for i in range(1, 100)]
+
+    def _list_range(self, start_after, end):
+        rows = []
+        for obj in self.source.list_objects(self.prefix, start_after=start_after):
+            if end is not None and obj['key'] > end:
+                break
+            rows.append(obj)
+        return rows
+
+    def _list(self, ranges):
+        with concurrent.futures.ThreadPoolExecutor(self.num_threads) as pool:
+            shards = pool.map(lambda r: self._list_range(*r), ranges)
+            rows = [row for shard in shards for row in shard]
+        return pl.DataFrame(rows, schema=INVENTORY_SCHEMA, orient='row') if rows else pl.DataFrame(schema=INVENTORY_SCHEMA)
+
+    def _write(self, df, meta):
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        df.write_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, self.snapshot_path)
+        with open(f"{self.meta_path}.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+
+    def refresh(self, full=False):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        meta = self._read_meta()
+        snapshot = self.snapshot()
+        last_full = meta.get('full_listed_at')
+        if last_full is None or now - datetime.datetime.fromisoformat(last_full) > datetime.timedelta(hours=self.full_every_hours):
+            full = True
+
+        keys = snapshot['key'].sort()
+        boundaries = self._boundaries(keys)
+        starts = [None] + boundaries
+        ends = boundaries + [None]
+        if not full:
+            # start each range after the newest key already listed in it
+            keys = keys.to_list()
+            for i, (start, end) in enumerate(zip(starts, ends)):
+                j = (bisect.bisect_right(keys, end) if end is not None else len(keys)) - 1
+                if j >= 0 and (start is None or keys[j] > start):
+                    starts[i] = keys[j]
+
+        listed = self._list(list(zip(starts, ends)))
+        if full:
+            df = listed.sort('key')
+            meta = {'prefix': self.prefix, 'full_listed_at': now.isoformat()}
+        else:
+            df = pl.concat([snapshot, listed]).unique('key', keep='last').sort('key')
+        meta['listed_at'] = now.isoformat()
+        self._write(df, meta)
+        logger.info(f"Listed {len(listed)} objects under {self.prefix} ({'full' if full else 'delta'}), {len(df)} in the inventory")
+        return df
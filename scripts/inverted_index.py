@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import polars as pl
+
+from relevance import fold, fold_expr
+from schema import VIDEO_SCHEMA
+from store import FragmentStore
+
+COLUMNS = ['id', 'desc', 'locationCreated', 'createTime']
+
+
+def terms_expr(min_length=2):
+    # hashtags keep their '#', so '#georgescu' and 'georgescu' are separate terms
+    folded = fold_expr(pl.col('desc'))
+    hashtags = folded.str.extract_all(r'#\w+')
+    tokens = folded.str.extract_all(r'\w+').list.eval(pl.element().filter(pl.element().str.len_chars() >= min_length))
+    return pl.concat_list(hashtags.fill_null([]), tokens.fill_null([])).list.unique()
+
+
+def normalize_term(term):
+    return fold(term.strip())
+
+
+class Segment:
+    # postings of one build: terms sorted, with each term's doc ids at postings[offset:offset + count]
+    def __init__(self, path):
+        self.path = path
+        self.terms = pl.read_parquet(os.path.join(path, 'terms.parquet'))
+        postings_path = os.path.join(path, 'postings.u32')
+        if os.path.getsize(postings_path) > 0:
+            self.postings = np.memmap(postings_path, dtype=np.uint32, mode='r')
+        else:
+            self.postings = np.zeros(0, np.uint32)
+
+    def lookup(self, term):
+        i = self.terms['term'].search_sorted(term)
+        if i >= len(self.terms) or self.terms['term'][i] != term:
+            return np.zeros(0, np.uint32)
+        offset, count = self.terms['offset'][i], self.terms['count'][i]
+        return np.asarray(self.postings[offset:offset + count])
+
+    def long(self):
+        # (term, doc_id) rows, used when segments are merged
+        repeats = np.repeat(np.arange(len(self.terms)), self.terms['count'].to_numpy())
+        return pl.DataFrame({'term': self.terms['term'].gather(repeats), 'doc_id': np.asarray(self.postings)})
+
+
+class InvertedIndex:
+    # An on-disk index from hashtags and folded tokens to the sorted doc ids of the videos of a
+    # FragmentStore, plus video counts per (term, day, country).
+    # Each update() indexes only the store fragments it hasn't seen, as a new segment. Doc ids are
+    # handed out in increasing order, so a term's postings are its segments' slices one after the other.
+    def __init__(self, store, path=None, max_segments=16):
+        self.store = store
+        self.path = path or os.path.join(os.path.dirname(store.path.rstrip('/')), '.index', os.path.basename(store.path.rstrip('/')))
+        self.max_segments = max_segments
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = self._read_meta()
+        self._open()
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return {'segments': [], 'fragments': [], 'num_docs': 0}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, '.meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def _open(self):
+        self.segments = [Segment(os.path.join(self.path, name)) for name in self.meta['segments']]
+        self._docs = None
+
+    def _write_segment(self, postings_df, docs_df, daily_df):
+        name = f"seg-{time.time_ns()}"
+        tmp_dir = os.path.join(self.path, f".{name}.tmp")
+        os.makedirs(tmp_dir)
+        postings_df = postings_df.sort('term', 'doc_id')
+        terms = postings_df.group_by('term', maintain_order=True).agg(pl.len().cast(pl.Int64).alias('count'))
+        terms = terms.with_columns((pl.col('count').cum_sum() - pl.col('count')).alias('offset'))
+        terms.write_parquet(os.path.join(tmp_dir, 'terms.parquet'))
+        postings_df['doc_id'].to_numpy().astype(np.uint32).tofile(os.path.join(tmp_dir, 'postings.u32'))
+        docs_df.write_parquet(os.path.join(tmp_dir, 'docs.parquet'))
+        daily_df.write_parquet(os.path.join(tmp_dir, 'daily.parquet'))
+        os.replace(tmp_dir, os.path.join(self.path, name))
+        return name
+
+    def indexed_ids(self):
+        return self.docs()['id']
+
+    def update(self):
+        fragments = [os.path.relpath(f, self.store.path) for f in self.store.fragments()]
+        indexed = set(self.meta['fragments'])
+        new_files = [os.path.join(self.store.path, f) for f in fragments if f not in indexed]
+        if not new_files:
+            return 0
+        # compaction rewrites rows that are already indexed into new fragments, those are skipped by id
+        df = self.store.scan(columns=COLUMNS, files=new_files)\
+            .unique('id', keep='last', maintain_order=True)\
+            .filter(~pl.col('id').is_in(self.indexed_ids().implode()))\
+            .collect()
+        num_docs = self.meta['num_docs']
+        if len(df) > 0:
+            docs_df = df.select(
+                (pl.int_range(pl.len(), dtype=pl.UInt32) + num_docs).alias('doc_id'),
+                pl.col('id'),
+                pl.from_epoch(pl.col('createTime').cast(pl.Int64)).dt.date().alias('day'),
+                pl.col('locationCreated').alias('country'),
+                terms_expr().alias('term'),
+            )
+            long_df = docs_df.select('doc_id', 'day', 'country', 'term').explode('term').drop_nulls('term')
+            daily_df = long_df.group_by('term', 'day', 'country').agg(pl.len().cast(pl.UInt32).alias('videos'))
+            name = self._write_segment(long_df.select('term', 'doc_id'), docs_df.drop('term'), daily_df)
+            self.meta['segments'].append(name)
+            num_docs += len(df)
+        self.meta['num_docs'] = num_docs
+        # fragments compacted away since the last update are dropped, so the list stays the size of the store
+        self.meta['fragments'] = fragments
+        self._write_meta()
+        self._open()
+        if len(self.segments) > self.max_segments:
+            self.merge()
+        return len(df)
+
+    def merge(self):
+        if len(self.segments) < 2:
+            return
+        postings_df = pl.concat([segment.long() for segment in self.segments])
+        docs_df = pl.concat([pl.read_parquet(os.path.join(s.path, 'docs.parquet')) for s in self.segments])
+        daily_df = pl.concat([pl.read_parquet(os.path.join(s.path, 'daily.parquet')) for s in self.segments])\
+            .group_by('term', 'day', 'country').agg(pl.col('videos').sum())
+        name = self._write_segment(postings_df, docs_df, daily_df)
+        old = self.meta['segments']
+        self.meta['segments'] = [name]
+        self._write_meta()
+        self._open()
+        for old_name in old:
+            shutil.rmtree(os.path.join(self.path, old_name))
+
+    def postings(self, term):
+        term = normalize_term(term)
+        return np.concatenate([np.zeros(0, np.uint32)] + [segment.lookup(term) for segment in self.segments])
+
+    def docs(self):
+        if self._docs is None:
+            frames = [pl.read_parquet(os.path.join(s.path, 'docs.parquet')) for s in self.segments]
+            self._docs = pl.concat(frames) if frames else pl.DataFrame(schema={'doc_id': pl.UInt32, 'id': pl.String, 'day': pl.Date, 'country': pl.String})
+        return self._docs
+
+    def search(self, *terms):
+        # ids of the videos that have every term
+        doc_ids = None
+        for term in terms:
+            postings = self.postings(term)
+            doc_ids = postings if doc_ids is None else np.intersect1d(doc_ids, postings, assume_unique=True)
+        if doc_ids is None:
+            return pl.Series('id', [], dtype=pl.String)
+        # doc ids are the row numbers of docs()
+        return self.docs()['id'].gather(doc_ids)
+
+    def daily(self, term, country=None):
+        term = normalize_term(term)
+        lf = pl.concat([pl.scan_parquet(os.path.join(s.path, 'daily.parquet')) for s in self.segments]) if self.segments else \
+            pl.LazyFrame(schema={'term': pl.String, 'day': pl.Date, 'country': pl.String, 'videos': pl.UInt32})
+        lf = lf.filter(pl.col('term') == term)
+        if country is not None:
+            lf = lf.filter(pl.col('country') == country)
+        return lf.group_by('day').agg(pl.col('videos').sum()).sort('day').collect()
+
+    def term_counts(self, hashtags_only=False):
+        lf = pl.concat([pl.scan_parquet(os.path.join(s.path, 'terms.parquet')) for s in self.segments]) if self.segments else \
+            pl.LazyFrame(schema={'term': pl.String, 'count': pl.Int64, 'offset': pl.Int64})
+        if hashtags_only:
+            lf = lf.filter(pl.col('term').str.starts_with('#'))
+        return lf.group_by('term').agg(pl.col('count').sum().alias('videos')).sort('videos', descending=True).collect()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default='./data/fetched_election_videos')
+    parser.add_argument('--term', action='append', default=[], help='e.g. --term "#calingeorgescu", repeat to intersect')
+    parser.add_argument('--country', default=None)
+    args = parser.parse_args()
+
+    index = InvertedIndex(FragmentStore(args.store, schema=VIDEO_SCHEMA))
+    start_time = time.perf_counter()
+    num_indexed = index.update()
+    print(f"Indexed {num_indexed} new videos in {time.perf_counter() - start_time:.2f}s, {index.meta['num_docs']} in total")
+
+    if args.term:
+        start_time = time.perf_counter()
+        ids = index.search(*args.term)
+        daily = index.daily(args.term[0], country=args.country) if len(args.term) == 1 else None
+        print(f"{len(ids)} videos in {(time.perf_counter() - start_time) * 1e3:.1f} ms")
+        if daily is not None:
+            print(daily)
+
+if __name__ == '__main__':
+    main()
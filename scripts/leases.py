@@ -0,0 +1,232 @@
+import datetime
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseTable:
+    # Work queue shared by transcription worker processes. A worker claims a batch of 'pending'
+    # videos, which become 'leased' to it until lease_expires. Heartbeats push the expiry forward
+    # while the worker is alive, so the videos of a worker that dies become claimable again once
+    # their lease runs out. Failed videos go back to 'pending' until max_attempts.
+    # SQLite's locking only holds on one host's local disk, network filesystems don't implement it
+    # reliably, so all workers have to run on the machine that has the file. Workers on several
+    # hosts share a PostgresLeaseTable instead, see open_lease_table.
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        # one connection used from the pipeline threads and the heartbeat thread, behind a lock
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        # rollback journal rather than WAL, whose shared-memory index adds a second way for this to
+        # go wrong if the file does end up on a network mount
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                video_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS leases_state ON leases (state, lease_expires)')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def _transaction(self, statements):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same rows
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements()
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def _now(self):
+        return datetime.datetime.now().isoformat()
+
+    def add(self, video_ids):
+        now = self._now()
+        rows = [(str(video_id), now) for video_id in video_ids]
+        def statements():
+            self.conn.executemany(
+                "INSERT INTO leases (video_id, state, updated_at) VALUES (?, 'pending', ?) ON CONFLICT(video_id) DO NOTHING",
+                rows,
+            )
+        self._transaction(statements)
+
+    def claim(self, worker_id, batch_size):
+        def statements():
+            now = time.time()
+            video_ids = [row[0] for row in self.conn.execute('''
+                SELECT video_id FROM leases
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                LIMIT ?
+            ''', (now, batch_size))]
+            self.conn.executemany('''
+                UPDATE leases SET state = 'leased', worker_id = ?, lease_expires = ?, updated_at = ?
+                WHERE video_id = ?
+            ''', [(worker_id, now + self.lease_seconds, self._now(), video_id) for video_id in video_ids])
+            return video_ids
+        return self._transaction(statements)
+
+    def heartbeat(self, worker_id):
+        def statements():
+            self.conn.execute('''
+                UPDATE leases SET lease_expires = ? WHERE state = 'leased' AND worker_id = ?
+            ''', (time.time() + self.lease_seconds, worker_id))
+        self._transaction(statements)
+
+    def complete(self, video_ids):
+        # a video whose lease expired and was claimed again still counts as done, the transcript
+        # store keeps the last copy of a video_id so the duplicate does no harm
+        now = self._now()
+        def statements():
+            self.conn.executemany('''
+                UPDATE leases SET state = 'done', lease_expires = NULL, updated_at = ? WHERE video_id = ?
+            ''', [(now, str(video_id)) for video_id in video_ids])
+        self._transaction(statements)
+
+    def fail(self, worker_id, video_ids):
+        # only touches videos still leased to worker_id, one whose lease expired may be with someone else now
+        now = self._now()
+        def statements():
+            self.conn.executemany('''
+                UPDATE leases SET
+                    attempts = attempts + 1,
+                    state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                    worker_id = NULL,
+                    lease_expires = NULL,
+                    updated_at = ?
+                WHERE video_id = ? AND state = 'leased' AND worker_id = ?
+            ''', [(self.max_attempts, now, str(video_id), worker_id) for video_id in video_ids])
+        self._transaction(statements)
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute('SELECT state, COUNT(*) FROM leases GROUP BY state').fetchall())
+
+    def start_heartbeat(self, worker_id):
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 3):
+                self.heartbeat(worker_id)
+        self._heartbeat = threading.Thread(target=beat, daemon=True, name='lease-heartbeat')
+        self._heartbeat.start()
+
+    def leased_batches(self, worker_id, batch_size):
+        # claims the next batch only once the previous one has been handed out, until nothing is left
+        while True:
+            video_ids = self.claim(worker_id, batch_size)
+            if not video_ids:
+                return
+            yield video_ids
+
+    def close(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        self.conn.close()
+
+
+class PostgresLeaseTable(LeaseTable):
+    # The same work queue in a Postgres table, for workers on several hosts. Claims lock the rows
+    # they take with FOR UPDATE SKIP LOCKED, so concurrent claims skip each other's rows instead of
+    # waiting on them, and lease times come from the database clock, so the hosts' clocks don't matter.
+    def __init__(self, url, lease_seconds=300, max_attempts=3):
+        import psycopg
+        self.conn = psycopg.connect(url, autocommit=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+        def statements():
+            # workers starting together would race on CREATE TABLE IF NOT EXISTS without the lock
+            self.conn.execute("SELECT pg_advisory_xact_lock(hashtext('leases'))")
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    video_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires TIMESTAMPTZ,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS leases_state ON leases (state, lease_expires)')
+        self._transaction(statements)
+
+    def _transaction(self, statements):
+        with self._lock, self.conn.transaction():
+            return statements()
+
+    def add(self, video_ids):
+        video_ids = [str(video_id) for video_id in video_ids]
+        def statements():
+            self.conn.execute('''
+                INSERT INTO leases (video_id, state) SELECT unnest(%s::text[]), 'pending'
+                ON CONFLICT (video_id) DO NOTHING
+            ''', (video_ids,))
+        self._transaction(statements)
+
+    def claim(self, worker_id, batch_size):
+        def statements():
+            return [row[0] for row in self.conn.execute('''
+                WITH claimable AS (
+                    SELECT video_id FROM leases
+                    WHERE state = 'pending' OR (state = 'leased' AND lease_expires < now())
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE leases SET state = 'leased', worker_id = %s, lease_expires = now() + make_interval(secs => %s), updated_at = now()
+                FROM claimable WHERE leases.video_id = claimable.video_id
+                RETURNING leases.video_id
+            ''', (batch_size, worker_id, self.lease_seconds))]
+        return self._transaction(statements)
+
+    def heartbeat(self, worker_id):
+        def statements():
+            self.conn.execute('''
+                UPDATE leases SET lease_expires = now() + make_interval(secs => %s) WHERE state = 'leased' AND worker_id = %s
+            ''', (self.lease_seconds, worker_id))
+        self._transaction(statements)
+
+    def complete(self, video_ids):
+        video_ids = [str(video_id) for video_id in video_ids]
+        def statements():
+            self.conn.execute('''
+                UPDATE leases SET state = 'done', lease_expires = NULL, updated_at = now() WHERE video_id = ANY(%s)
+            ''', (video_ids,))
+        self._transaction(statements)
+
+    def fail(self, worker_id, video_ids):
+        video_ids = [str(video_id) for video_id in video_ids]
+        def statements():
+            self.conn.execute('''
+                UPDATE leases SET
+                    attempts = attempts + 1,
+                    state = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                    worker_id = NULL,
+                    lease_expires = NULL,
+                    updated_at = now()
+                WHERE video_id = ANY(%s) AND state = 'leased' AND worker_id = %s
+            ''', (self.max_attempts, video_ids, worker_id))
+        self._transaction(statements)
+
+
+def open_lease_table(location, **kwargs):
+    # a postgres:// url for workers on several hosts, otherwise the path of a SQLite file on local disk
+    if location.startswith(('postgres://', 'postgresql://')):
+        return PostgresLeaseTable(location, **kwargs)
+    return LeaseTable(location, **kwargs)
@@ -0,0 +1,62 @@
+import glob
+import hashlib
+import json
+import os
+
+import polars as pl
+
+from schema import SCHEMA_VERSION, VIDEO_SCHEMA, check_schema_version, conform, schema_metadata
+
+def hashtag_shards(data_dir='./data'):
+    # the single file per hashtag the collector used to rewrite, and the fragments it appends now
+    legacy = glob.glob(os.path.join(data_dir, 'hashtag_*.parquet.zstd'))
+    fragments = glob.glob(os.path.join(data_dir, 'hashtag_*', '*', '*.parquet.zstd'))
+    return sorted(legacy + fragments)
+
+def fingerprint_files(files):
+    # changes whenever a file is added, removed or rewritten
+    h = hashlib.sha1()
+    for f in files:
+        stat = os.stat(f)
+        h.update(f"{os.path.basename(f)}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return h.hexdigest()
+
+def _build_snapshot(files, snapshot_path):
+    # every shard is scanned lazily and unioned in one plan, so polars reads them in parallel
+    for f in files:
+        check_schema_version(f)
+    lf = pl.concat([conform(pl.scan_parquet(f), VIDEO_SCHEMA) for f in files], how='diagonal_relaxed')
+    tmp_path = f"{snapshot_path}.tmp"
+    lf.unique('id', keep='last').collect().write_parquet(tmp_path, compression='zstd', metadata=schema_metadata())
+    os.replace(tmp_path, snapshot_path)
+
+def scan_hashtag_videos(data_dir='./data', columns=None, predicate=None, cache_dir=None):
+    files = hashtag_shards(data_dir)
+    if not files:
+        return pl.LazyFrame(schema=VIDEO_SCHEMA)
+
+    # the deduplicated union is cached, and only rebuilt when a shard is added or changes
+    cache_dir = cache_dir or os.path.join(data_dir, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot_path = os.path.join(cache_dir, 'hashtag_snapshot.parquet.zstd')
+    fingerprint_path = os.path.join(cache_dir, 'hashtag_snapshot.json')
+    fingerprint = fingerprint_files(files)
+    cached = {}
+    if os.path.exists(fingerprint_path) and os.path.exists(snapshot_path):
+        with open(fingerprint_path) as f:
+            cached = json.load(f)
+    # a snapshot conformed to an older schema is rebuilt too
+    if cached.get('fingerprint') != fingerprint or cached.get('schema_version') != SCHEMA_VERSION:
+        _build_snapshot(files, snapshot_path)
+        with open(fingerprint_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'schema_version': SCHEMA_VERSION, 'shards': [os.path.basename(f) for f in files]}, f)
+
+    lf = pl.scan_parquet(snapshot_path)
+    if predicate is not None:
+        lf = lf.filter(predicate)
+    if columns is not None:
+        lf = lf.select(columns)
+    return lf
+
+def load_hashtag_videos(data_dir='./data', columns=None, predicate=None, cache_dir=None):
+    return scan_hashtag_videos(data_dir=data_dir, columns=columns, predicate=predicate, cache_dir=cache_dir).collect()
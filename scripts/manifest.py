@@ -0,0 +1,71 @@
+import datetime
+import sqlite3
+
+
+class DownloadManifest:
+    # per-video download state: 'partial' rows have bytes on disk that can be resumed with a
+    # range request, 'complete' rows have the final size and sha256 of the file
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS downloads (
+                video_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                bytes_written INTEGER NOT NULL DEFAULT 0,
+                total_bytes INTEGER,
+                sha256 TEXT,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        # the validator of the object a partial file came from, manifests from before it get the column added
+        if 'etag' not in {row[1] for row in self.conn.execute('PRAGMA table_info(downloads)')}:
+            self.conn.execute('ALTER TABLE downloads ADD COLUMN etag TEXT')
+        self.conn.commit()
+
+    def _upsert(self, video_id, state, bytes_written, total_bytes=None, sha256=None, etag=None):
+        self.conn.execute('''
+            INSERT INTO downloads (video_id, state, bytes_written, total_bytes, sha256, etag, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                state = excluded.state,
+                bytes_written = excluded.bytes_written,
+                total_bytes = COALESCE(excluded.total_bytes, downloads.total_bytes),
+                sha256 = excluded.sha256,
+                etag = COALESCE(excluded.etag, downloads.etag),
+                updated_at = excluded.updated_at
+        ''', (str(video_id), state, bytes_written, total_bytes, sha256, etag, datetime.datetime.now().isoformat()))
+        self.conn.commit()
+
+    def mark_partial(self, video_id, bytes_written, total_bytes=None, etag=None):
+        self._upsert(video_id, 'partial', bytes_written, total_bytes, etag=etag)
+
+    def mark_started(self, video_id, total_bytes, etag):
+        # a download from byte 0, whatever was known about an earlier object is replaced
+        self.conn.execute('''
+            INSERT INTO downloads (video_id, state, bytes_written, total_bytes, sha256, etag, updated_at)
+            VALUES (?, 'partial', 0, ?, NULL, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                state = 'partial', bytes_written = 0, total_bytes = excluded.total_bytes, sha256 = NULL,
+                etag = excluded.etag, updated_at = excluded.updated_at
+        ''', (str(video_id), total_bytes, etag, datetime.datetime.now().isoformat()))
+        self.conn.commit()
+
+    def mark_complete(self, video_id, total_bytes, sha256):
+        self._upsert(video_id, 'complete', total_bytes, total_bytes, sha256)
+
+    def mark_failed(self, video_id, bytes_written=0):
+        self._upsert(video_id, 'failed', bytes_written)
+
+    def get(self, video_id):
+        row = self.conn.execute(
+            'SELECT state, bytes_written, total_bytes, sha256, etag FROM downloads WHERE video_id = ?', (str(video_id),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['state', 'bytes_written', 'total_bytes', 'sha256', 'etag'], row))
+
+    def completed_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT video_id FROM downloads WHERE state = 'complete'")}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,84 @@
+import re
+
+import polars as pl
+
+CANDIDATE_KEYWORDS = [
+    'georgescu', 'lasconi', 'bucuresti', 'iohannis', 'hurezeanu', 'sosoaca', 'ciolacu',
+    'simion', 'nicusor dan', 'bolojan', 'crin antonescu', 'potra', 'ponta', 'alegeri',
+]
+ELECTION_KEYWORDS = CANDIDATE_KEYWORDS + ['diaconescu']
+ROMANIA_KEYWORDS = ['romania', 'bucharest'] + CANDIDATE_KEYWORDS + ['mariustuca']
+
+# Romanian letters are folded to plain ascii so 'Șoșoacă', 'şoşoacă' (cedilla) and 'sosoaca' all
+# match, including the decomposed forms with a combining mark after the letter
+DIACRITICS = {
+    'ș': 's', 'ş': 's', 'ț': 't', 'ţ': 't', 'ă': 'a', 'â': 'a', 'î': 'i',
+    # comma below, cedilla, breve, circumflex
+    '\u0326': '', '\u0327': '', '\u0306': '', '\u0302': '',
+}
+
+
+def fold(text):
+    text = text.lower()
+    for old, new in DIACRITICS.items():
+        text = text.replace(old, new)
+    return text
+
+
+def fold_expr(expr):
+    return expr.str.to_lowercase().str.replace_many(list(DIACRITICS), list(DIACRITICS.values()))
+
+
+def hit_column(keyword):
+    return 'hit_' + re.sub(r'\W+', '_', keyword)
+
+
+class RelevanceClassifier:
+    # Matches every keyword in one pass over the folded description (polars runs extract_many as an
+    # Aho-Corasick automaton), and adds
+    #   keywordHits: the distinct keywords found, keywordScore: how many there are,
+    #   subtitleLanguages and romanianLanguage: whether textLanguage or the subtitles say Romanian.
+    # With use_language, Romanian videos are relevant even without a keyword.
+    def __init__(self, keywords, use_language=False, max_subtitle_languages=5):
+        self.keywords = list(dict.fromkeys(fold(k) for k in keywords))
+        self.use_language = use_language
+        self.max_subtitle_languages = max_subtitle_languages
+
+    def _annotate_all(self, df):
+        hits = fold_expr(pl.col('desc')).str.extract_many(self.keywords, overlapping=True).list.unique(maintain_order=True)
+        df = df.with_columns(
+            pl.col('video').struct.field('subtitleInfos').list.eval(pl.element().struct.field('LanguageCodeName')).alias('subtitleLanguages'),
+            hits.fill_null([]).alias('keywordHits'),
+        )
+        # videos subtitled in many languages are auto-translated, so ron-RO among them says nothing
+        subtitled_romanian = pl.col('subtitleLanguages').list.contains('ron-RO') & (pl.col('subtitleLanguages').list.len() < self.max_subtitle_languages)
+        text_romanian = (pl.col('textLanguage') == 'ro') if 'textLanguage' in df.columns else pl.lit(False)
+        return df.with_columns(
+            pl.col('keywordHits').list.len().cast(pl.Int64).alias('keywordScore'),
+            (text_romanian.fill_null(False) | subtitled_romanian.fill_null(False)).alias('romanianLanguage'),
+        )
+
+    def annotate(self, df):
+        # rows that were already classified (e.g. read back from a store) keep their columns, only
+        # the new ones go through the matcher
+        if 'keywordHits' in df.columns and 'romanianLanguage' in df.columns:
+            is_new = pl.col('keywordHits').is_null() | pl.col('romanianLanguage').is_null()
+            old_df = df.filter(~is_new)
+            new_df = df.filter(is_new)
+            if len(new_df) == 0:
+                return df
+            return pl.concat([old_df, self._annotate_all(new_df).select(old_df.columns)])
+        return self._annotate_all(df)
+
+    def relevant(self):
+        relevant = pl.col('keywordScore') > 0
+        if self.use_language:
+            relevant = relevant | pl.col('romanianLanguage')
+        return relevant
+
+    def filter(self, df):
+        return self.annotate(df).filter(self.relevant())
+
+    def hit_columns(self, df):
+        # one boolean column per keyword, e.g. hit_nicusor_dan
+        return df.with_columns([pl.col('keywordHits').list.contains(k).alias(hit_column(k)) for k in self.keywords])
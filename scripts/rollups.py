@@ -0,0 +1,141 @@
+import glob
+import json
+import os
+import time
+
+import polars as pl
+
+from aggregate import term_column, with_term_indicators
+from relevance import fold_expr
+
+ENGAGEMENT = ['playCount', 'diggCount', 'commentCount', 'shareCount', 'collectCount']
+KEYS = ['day', 'country', 'term', 'author']
+COLUMNS = ['id', 'desc', 'locationCreated', 'createTime', 'author', 'stats', 'scrape_date']
+
+# bump when the rollup changes so existing tables are rebuilt
+ROLLUP_VERSION = 2
+
+
+class DailyRollup:
+    # Video counts and summed engagement per (day, country, term, author) for the videos of a
+    # FragmentStore. term is one of the configured terms, a '#hashtag', or null for all videos.
+    # update() only reads the store fragments it hasn't read before, whatever their scrape_date, and a
+    # video is counted the first time it's seen, so refetching it doesn't count it twice.
+    def __init__(self, store, terms=(), path=None, max_parts=32):
+        self.store = store
+        self.terms = list(terms)
+        self.path = path or os.path.join(os.path.dirname(store.path.rstrip('/')), '.rollups', os.path.basename(store.path.rstrip('/')))
+        self.max_parts = max_parts
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = self._read_meta()
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('version') == ROLLUP_VERSION and meta.get('terms') == self.terms:
+                return meta
+        # new terms can't be backfilled from the rollup itself, so it starts over
+        for f in self._parts() + glob.glob(os.path.join(self.path, 'ids-*.parquet')):
+            os.remove(f)
+        return {'version': ROLLUP_VERSION, 'terms': self.terms, 'fragments': []}
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, '.meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def _write(self, prefix, df):
+        name = f"{prefix}-{time.time_ns()}.parquet"
+        df.write_parquet(os.path.join(self.path, f".{name}.tmp"))
+        os.replace(os.path.join(self.path, f".{name}.tmp"), os.path.join(self.path, name))
+
+    def _counted_ids(self):
+        files = glob.glob(os.path.join(self.path, 'ids-*.parquet'))
+        if not files:
+            return pl.Series('id', [], dtype=pl.String)
+        return pl.concat([pl.read_parquet(f) for f in files])['id']
+
+    def _rollup(self, df):
+        df = df.select(
+            pl.from_epoch(pl.col('createTime').cast(pl.Int64)).dt.date().alias('day'),
+            pl.col('locationCreated').alias('country'),
+            pl.col('author').struct.field('uniqueId').alias('author'),
+            pl.col('desc'),
+            *[pl.col('stats').struct.field(c).fill_null(0).alias(c) for c in ENGAGEMENT],
+        )
+        df = with_term_indicators(df, self.terms)
+        hashtags = fold_expr(pl.col('desc')).str.extract_all(r'#\w+').list.unique().fill_null([])
+        # every video contributes a row with a null term, one per matched term and one per hashtag
+        matched = pl.concat_list(*[pl.when(pl.col(term_column(t))).then(pl.lit(t)) for t in self.terms], hashtags)
+        terms = pl.concat_list(pl.lit(None, dtype=pl.String), matched.list.drop_nulls().list.unique())
+        long_df = df.with_columns(terms.alias('term')).explode('term')
+        return long_df.group_by(KEYS).agg(
+            pl.len().cast(pl.UInt32).alias('videos'),
+            *[pl.col(c).sum() for c in ENGAGEMENT],
+        )
+
+    def update(self):
+        fragments = [os.path.relpath(f, self.store.path) for f in self.store.fragments()]
+        read = set(self.meta['fragments'])
+        new_files = [os.path.join(self.store.path, f) for f in fragments if f not in read]
+        if not new_files:
+            return 0
+        # a fragment can be flushed late with rows scraped before ones already counted, so it's the
+        # fragments that are tracked and not a scrape_date mark. Compaction rewrites counted rows
+        # into new fragments, those are skipped by id.
+        df = self.store.scan(columns=COLUMNS, files=new_files)\
+            .unique('id', keep='first', maintain_order=True)\
+            .filter(~pl.col('id').is_in(self._counted_ids().implode()))\
+            .collect()
+        if len(df) > 0:
+            self._write('part', self._rollup(df))
+            self._write('ids', df.select('id'))
+        # fragments compacted away since the last update are dropped, so the list stays the size of the store
+        self.meta['fragments'] = fragments
+        self._write_meta()
+        if len(self._parts()) > self.max_parts:
+            self.compact()
+        return len(df)
+
+    def compact(self):
+        parts = self._parts()
+        ids = glob.glob(os.path.join(self.path, 'ids-*.parquet'))
+        if len(parts) < 2:
+            return
+        self._write('part', self.scan().collect())
+        self._write('ids', self._counted_ids().to_frame())
+        for f in parts + ids:
+            os.remove(f)
+
+    def scan(self):
+        parts = self._parts()
+        if not parts:
+            return pl.LazyFrame(schema={
+                'day': pl.Date, 'country': pl.String, 'term': pl.String, 'author': pl.String,
+                'videos': pl.UInt32, **{c: pl.Int64 for c in ENGAGEMENT},
+            })
+        return pl.scan_parquet(parts).group_by(KEYS).agg(pl.col('videos').sum(), *[pl.col(c).sum() for c in ENGAGEMENT])
+
+    def daily(self, term=None, country=None):
+        lf = self.scan().filter(pl.col('term').is_null() if term is None else pl.col('term') == term)
+        if country is not None:
+            lf = lf.filter(pl.col('country') == country)
+        return lf.group_by('day').agg(pl.col('videos').sum(), *[pl.col(c).sum() for c in ENGAGEMENT]).sort('day').collect()
+
+    def term_table(self, terms):
+        # per (country, day) counts with a total_videos column and one <term>_videos column per term,
+        # what aggregate.by_country and by_day roll up for the plots
+        wide = self.scan().filter(pl.col('term').is_null() | pl.col('term').is_in(terms))\
+            .group_by('country', 'day', 'term').agg(pl.col('videos').sum())\
+            .collect()\
+            .with_columns(pl.col('term').fill_null('total') + '_videos')\
+            .pivot('term', index=['country', 'day'], values='videos')
+        columns = ['total_videos'] + [term_column(t) for t in terms]
+        return wide.with_columns([pl.lit(0, dtype=pl.UInt32).alias(c) for c in columns if c not in wide.columns])\
+            .select('country', 'day', *[pl.col(c).fill_null(0) for c in columns]).sort('country', 'day')
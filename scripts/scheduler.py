@@ -0,0 +1,144 @@
+import collections
+import datetime
+import json
+import math
+import os
+
+import polars as pl
+
+# Crawl items carry the features the policies rank on:
+# depth (hops from a hashtag seed), keyword_score (keywords matched by relevance.RelevanceClassifier),
+# play_count (stats.playCount) and author_id.
+# observe() is called once when an item is queued and may stamp it, score() only reads the item, so
+# re-scoring the items of a saved frontier on load doesn't change anything.
+
+class FIFOPolicy:
+    name = 'fifo'
+
+    def observe(self, item):
+        pass
+
+    def score(self, item):
+        return 0.0
+
+
+class BFSPolicy(FIFOPolicy):
+    name = 'bfs'
+
+    def score(self, item):
+        return -item.get('depth', 0)
+
+
+class KeywordPolicy(FIFOPolicy):
+    name = 'keyword'
+
+    def score(self, item):
+        return item.get('keyword_score') or 0
+
+
+class EngagementPolicy(FIFOPolicy):
+    name = 'engagement'
+
+    def score(self, item):
+        return math.log1p(item.get('play_count') or 0)
+
+
+class NoveltyPolicy(FIFOPolicy):
+    name = 'novelty'
+
+    def __init__(self):
+        self.author_counts = collections.Counter()
+
+    def observe(self, item):
+        # each item keeps the count of its author's videos queued up to it, so later ones rank lower.
+        # Items that already have one, e.g. from a saved frontier, only move the count forward
+        author_id = item.get('author_id')
+        if item.get('author_rank') is None:
+            self.author_counts[author_id] += 1
+            item['author_rank'] = self.author_counts[author_id]
+        else:
+            self.author_counts[author_id] = max(self.author_counts[author_id], item['author_rank'])
+
+    def score(self, item):
+        return 1 / (item.get('author_rank') or 1)
+
+
+class WeightedPolicy(FIFOPolicy):
+    name = 'weighted'
+
+    def __init__(self, depth=1.0, keyword=2.0, engagement=0.25, novelty=1.0):
+        self.weights = {'depth': depth, 'keyword': keyword, 'engagement': engagement, 'novelty': novelty}
+        self.bfs = BFSPolicy()
+        self.keyword = KeywordPolicy()
+        self.engagement = EngagementPolicy()
+        self.novelty = NoveltyPolicy()
+
+    def observe(self, item):
+        self.novelty.observe(item)
+
+    def score(self, item):
+        return self.weights['depth'] * self.bfs.score(item) \
+            + self.weights['keyword'] * self.keyword.score(item) \
+            + self.weights['engagement'] * self.engagement.score(item) \
+            + self.weights['novelty'] * self.novelty.score(item)
+
+
+POLICIES = {
+    policy.name: policy
+    for policy in [FIFOPolicy, BFSPolicy, KeywordPolicy, EngagementPolicy, NoveltyPolicy, WeightedPolicy]
+}
+
+
+class CrawlMetrics:
+    # counts the new relevant videos each fetch discovers, i.e. related videos that pass the relevance
+    # filter and weren't seen before, and appends one line per window of fetches to a jsonl file so
+    # that runs under different policies can be compared. Each line names the crawler, crawlers with
+    # different relevance filters aren't comparable.
+    def __init__(self, crawler, policy_name, path, window=100):
+        self.crawler = crawler
+        self.policy_name = policy_name
+        self.path = path
+        self.window = window
+        self.num_fetched = 0
+        self.num_discovered = 0
+        self._window_discovered = 0
+        self._window_fetched = 0
+
+    def record(self, num_discovered):
+        self.num_fetched += 1
+        self.num_discovered += num_discovered
+        self._window_discovered += num_discovered
+        self._window_fetched += 1
+        if self._window_fetched == self.window:
+            self._write_window()
+
+    def discovered_per_100(self):
+        return 100 * self.num_discovered / max(self.num_fetched, 1)
+
+    def _write_window(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({
+                'crawler': self.crawler,
+                'policy': self.policy_name,
+                'time': datetime.datetime.now().isoformat(),
+                'fetches': self._window_fetched,
+                'discovered': self._window_discovered,
+            }) + '\n')
+        self._window_discovered = 0
+        self._window_fetched = 0
+
+    def close(self):
+        # the last window of a run is usually short, it's written with its own number of fetches
+        if self._window_fetched:
+            self._write_window()
+
+
+def summarize_metrics(path, crawler=None):
+    df = pl.read_ndjson(path)
+    if crawler is not None:
+        df = df.filter(pl.col('crawler') == crawler)
+    return df.group_by('crawler', 'policy')\
+        .agg(pl.col('fetches').sum(), pl.col('discovered').sum())\
+        .with_columns((100 * pl.col('discovered') / pl.col('fetches')).alias('discovered_per_100'))\
+        .sort('crawler', 'discovered_per_100', descending=[False, True])
@@ -0,0 +1,322 @@
+import json
+import logging
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# Canonical layout of the TikTok item dicts we ingest. Bump SCHEMA_VERSION whenever a field is
+# added or retyped. Top-level keys TikTok adds that are not listed here are kept as JSON in 'extra',
+# unknown nested fields are dropped, and both are logged as drift.
+SCHEMA_VERSION = 1
+# parquet key-value metadata key the version is written under, see schema_metadata
+SCHEMA_VERSION_KEY = 'schema_version'
+
+AUTHOR = pl.Struct({
+    'id': pl.String,
+    'uniqueId': pl.String,
+    'nickname': pl.String,
+    'signature': pl.String,
+    'secUid': pl.String,
+    'avatarThumb': pl.String,
+    'avatarMedium': pl.String,
+    'avatarLarger': pl.String,
+    'verified': pl.Boolean,
+    'secret': pl.Boolean,
+    'privateAccount': pl.Boolean,
+    'ftc': pl.Boolean,
+    'isADVirtual': pl.Boolean,
+    'ttSeller': pl.Boolean,
+    'openFavorite': pl.Boolean,
+    'relation': pl.Int64,
+    'commentSetting': pl.Int64,
+    'duetSetting': pl.Int64,
+    'stitchSetting': pl.Int64,
+    'downloadSetting': pl.Int64,
+    'createTime': pl.Int64,
+    'region': pl.String,
+    'language': pl.String,
+})
+
+AUTHOR_STATS = pl.Struct({
+    'followerCount': pl.Int64,
+    'followingCount': pl.Int64,
+    'friendCount': pl.Int64,
+    'heart': pl.Int64,
+    'heartCount': pl.Int64,
+    'videoCount': pl.Int64,
+    'diggCount': pl.Int64,
+})
+
+STATS = pl.Struct({
+    'diggCount': pl.Int64,
+    'shareCount': pl.Int64,
+    'commentCount': pl.Int64,
+    'playCount': pl.Int64,
+    'collectCount': pl.Int64,
+})
+
+# TikTok sends the same counters again as strings
+STATS_V2 = pl.Struct({
+    'diggCount': pl.String,
+    'shareCount': pl.String,
+    'commentCount': pl.String,
+    'playCount': pl.String,
+    'collectCount': pl.String,
+    'repostCount': pl.String,
+})
+
+SUBTITLE_INFO = pl.Struct({
+    'LanguageID': pl.String,
+    'LanguageCodeName': pl.String,
+    'Url': pl.String,
+    'UrlExpire': pl.String,
+    'Size': pl.String,
+    'Version': pl.String,
+    'Format': pl.String,
+    'Source': pl.String,
+})
+
+VIDEO = pl.Struct({
+    'id': pl.String,
+    'height': pl.Int64,
+    'width': pl.Int64,
+    'duration': pl.Int64,
+    'ratio': pl.String,
+    'cover': pl.String,
+    'originCover': pl.String,
+    'dynamicCover': pl.String,
+    'playAddr': pl.String,
+    'downloadAddr': pl.String,
+    'format': pl.String,
+    'bitrate': pl.Int64,
+    'encodedType': pl.String,
+    'definition': pl.String,
+    'videoQuality': pl.String,
+    'codecType': pl.String,
+    'VQScore': pl.String,
+    'size': pl.String,
+    'subtitleInfos': pl.List(SUBTITLE_INFO),
+})
+
+MUSIC = pl.Struct({
+    'id': pl.String,
+    'title': pl.String,
+    'playUrl': pl.String,
+    'coverLarge': pl.String,
+    'coverMedium': pl.String,
+    'coverThumb': pl.String,
+    'authorName': pl.String,
+    'album': pl.String,
+    'original': pl.Boolean,
+    'duration': pl.Int64,
+})
+
+CHALLENGE = pl.Struct({
+    'id': pl.String,
+    'title': pl.String,
+    'desc': pl.String,
+})
+
+TEXT_EXTRA = pl.Struct({
+    'hashtagId': pl.String,
+    'hashtagName': pl.String,
+    'userId': pl.String,
+    'userUniqueId': pl.String,
+    'secUid': pl.String,
+    'type': pl.Int64,
+    'subType': pl.Int64,
+    'start': pl.Int64,
+    'end': pl.Int64,
+    'isCommerce': pl.Boolean,
+})
+
+CONTENT = pl.Struct({
+    'desc': pl.String,
+    'textExtra': pl.List(TEXT_EXTRA),
+})
+
+VIDEO_SCHEMA = pl.Schema({
+    'id': pl.String,
+    'desc': pl.String,
+    'createTime': pl.Int64,
+    'scheduleTime': pl.Int64,
+    'author': AUTHOR,
+    'authorStats': AUTHOR_STATS,
+    'stats': STATS,
+    'statsV2': STATS_V2,
+    'video': VIDEO,
+    'music': MUSIC,
+    'challenges': pl.List(CHALLENGE),
+    'textExtra': pl.List(TEXT_EXTRA),
+    'contents': pl.List(CONTENT),
+    'suggestedWords': pl.List(pl.String),
+    'diversificationLabels': pl.List(pl.String),
+    'locationCreated': pl.String,
+    'textLanguage': pl.String,
+    'textTranslatable': pl.Boolean,
+    'isAd': pl.Boolean,
+    'duetEnabled': pl.Boolean,
+    'stitchEnabled': pl.Boolean,
+    'shareEnabled': pl.Boolean,
+    'privateItem': pl.Boolean,
+    'scrape_date': pl.Datetime('us'),
+    # derived by relevance.RelevanceClassifier
+    'subtitleLanguages': pl.List(pl.String),
+    'keywordScore': pl.Int64,
+    'keywordHits': pl.List(pl.String),
+    'romanianLanguage': pl.Boolean,
+    'extra': pl.String,
+})
+
+# user info comes back as the author fields at the top level
+USER_SCHEMA = pl.Schema({
+    **{f.name: f.dtype for f in AUTHOR.fields},
+    'stats': AUTHOR_STATS,
+    'extra': pl.String,
+})
+
+# one row per transcribed video, see transcribe.to_df
+TRANSCRIPT_SCHEMA = pl.Schema({
+    'video_id': pl.UInt64,
+    'transcript': pl.Struct({
+        'segments': pl.List(pl.Struct({
+            'start': pl.Float64,
+            'end': pl.Float64,
+            'speaker': pl.String,
+            'text': pl.String,
+        })),
+    }),
+    # pyannote embeddings are float32 to begin with, older transcripts stored them as float64
+    'speaker_embeddings': pl.List(pl.Array(pl.Float32, 256)),
+})
+
+_logged_drift = set()
+
+# the API has sent flags as strings at times, bool("false") would be True
+def schema_metadata():
+    return {SCHEMA_VERSION_KEY: str(SCHEMA_VERSION)}
+
+
+def check_schema_version(path):
+    # files from before the version was written have none and are conformed like any older layout,
+    # a file from a newer version may have fields this code would drop or mistype
+    version = pl.read_parquet_metadata(path).get(SCHEMA_VERSION_KEY)
+    if version is not None and int(version) > SCHEMA_VERSION:
+        raise ValueError(f"{path} has schema version {version}, newer than this code's {SCHEMA_VERSION}")
+    return int(version) if version is not None else None
+
+
+TRUE_STRINGS = {'true', '1', 'yes'}
+FALSE_STRINGS = {'false', '0', 'no', ''}
+
+def _parse_bool(value):
+    value = value.strip().lower()
+    if value in TRUE_STRINGS:
+        return True
+    if value in FALSE_STRINGS:
+        return False
+    raise ValueError(value)
+
+def _log_drift(path, what):
+    if (path, what) not in _logged_drift:
+        _logged_drift.add((path, what))
+        logger.warning(f"Schema drift at {path}: {what}")
+
+def _normalize_value(value, dtype, path):
+    if value is None:
+        return None
+    if isinstance(dtype, pl.Struct):
+        if not isinstance(value, dict):
+            _log_drift(path, f"expected object, got {type(value).__name__}")
+            return None
+        names = {f.name for f in dtype.fields}
+        for key in value.keys() - names:
+            _log_drift(f"{path}.{key}", 'unknown field dropped')
+        return {f.name: _normalize_value(value.get(f.name), f.dtype, f"{path}.{f.name}") for f in dtype.fields}
+    if isinstance(dtype, pl.List):
+        if not isinstance(value, (list, tuple)):
+            _log_drift(path, f"expected list, got {type(value).__name__}")
+            return None
+        return [_normalize_value(v, dtype.inner, f"{path}[]") for v in value]
+    try:
+        if dtype == pl.String:
+            if isinstance(value, str):
+                return value
+            return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+        if dtype.is_integer():
+            return int(value)
+        if dtype.is_float():
+            return float(value)
+        if dtype == pl.Boolean:
+            if isinstance(value, str):
+                return _parse_bool(value)
+            return bool(value)
+    except (TypeError, ValueError):
+        _log_drift(path, f"could not convert {type(value).__name__} to {dtype}")
+        return None
+    return value
+
+def normalize(records, schema=VIDEO_SCHEMA):
+    rows = []
+    for record in records:
+        row = {}
+        extra = {}
+        for key, value in record.items():
+            if key in schema:
+                row[key] = _normalize_value(value, schema[key], key)
+            else:
+                _log_drift(key, 'unknown column kept in extra')
+                extra[key] = value
+        if 'extra' in schema and extra:
+            row['extra'] = json.dumps(extra, default=str)
+        rows.append(row)
+    return pl.DataFrame(rows, schema=schema)
+
+def _conform_expr(expr, src, dst, path):
+    if src == dst:
+        return expr
+    if src == pl.Null:
+        return expr.cast(dst)
+    if isinstance(dst, pl.Struct) and isinstance(src, pl.Struct):
+        src_fields = {f.name: f.dtype for f in src.fields}
+        for name in src_fields.keys() - {f.name for f in dst.fields}:
+            _log_drift(f"{path}.{name}", 'unknown field dropped')
+        fields = [
+            _conform_expr(expr.struct.field(f.name), src_fields[f.name], f.dtype, f"{path}.{f.name}").alias(f.name)
+            if f.name in src_fields else pl.lit(None, dtype=f.dtype).alias(f.name)
+            for f in dst.fields
+        ]
+        return pl.when(expr.is_not_null()).then(pl.struct(fields))
+    if isinstance(dst, pl.List) and isinstance(src, (pl.List, pl.Array)):
+        return expr.cast(pl.List(src.inner)).list.eval(_conform_expr(pl.element(), src.inner, dst.inner, f"{path}[]"))
+    if isinstance(dst, pl.Array) and isinstance(src, pl.Array) and src.size == dst.size and src.inner.is_numeric() and dst.inner.is_numeric():
+        return expr.cast(dst)
+    if dst == pl.String and isinstance(src, pl.Struct):
+        return expr.struct.json_encode()
+    if dst == pl.Boolean and src == pl.String:
+        _log_drift(path, f"{src} parsed as {dst}")
+        lowered = expr.str.strip_chars().str.to_lowercase()
+        return pl.when(lowered.is_in(list(TRUE_STRINGS))).then(True).when(lowered.is_in(list(FALSE_STRINGS))).then(False)
+    _log_drift(path, f"{src} cast to {dst}")
+    return expr.cast(dst, strict=False)
+
+def conform(df, schema=VIDEO_SCHEMA, keep_unknown=False):
+    # columnar equivalent of normalize for frames already on disk, works on DataFrames and LazyFrames.
+    # keep_unknown leaves columns outside the schema as they are, after the schema's, instead of in extra
+    src_schema = df.collect_schema()
+    if len(src_schema) == 0:
+        return pl.DataFrame(schema=schema) if isinstance(df, pl.DataFrame) else pl.LazyFrame(schema=schema)
+    exprs = [
+        _conform_expr(pl.col(name), src_schema[name], dtype, name).alias(name) if name in src_schema
+        else pl.lit(None, dtype=dtype).alias(name)
+        for name, dtype in schema.items()
+    ]
+    unknown = [name for name in src_schema.names() if name not in schema]
+    if keep_unknown:
+        return df.select(exprs + [pl.col(name) for name in unknown])
+    for name in unknown:
+        _log_drift(name, 'unknown column kept in extra')
+    if unknown and 'extra' in schema and 'extra' not in src_schema:
+        exprs[list(schema).index('extra')] = pl.struct(unknown).struct.json_encode().alias('extra')
+    return df.select(exprs)
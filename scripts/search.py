@@ -1,25 +1,41 @@
+import argparse
 import asyncio
-import json
+import logging
+import time
 
-import polars as pl
-from pytok.tiktok import PyTok
+from crawl import ApiWrapper, DeltaWriter, write_report
+from schema import VIDEO_SCHEMA
+from store import FragmentStore
 
-hashtag_name = 'romania'
+logger = logging.getLogger(__name__)
 
-async def main():
-    terms = ['romania', 'bucharest', 'georgescu', 'lasconi']
-
-    async with PyTok(manual_captcha_solves=True) as api:
-        for term in terms:
-            search = api.search(term)
+async def collect_search(api, term):
+    # the old single file ./data/<term>.parquet.zstd is read as part of the store
+    store = FragmentStore(f'./data/{term}', schema=VIDEO_SCHEMA)
+    writer = DeltaWriter(store)
+    row = {'name': term, 'videos': 0, 'new_videos': 0, 'seconds': 0.0, 'error': None}
+    try:
+        stats = await api.get_search_videos(term, writer)
+        row.update(videos=stats['videos'], seconds=stats['seconds'])
+    except Exception as e:
+        logger.warning(f"Failed to search {term}: {e}")
+        row['error'] = str(e)
+    finally:
+        store.close()
+    row['new_videos'] = writer.num_new
+    return row
 
-            videos = []
-            async for video in search.videos(count=1000):
-                video_info = await video.info()
-                videos.append(video_info)
+async def main(args):
+    terms = ['romania', 'bucharest', 'georgescu', 'lasconi']
 
-            df = pl.DataFrame(videos)
-            df.write_parquet(f'./data/{term}.parquet.zstd', compression='zstd')
+    start_time = time.perf_counter()
+    async with ApiWrapper('pytok', num_sessions=args.sessions, videos_per_min=args.videos_per_min, session_delay=args.session_delay) as api:
+        rows = await asyncio.gather(*[collect_search(api, term) for term in terms])
+    write_report('search', rows, time.perf_counter() - start_time)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--videos-per-min', type=float, default=None, help='budget shared by all sessions')
+    parser.add_argument('--session-delay', type=float, default=5.0, help='seconds between starting sessions')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import polars as pl
+
+from transcripts import TRANSCRIPTS_PATH, scan_transcripts
+
+INDEX_PATH = './data/tiktok/speaker_index'
+DIM = 256
+
+# per-row files, appended to on insert and memory-mapped on load
+ROW_FILES = {
+    'vectors': ('vectors.f32', np.float32),
+    'video_ids': ('video_ids.u64', np.uint64),
+    # position of the embedding in the video's speaker_embeddings, i.e. SPEAKER_00, SPEAKER_01, ...
+    'speakers': ('speakers.u16', np.uint16),
+    # nearest centroid of each vector, -1 until the index is trained
+    'lists': ('lists.i32', np.int32),
+}
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def assign_lists(vectors, centroids, batch_size=65536):
+    if len(vectors) == 0:
+        return np.zeros(0, np.int32)
+    return np.concatenate([
+        np.argmax(np.asarray(vectors[i:i + batch_size]) @ centroids.T, axis=1)
+        for i in range(0, len(vectors), batch_size)
+    ]).astype(np.int32)
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    # spherical k-means, centroids stay unit length so a dot product with them is a cosine similarity
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=k) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class SpeakerIndex:
+    # An IVF index over unit-length speaker embeddings: vectors are bucketed by their nearest k-means
+    # centroid and a query only scores the buckets of its nprobe nearest centroids. Before there are
+    # enough vectors to train on, every vector is scored.
+    def __init__(self, path=INDEX_PATH, dim=DIM, num_lists=256):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        meta = self._read_meta()
+        self.dim = meta.get('dim', dim)
+        self.num_lists = meta.get('num_lists', num_lists)
+        self.count = meta.get('count', 0)
+        centroids_path = self._file('centroids.npy')
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._truncate()
+        self._open()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        meta_path = self._file('meta.json')
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self):
+        tmp_path = self._file('.meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'num_lists': self.num_lists, 'count': self.count}, f)
+        os.replace(tmp_path, self._file('meta.json'))
+
+    def _row_bytes(self, name):
+        file_name, dtype = ROW_FILES[name]
+        return np.dtype(dtype).itemsize * (self.dim if name == 'vectors' else 1)
+
+    def _truncate(self):
+        # meta.json is written after the row files, so rows past its count are from an interrupted insert
+        for name, (file_name, _) in ROW_FILES.items():
+            path = self._file(file_name)
+            if os.path.exists(path) and os.path.getsize(path) > self.count * self._row_bytes(name):
+                os.truncate(path, self.count * self._row_bytes(name))
+
+    def _open(self):
+        for name, (file_name, dtype) in ROW_FILES.items():
+            shape = (self.count, self.dim) if name == 'vectors' else (self.count,)
+            if self.count == 0:
+                rows = np.zeros(shape, dtype)
+            else:
+                rows = np.memmap(self._file(file_name), dtype=dtype, mode='r', shape=shape)
+            setattr(self, name, rows)
+        self._inverted = None
+
+    def __len__(self):
+        return self.count
+
+    def indexed_video_ids(self):
+        return np.unique(self.video_ids)
+
+    def add(self, vectors, video_ids, speakers):
+        vectors = normalize_rows(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embeddings, got {vectors.shape[1]}")
+        if self.centroids is not None:
+            lists = assign_lists(vectors, self.centroids)
+        else:
+            lists = np.full(len(vectors), -1, np.int32)
+        rows = {
+            'vectors': vectors,
+            'video_ids': np.asarray(video_ids, np.uint64),
+            'speakers': np.asarray(speakers, np.uint16),
+            'lists': lists,
+        }
+        for name, (file_name, dtype) in ROW_FILES.items():
+            with open(self._file(file_name), 'ab') as f:
+                f.write(np.ascontiguousarray(rows[name], dtype=dtype).tobytes())
+        self.count += len(vectors)
+        self._write_meta()
+        self._open()
+        # faiss' rule of thumb is ~39 training points per centroid
+        if self.centroids is None and self.count >= 39 * self.num_lists:
+            self.train()
+
+    def train(self, sample_size=100_000, seed=0):
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(self.count, min(sample_size, self.count), replace=False))
+        self.centroids = kmeans(np.asarray(self.vectors[sample]), min(self.num_lists, len(sample)), seed=seed)
+        tmp_path = self._file('.centroids.npy.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.centroids)
+        os.replace(tmp_path, self._file('centroids.npy'))
+
+        lists = assign_lists(self.vectors, self.centroids)
+        file_name, dtype = ROW_FILES['lists']
+        tmp_path = self._file(f".{file_name}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(lists.astype(dtype).tobytes())
+        os.replace(tmp_path, self._file(file_name))
+        self._open()
+
+    def _inverted_lists(self):
+        # row numbers grouped by list, list l (with -1 for untrained rows) is order[offsets[l + 1]:offsets[l + 2]]
+        if self._inverted is None:
+            lists = np.asarray(self.lists)
+            order = np.argsort(lists, kind='stable')
+            offsets = np.searchsorted(lists[order], np.arange(-1, self.num_lists + 1))
+            self._inverted = (order, offsets)
+        return self._inverted
+
+    def _candidates(self, query, nprobe):
+        if self.centroids is None:
+            return np.arange(self.count)
+        order, offsets = self._inverted_lists()
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        rows = [order[offsets[l + 1]:offsets[l + 2]] for l in [-1, *probe]]
+        # sorted rows read the memory-mapped vectors front to back
+        return np.sort(np.concatenate(rows))
+
+    def search(self, query, k=10, nprobe=8):
+        query = normalize_rows(np.atleast_2d(query))[0]
+        rows = self._candidates(query, nprobe)
+        if len(rows) == 0:
+            return pl.DataFrame(schema={'video_id': pl.UInt64, 'speaker': pl.UInt16, 'similarity': pl.Float32})
+        similarities = np.asarray(self.vectors[rows]) @ query
+        top = np.argpartition(-similarities, min(k, len(rows)) - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return pl.DataFrame({
+            'video_id': np.asarray(self.video_ids[rows[top]]),
+            'speaker': np.asarray(self.speakers[rows[top]]),
+            'similarity': similarities[top],
+        })
+
+    def vector(self, video_id, speaker):
+        rows = np.flatnonzero((self.video_ids == np.uint64(video_id)) & (self.speakers == speaker))
+        if len(rows) == 0:
+            raise KeyError(f"No embedding for speaker {speaker} of video {video_id}")
+        return np.asarray(self.vectors[rows[0]])
+
+
+def update_from_transcripts(index, transcripts_path=TRANSCRIPTS_PATH):
+    # only transcripts of videos that aren't in the index yet are read
+    lf = scan_transcripts(transcripts_path, columns=['video_id', 'speaker_embeddings'])
+    if 'speaker_embeddings' not in lf.collect_schema().names():
+        return 0
+    df = lf.filter(~pl.col('video_id').is_in(pl.Series(index.indexed_video_ids(), dtype=pl.UInt64)))\
+        .with_columns(pl.int_ranges(pl.col('speaker_embeddings').list.len()).alias('speaker'))\
+        .explode(['speaker_embeddings', 'speaker'])\
+        .drop_nulls('speaker_embeddings')\
+        .collect()
+    if len(df) == 0:
+        return 0
+    vectors = df['speaker_embeddings'].to_numpy()
+    # pyannote gives NaN embeddings for speakers with too little speech to embed
+    finite = np.isfinite(vectors).all(axis=1)
+    index.add(vectors[finite], df['video_id'].to_numpy()[finite], df['speaker'].to_numpy()[finite])
+    return int(finite.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--index-path', default=INDEX_PATH)
+    parser.add_argument('--transcripts-path', default=TRANSCRIPTS_PATH)
+    parser.add_argument('--num-lists', type=int, default=256)
+    parser.add_argument('--retrain', action='store_true')
+    parser.add_argument('--query-video', type=int, default=None)
+    parser.add_argument('--query-speaker', type=int, default=0)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--nprobe', type=int, default=8)
+    args = parser.parse_args()
+
+    index = SpeakerIndex(args.index_path, num_lists=args.num_lists)
+    num_added = update_from_transcripts(index, args.transcripts_path)
+    print(f"Added {num_added} speaker embeddings, {len(index)} in the index")
+    if args.retrain and len(index) > 0:
+        index.train()
+
+    if args.query_video is not None:
+        query = index.vector(args.query_video, args.query_speaker)
+        start_time = time.perf_counter()
+        matches = index.search(query, k=args.k, nprobe=args.nprobe)
+        print(f"Searched in {(time.perf_counter() - start_time) * 1e3:.1f} ms")
+        print(matches)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    # fn(item) returns the item to pass on, or None to drop it. make_queue(queue_size) can swap in
+    # a queue that reorders its items, as long as it stays bounded
+    def __init__(self, name, fn, num_workers=1, queue_size=8, make_queue=queue.Queue):
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.queue = make_queue(queue_size)
+        self.num_processed = 0
+        self.num_dropped = 0
+        self.num_errors = 0
+        self.busy_seconds = 0.0
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+        self._workers_left = num_workers
+
+    def _record(self, start, end, dropped, error):
+        with self._lock:
+            self.num_processed += 1
+            self.num_dropped += int(dropped)
+            self.num_errors += int(error)
+            self.busy_seconds += end - start
+            self.first_start = start if self.first_start is None else self.first_start
+            self.last_end = end
+
+    def stats(self):
+        wall = (self.last_end - self.first_start) if self.first_start is not None else 0.0
+        return {
+            'stage': self.name,
+            'workers': self.num_workers,
+            'processed': self.num_processed,
+            'dropped': self.num_dropped,
+            'errors': self.num_errors,
+            'mean_latency_s': self.busy_seconds / max(self.num_processed, 1),
+            'items_per_s': self.num_processed / wall if wall > 0 else 0.0,
+            'queued': self.queue.qsize(),
+        }
+
+
+class Pipeline:
+    # each stage's workers read from its bounded queue and put into the next stage's, so a slow
+    # stage fills the queue in front of it and blocks the stages upstream instead of growing memory.
+    # on_drop(stage_name, item) is called for every item a stage dropped or failed on
+    def __init__(self, stages, on_drop=None):
+        self.stages = stages
+        self.on_drop = on_drop
+
+    def _worker(self, i):
+        stage = self.stages[i]
+        next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            out = None
+            error = False
+            try:
+                out = stage.fn(item)
+            except Exception as e:
+                error = True
+                logger.warning(f"{stage.name} failed: {e!r}")
+            stage._record(start, time.perf_counter(), out is None and not error, error)
+            if out is None and self.on_drop is not None:
+                self.on_drop(stage.name, item)
+            if out is not None and next_stage is not None:
+                next_stage.queue.put(out)
+        with stage._lock:
+            stage._workers_left -= 1
+            last = stage._workers_left == 0
+        # the last worker out tells every worker of the next stage to finish
+        if last and next_stage is not None:
+            for _ in range(next_stage.num_workers):
+                next_stage.queue.put(_DONE)
+
+    def run(self, items):
+        threads = [
+            threading.Thread(target=self._worker, args=(i,), daemon=True, name=f"{stage.name}-{j}")
+            for i, stage in enumerate(self.stages)
+            for j in range(stage.num_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            self.stages[0].queue.put(item)
+        for _ in range(self.stages[0].num_workers):
+            self.stages[0].queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    def report(self):
+        return pl.DataFrame([stage.stats() for stage in self.stages])
+
+
+class S3Source:
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def list_objects(self, prefix, start_after=None):
+        # keys come back in lexicographic order, starting after start_after when it's given
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after is not None:
+            kwargs['StartAfter'] = start_after
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**kwargs):
+            for obj in page.get('Contents', []):
+                yield {'key': obj['Key'], 'last_modified': obj['LastModified'], 'etag': obj['ETag'].strip('"'), 'size': obj['Size']}
+
+    def list_keys(self, prefix):
+        for obj in self.list_objects(prefix):
+            yield obj['key']
+
+    def read(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+
+class LocalSource:
+    # a directory laid out like the bucket, e.g. <root>/tiktok/bytes/<video_id>.mp4
+    def __init__(self, root):
+        self.root = root
+
+    def list_keys(self, prefix):
+        for dir_path, _, file_names in os.walk(os.path.join(self.root, prefix)):
+            for file_name in file_names:
+                yield os.path.relpath(os.path.join(dir_path, file_name), self.root).replace(os.sep, '/')
+
+    def list_objects(self, prefix, start_after=None):
+        keys = sorted(key for key in self.list_keys(prefix) if start_after is None or key > start_after)
+        for key in keys:
+            stat = os.stat(os.path.join(self.root, key))
+            yield {
+                'key': key,
+                'last_modified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc),
+                # no content hash without reading the file, mtime and size change whenever it's rewritten
+                'etag': f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                'size': stat.st_size,
+            }
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+
+def make_source(kind, location):
+    if kind == 's3':
+        import boto3
+        return S3Source(boto3.client('s3'), location)
+    return LocalSource(location)
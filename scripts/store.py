@@ -0,0 +1,149 @@
+import datetime
+import glob
+import os
+import threading
+import uuid
+
+import polars as pl
+
+from schema import check_schema_version, conform, schema_metadata
+
+FRAGMENT_SUFFIX = '.parquet.zstd'
+
+
+class FragmentStore:
+    # A logical parquet dataset stored as a directory of small append-only fragments,
+    # partitioned into subdirectories, e.g. ./data/fetched_videos/date=2025-05-01/part-*.parquet.zstd
+    # Compaction deletes the fragments it merged right after writing their replacement. A scan in
+    # another process that listed the old fragments before that fails when it reads them, read()
+    # lists them again and retries once, a lazy scan() collected later has to be redone by the caller.
+    def __init__(self, path, schema=None, partition_by='date', num_buckets=16, unique_key='id', compact_threshold=32, background=True):
+        assert partition_by in ('date', 'id_hash', None)
+        self.path = path
+        # when set, every fragment is conformed to this schema so older fragments line up with newer ones
+        self.schema = schema
+        self.partition_by = partition_by
+        self.num_buckets = num_buckets
+        self.unique_key = unique_key
+        self.compact_threshold = compact_threshold
+        self.background = background
+        # the single file the crawlers used to rewrite, read as the oldest fragment until a compact()
+        # of the whole store folds it into the partitions
+        self.legacy_path = path.rstrip('/') + FRAGMENT_SUFFIX
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        os.makedirs(path, exist_ok=True)
+
+    def _partitions(self, df):
+        if self.partition_by == 'date':
+            if 'scrape_date' in df.columns and df.schema['scrape_date'] in (pl.Datetime, pl.Date):
+                key = pl.col('scrape_date').dt.strftime('date=%Y-%m-%d').fill_null(f"date={datetime.date.today()}")
+            else:
+                key = pl.lit(f"date={datetime.date.today()}")
+        elif self.partition_by == 'id_hash':
+            key = pl.format('bucket={}', (pl.col(self.unique_key).hash() % self.num_buckets).cast(pl.String))
+        else:
+            key = pl.lit('all')
+        df = df.with_columns(key.alias('__partition'))
+        for (partition,), partition_df in df.group_by('__partition'):
+            yield partition, partition_df.drop('__partition')
+
+    def _write_fragment(self, partition_dir, df, prefix='part'):
+        os.makedirs(partition_dir, exist_ok=True)
+        name = f"{prefix}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}{FRAGMENT_SUFFIX}"
+        final_path = os.path.join(partition_dir, name)
+        tmp_path = os.path.join(partition_dir, f".{name}.tmp")
+        df.write_parquet(tmp_path, compression='zstd', metadata=schema_metadata() if self.schema is not None else None)
+        # readers only glob finished fragments, so a crash mid-write never leaves a torn file visible
+        os.replace(tmp_path, final_path)
+        return final_path
+
+    def append(self, df, fragment_prefix='part'):
+        if isinstance(df, list):
+            df = pl.DataFrame(df)
+        if len(df) == 0:
+            return []
+        paths = []
+        for partition, partition_df in self._partitions(df):
+            partition_dir = os.path.join(self.path, partition)
+            paths.append(self._write_fragment(partition_dir, partition_df, prefix=fragment_prefix))
+            # compact_threshold=None leaves compaction to whoever calls compact(), e.g. when several
+            # processes append to the same store
+            if self.compact_threshold is not None and len(self._fragments(partition_dir)) >= self.compact_threshold:
+                self._schedule_compaction(partition_dir)
+        return paths
+
+    def _fragments(self, partition_dir):
+        return sorted(glob.glob(os.path.join(partition_dir, f"*{FRAGMENT_SUFFIX}")))
+
+    def fragments(self):
+        files = sorted(glob.glob(os.path.join(self.path, '*', f"*{FRAGMENT_SUFFIX}")))
+        if os.path.exists(self.legacy_path):
+            files = [self.legacy_path] + files
+        return files
+
+    def scan(self, columns=None, files=None):
+        # files narrows the scan to some of fragments(), e.g. the ones added since a previous read
+        files = self.fragments() if files is None else files
+        if not files:
+            return pl.LazyFrame()
+        frames = [pl.scan_parquet(f) for f in files]
+        if self.schema is not None:
+            for f in files:
+                check_schema_version(f)
+            frames = [conform(f, self.schema) for f in frames]
+        if columns is not None:
+            frames = [f.select([c for c in columns if c in f.collect_schema().names()]) for f in frames]
+        return pl.concat(frames, how='diagonal_relaxed')
+
+    def read(self, columns=None):
+        try:
+            return self.scan(columns=columns).collect()
+        except FileNotFoundError:
+            # a compaction in another process removed fragments between listing and reading them
+            return self.scan(columns=columns).collect()
+
+    def exists(self):
+        return len(self.fragments()) > 0
+
+    def _read_fragment(self, path):
+        df = pl.read_parquet(path)
+        if self.schema is not None:
+            check_schema_version(path)
+            df = conform(df, self.schema)
+        return df
+
+    def compact(self, partition_dir=None):
+        with self._compact_lock:
+            # the legacy file goes before each partition's fragments, so newer copies of its rows win
+            legacy = {}
+            if partition_dir is None and os.path.exists(self.legacy_path):
+                legacy = {os.path.join(self.path, p): df for p, df in self._partitions(self._read_fragment(self.legacy_path))}
+            partition_dirs = [partition_dir] if partition_dir else sorted(set(glob.glob(os.path.join(self.path, '*'))) | set(legacy))
+            for d in partition_dirs:
+                files = self._fragments(d)
+                if len(files) < 2 and d not in legacy:
+                    continue
+                frames = ([legacy[d]] if d in legacy else []) + [self._read_fragment(f) for f in files]
+                df = pl.concat(frames, how='diagonal_relaxed')
+                if self.unique_key in df.columns:
+                    df = df.unique(self.unique_key, keep='last', maintain_order=True)
+                self._write_fragment(d, df, prefix='compacted')
+                # the compacted fragment is in place before its inputs go, so nothing is ever missing
+                for f in files:
+                    os.remove(f)
+            if legacy:
+                os.remove(self.legacy_path)
+
+    def _schedule_compaction(self, partition_dir):
+        if not self.background:
+            self.compact(partition_dir)
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, args=(partition_dir,), daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
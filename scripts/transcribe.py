@@ -1,5 +1,11 @@
+import argparse
+import concurrent.futures
 import io
+import itertools
+import logging
 import os
+import queue
+import time
 
 import boto3
 from PIL import Image
@@ -11,7 +17,6 @@ import json
 import os
 
 import dotenv
-from moviepy import VideoFileClip
 import numpy as np
 from pyannote.audio import Pipeline
 import pandas as pd
@@ -20,60 +25,41 @@ from tqdm import tqdm
 import whisperx
 from whisperx.audio import SAMPLE_RATE
 
+from align_cache import AlignModelCache, LanguageGroupedQueue
+from audio import decode_audio, prefetch, transcribe_packed
+from inventory import MediaInventory
+from leases import default_worker_id, open_lease_table
+from schema import TRANSCRIPT_SCHEMA
+# pyannote's Pipeline is the diarization model, this one runs the GPU stages
+from stages import Pipeline as StagePipeline, Stage, make_source
+from transcripts import TRANSCRIPTS_PATH, transcript_store, transcribed_ids
+
+logger = logging.getLogger(__name__)
+
 def to_df(transcript_data):
     batch_transcript_df = pl.DataFrame(
         {
             'video_id': [d['video_id'] for d in transcript_data],
             'transcript': [d['transcript'] for d in transcript_data],
-            'speaker_embeddings': [[d['speaker_embeddings'][i].astype(np.float64) for i in range(d['speaker_embeddings'].shape[0])] for d in transcript_data],
+            'speaker_embeddings': [[d['speaker_embeddings'][i].astype(np.float32) for i in range(d['speaker_embeddings'].shape[0])] for d in transcript_data],
         },
-        schema={
-            'video_id': pl.UInt64,
-            'transcript': pl.Struct({
-                'segments': pl.List(pl.Struct({
-                    'start': pl.Float64,
-                    'end': pl.Float64,
-                    'speaker': pl.String,
-                    'text': pl.String
-                }))
-            }),
-            'speaker_embeddings': pl.List(pl.Array(pl.Float64, 256))
-        }
+        schema=TRANSCRIPT_SCHEMA
     )
     return batch_transcript_df
 
-def try_create_audio(video_path, audio_file_path):
-    try:
-        with VideoFileClip(video_path) as video:
-            video.audio.write_audiofile(audio_file_path)
-        return True
-    except OSError:
-        return False
-    except AttributeError:
-        return False
-
-def apply_whisperx_pipeline(audio, model, diarize_model):
-    device = "cuda" 
-    batch_size = 16 # reduce if low on GPU mem
-
-    # 1. Transcribe with original whisper (batched)
-    # save model to local path (optional)
-    # model_dir = "/path/"
-    # model = whisperx.load_model("large-v2", device, compute_type=compute_type, download_root=model_dir)
-
-    
-    result = model.transcribe(audio, batch_size=batch_size)
-
-    # delete model if low on GPU resources
-    # import gc; gc.collect(); torch.cuda.empty_cache(); del model
-
+def align(result, audio, device, align_cache=None):
     # 2. Align whisper output
-    model_a, metadata = whisperx.load_align_model(language_code=result["language"], device=device)
+    if align_cache is not None:
+        model_a, metadata = align_cache.get(result["language"])
+    else:
+        model_a, metadata = whisperx.load_align_model(language_code=result["language"], device=device)
     result = whisperx.align(result["segments"], model_a, metadata, audio, device, return_char_alignments=False)
 
     # delete model if low on GPU resources
     # import gc; gc.collect(); torch.cuda.empty_cache(); del model_a
+    return result
 
+def diarize(result, audio, diarize_model):
     # 3. Assign speaker labels
     # add min/max number of speakers if known
     audio_data = {
@@ -88,8 +74,93 @@ def apply_whisperx_pipeline(audio, model, diarize_model):
     result = whisperx.assign_word_speakers(diarize_segments, result)
     return result, diarize_segments, embeddings
 
+def align_and_diarize(result, audio, diarize_model, device, align_cache=None):
+    result = align(result, audio, device, align_cache)
+    return diarize(result, audio, diarize_model)
+
+def apply_whisperx_pipeline(audio, model, diarize_model, device="cuda", batch_size=16, align_cache=None):
+    # batch_size: reduce if low on GPU mem
+
+    # 1. Transcribe with original whisper (batched)
+    # save model to local path (optional)
+    # model_dir = "/path/"
+    # model = whisperx.load_model("large-v2", device, compute_type=compute_type, download_root=model_dir)
+
+    
+    result = model.transcribe(audio, batch_size=batch_size)
+
+    # delete model if low on GPU resources
+    # import gc; gc.collect(); torch.cuda.empty_cache(); del model
+
+    return align_and_diarize(result, audio, diarize_model, device, align_cache)
+
+def chunks(items, size):
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+def load_video_audio(source, video_data):
+    # the video never touches disk, ffmpeg decodes the downloaded bytes straight to PCM
+    file_byte_string = source.read(video_data['key'])
+    return decode_audio(file_byte_string, sr=SAMPLE_RATE)
+
+_worker = {}
+
+def init_cpu_worker(compute_type, threads, hf_token, source_kind, source_location, align_cache_bytes):
+    # runs once per process, so each worker loads its models a single time
+    torch.set_num_threads(threads)
+    _worker['model'] = whisperx.load_model("large-v2", "cpu", compute_type=compute_type, threads=threads)
+    _worker['diarize_model'] = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=hf_token)
+    _worker['align_cache'] = AlignModelCache("cpu", max_bytes=align_cache_bytes)
+    _worker['source'] = make_source(source_kind, source_location)
 
-def main():
+def transcribe_cpu_batch(video_batch, batch_size, pack_seconds, decode_threads, group_by_language):
+    audios = []
+    load = lambda video_data: load_video_audio(_worker['source'], video_data)
+    for video_data, audio in prefetch(video_batch, load, num_threads=decode_threads):
+        if audio is not None:
+            audios.append((video_data['video_id'], audio))
+
+    start_time = time.perf_counter()
+    # clips shorter than pack_seconds are grouped until a group would exceed it, longer clips go alone
+    groups = []
+    group_seconds = 0.0
+    for video_id, audio in sorted(audios, key=lambda a: len(a[1])):
+        seconds = len(audio) / SAMPLE_RATE
+        if not groups or group_seconds + seconds > pack_seconds:
+            groups.append([])
+            group_seconds = 0.0
+        groups[-1].append((video_id, audio))
+        group_seconds += seconds
+
+    transcribed = []
+    for group in groups:
+        try:
+            results = transcribe_packed([audio for _, audio in group], _worker['model'], batch_size)
+        except Exception as e:
+            # every clip packed with the one that broke the call is lost with it
+            logger.warning(f"Failed to transcribe videos {[video_id for video_id, _ in group]}: {e!r}")
+            continue
+        transcribed.extend((video_id, audio, result) for (video_id, audio), result in zip(group, results))
+
+    transcript_data = []
+    if group_by_language:
+        transcribed.sort(key=lambda t: t[2]['language'])
+    for video_id, audio, result in transcribed:
+        try:
+            result, diarize_segments, speaker_embeddings = align_and_diarize(result, audio, _worker['diarize_model'], "cpu", _worker['align_cache'])
+            transcript_data.append({
+                'video_id': video_id,
+                'transcript': result,
+                'speaker_embeddings': speaker_embeddings
+            })
+        except Exception as e:
+            logger.warning(f"Failed to align and diarize video {video_id}: {e!r}")
+            continue
+    audio_seconds = sum(len(audio) for _, audio in audios) / SAMPLE_RATE
+    return transcript_data, audio_seconds, time.perf_counter() - start_time
+
+def main(args):
     path = '../sitrep/data/digital_trace/raw_platforms'
     data_files = os.listdir(path)
     data_files = [f for f in data_files if f.endswith('.parquet.zstd') and 'tiktok' in f]
@@ -97,19 +168,13 @@ def main():
     bucket = 'media-data-pipeline-raw-data'
     prefix = 'tiktok/bytes/'
 
-    s3 = boto3.client('s3')
+    # a local directory laid out like the bucket can stand in for S3
+    source_location = args.local_root if args.source == 'local' else bucket
+    source = make_source(args.source, source_location)
 
-    paginator = s3.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
-
-    media_files = []
-    media_pbar = tqdm(desc='Finding media files')
-    for page in pages:
-        for obj in page['Contents']:
-            media_files.append(obj['Key'])
-            media_pbar.update(1)
-    media_pbar.close()
-    media_df = pl.DataFrame({'key': media_files})
+    # the listing is cached between runs and only the new keys are listed again
+    inventory = MediaInventory(source, prefix, f'./data/tiktok/media_inventory_{args.source}.parquet.zstd', num_threads=args.listing_threads)
+    media_df = inventory.refresh(full=args.full_listing).select('key')
     media_df = media_df.with_columns(pl.col('key').str.replace('tiktok/bytes/', '').alias('file_name'))\
         .with_columns(pl.col('file_name').str.split('.').list.get(0).cast(pl.UInt64).alias('video_id'))
 
@@ -122,67 +187,196 @@ def main():
     df = df.join(media_df, on='video_id', how='left')
     df = df.filter(pl.col('file_name').is_not_null())
 
-    transcripts_path = './data/tiktok/transcripts.parquet.zstd'
-    if os.path.exists(transcripts_path):
-        transcript_df = pl.read_parquet(transcripts_path)
-        transcript_df = transcript_df.unique('video_id')
-        df = df.filter(~pl.col('video_id').is_in(transcript_df['video_id']))
-        # TODO remove already processed videos
-        # TODO unique video_id
-    else:
-        transcript_df = pl.DataFrame()
+    df = df.filter(~pl.col('video_id').is_in(transcribed_ids(args.transcripts_path)))
+    df = df.unique('video_id', maintain_order=True)
+
+    # with --lease-db, worker processes take batches of videos from a shared lease table, a SQLite file
+    # for the processes of one machine or Postgres for several hosts (see leases.open_lease_table), and
+    # each writes its own fragments to the store. Workers on several hosts need --transcripts-path on
+    # storage they all mount, fragments have unique names and are never rewritten by a worker, so
+    # that needs no locking. Compaction is left to a later single-process run so two workers never
+    # compact the same bucket.
+    leases = None
+    fragment_prefix = 'part'
+    if args.lease_db:
+        worker_id = args.worker_id or default_worker_id()
+        fragment_prefix = f"worker-{worker_id}"
+        leases = open_lease_table(args.lease_db, lease_seconds=args.lease_seconds)
+        leases.add(df['video_id'].to_list())
+        leases.start_heartbeat(worker_id)
+
+    def videos():
+        if leases is None:
+            yield from df.iter_rows(named=True)
+            return
+        rows = {str(row['video_id']): row for row in df.iter_rows(named=True)}
+        for video_ids in leases.leased_batches(worker_id, args.lease_batch):
+            # another worker may have added videos this one has no media for
+            missing = [video_id for video_id in video_ids if video_id not in rows]
+            if missing:
+                leases.fail(worker_id, missing)
+            yield from (rows[video_id] for video_id in video_ids if video_id in rows)
 
-    device = "cuda" 
-    compute_type = "float16" # change to "int8" if low on GPU mem (may reduce accu
-    model = whisperx.load_model("large-v2", device, compute_type=compute_type)
-    diarize_model = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=HF_TOKEN).to(torch.device(device))
+    def fail_videos(video_ids):
+        if leases is not None and video_ids:
+            leases.fail(worker_id, video_ids)
 
-    tmp_path = './tmp'
-    batch_size = 10
+    num_videos = len(df) if leases is None else None
+
+    # each checkpoint appends a fragment instead of rewriting every transcript so far, and resuming
+    # only reads the ids back
+    store = transcript_store(args.transcripts_path, compact_threshold=32 if leases is None else None)
+    save_every = 10
     transcript_data = []
-    for video_data in tqdm(df.to_dicts(), desc='Extracting video data'):
-        # download video file
-        key = video_data['key']
-        file_byte_string = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
-
-        # save video file
-        video_path = os.path.join(tmp_path, video_data['file_name'])
-        with open(video_path, 'wb') as f:
-            f.write(file_byte_string)
-            
-        audio_file_path = video_path.replace('.mp4', '.mp3')
-
-        # extract audio
-        success = try_create_audio(video_path, audio_file_path)
-        if not success:
-            continue
-        audio = whisperx.load_audio(audio_file_path)
 
-        # delete audio and video files
-        os.remove(audio_file_path)
-        os.remove(video_path)
+    def save_transcripts(transcript_data):
+        if transcript_data:
+            store.append(to_df(transcript_data), fragment_prefix=fragment_prefix)
+            # leases are only given up once the transcripts are on disk
+            if leases is not None:
+                leases.complete([d['video_id'] for d in transcript_data])
 
-        try:
-            result, diarize_segments, speaker_embeddings = apply_whisperx_pipeline(audio, model, diarize_model)
+    audio_seconds = 0.0
+    processing_seconds = 0.0
+    start_time = time.perf_counter()
+    align_cache_bytes = args.align_cache_gb * 1e9
+
+    if args.device == 'cpu':
+        compute_type = args.compute_type or "int8"
+        video_batches = chunks(videos(), args.videos_per_task)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_cpu_worker,
+            initargs=(compute_type, args.threads_per_worker, HF_TOKEN, args.source, source_location, align_cache_bytes),
+        ) as pool:
+            # a couple of batches per process are in flight at a time, so leases are claimed as
+            # processes free up rather than all at once
+            futures = {}
+            def submit(num_batches):
+                for video_batch in itertools.islice(video_batches, num_batches):
+                    future = pool.submit(transcribe_cpu_batch, video_batch, args.batch_size, args.pack_seconds, args.decode_threads, args.group_by_language)
+                    futures[future] = video_batch
+            submit(2 * args.workers)
+            pbar = tqdm(total=num_videos, desc='Transcribing videos')
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    video_batch = futures.pop(future)
+                    batch_data, batch_audio_seconds, batch_processing_seconds = future.result()
+                    transcript_data.extend(batch_data)
+                    transcribed = {d['video_id'] for d in batch_data}
+                    fail_videos([v['video_id'] for v in video_batch if v['video_id'] not in transcribed])
+                    audio_seconds += batch_audio_seconds
+                    processing_seconds += batch_processing_seconds
+                    pbar.update(len(video_batch))
+                    pbar.set_postfix(rtf=processing_seconds / max(audio_seconds, 1e-9))
+                    if len(transcript_data) >= save_every:
+                        save_transcripts(transcript_data)
+                        transcript_data = []
+                submit(len(done))
+            pbar.close()
+    else:
+        device = args.device
+        compute_type = args.compute_type or "float16" # change to "int8" if low on GPU mem (may reduce accu
+        model = whisperx.load_model("large-v2", device, compute_type=compute_type)
+        diarize_model = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=HF_TOKEN).to(torch.device(device))
+        align_cache = AlignModelCache(device, max_bytes=align_cache_bytes)
+
+        def fetch_stage(video_data):
+            return {**video_data, 'video_bytes': source.read(video_data['key'])}
+
+        def decode_stage(video_data):
+            audio = decode_audio(video_data.pop('video_bytes'), sr=SAMPLE_RATE)
+            return {**video_data, 'audio': audio} if audio is not None else None
+
+        def asr_stage(video_data):
+            return {**video_data, 'result': model.transcribe(video_data['audio'], batch_size=args.batch_size)}
+
+        def align_stage(video_data):
+            return {**video_data, 'result': align(video_data['result'], video_data['audio'], device, align_cache)}
+
+        def diarize_stage(video_data):
+            result, diarize_segments, speaker_embeddings = diarize(video_data['result'], video_data['audio'], diarize_model)
+            return {**video_data, 'result': result, 'speaker_embeddings': speaker_embeddings}
+
+        pbar = tqdm(total=num_videos, desc='Transcribing videos')
+        def write_stage(video_data):
+            nonlocal transcript_data, audio_seconds
+            audio_seconds += len(video_data['audio']) / SAMPLE_RATE
             transcript_data.append({
                 'video_id': video_data['video_id'],
-                'transcript': result,
-                'speaker_embeddings': speaker_embeddings
+                'transcript': video_data['result'],
+                'speaker_embeddings': video_data['speaker_embeddings']
             })
-        except:
-            continue
+            if len(transcript_data) == save_every:
+                save_transcripts(transcript_data)
+                transcript_data = []
+            pbar.update(1)
+            return video_data
+
+        # with --group-by-language the align queue hands out videos in the language of the model
+        # that was used last while any are waiting, so a mixed queue doesn't thrash the cache
+        align_queue = queue.Queue
+        if args.group_by_language:
+            align_queue = lambda size: LanguageGroupedQueue(size, key=lambda video_data: video_data['result']['language'])
+
+        # the network, ffmpeg and each model run in their own threads, connected by bounded queues
+        pipeline = StagePipeline([
+            Stage('fetch', fetch_stage, num_workers=args.fetch_workers, queue_size=args.queue_size),
+            Stage('decode', decode_stage, num_workers=args.decode_workers, queue_size=args.queue_size),
+            Stage('asr', asr_stage, num_workers=args.asr_workers, queue_size=args.queue_size),
+            Stage('align', align_stage, num_workers=args.align_workers, queue_size=args.queue_size, make_queue=align_queue),
+            Stage('diarize', diarize_stage, num_workers=args.diarize_workers, queue_size=args.queue_size),
+            Stage('write', write_stage, num_workers=1, queue_size=args.queue_size),
+        ], on_drop=lambda stage_name, video_data: fail_videos([video_data['video_id']]))
+        pipeline.run(videos())
+        pbar.close()
+        report = pipeline.report()
+        print(report)
+        print(f"Alignment model cache hit rate: {align_cache.hit_rate():.1%}")
+        processing_seconds = report.filter(pl.col('stage').is_in(['asr', 'align', 'diarize']))\
+            .select((pl.col('mean_latency_s') * pl.col('processed')).sum()).item()
 
-        if len(transcript_data) == batch_size:
-            batch_transcript_df = to_df(transcript_data)
-            transcript_df = pl.concat([transcript_df, batch_transcript_df], how='diagonal_relaxed')
-            transcript_df.write_parquet(transcripts_path)
-            transcript_data = []
+    save_transcripts(transcript_data)
+    store.close()
+    if leases is not None:
+        print(f"Lease table: {leases.counts()}")
+        leases.close()
 
-    batch_transcript_df = to_df(transcript_data)
-    transcript_df = pl.concat([transcript_df, batch_transcript_df], how='diagonal_relaxed')
-    transcript_df.write_parquet(transcripts_path)
+    # real-time factor: processing time per second of audio, below 1 is faster than real time.
+    # with N workers the whole run gets through roughly N / rtf seconds of audio per second
+    wall_seconds = time.perf_counter() - start_time
+    print(f"Transcribed {audio_seconds / 3600:.2f}h of audio in {wall_seconds / 3600:.2f}h")
+    print(f"Real-time factor per worker: {processing_seconds / max(audio_seconds, 1e-9):.3f}, overall: {wall_seconds / max(audio_seconds, 1e-9):.3f}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='cuda', choices=['cuda', 'cpu'])
+    parser.add_argument('--compute-type', default=None, help='defaults to float16 on cuda and int8 on cpu')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() // 4 or 1)
+    parser.add_argument('--threads-per-worker', type=int, default=4)
+    parser.add_argument('--videos-per-task', type=int, default=8)
+    parser.add_argument('--pack-seconds', type=float, default=120.0)
+    parser.add_argument('--decode-threads', type=int, default=4)
+    parser.add_argument('--source', default='s3', choices=['s3', 'local'])
+    parser.add_argument('--local-root', default='./data/media')
+    parser.add_argument('--listing-threads', type=int, default=16)
+    parser.add_argument('--full-listing', action='store_true', help='relist every key instead of only the new ones')
+    parser.add_argument('--fetch-workers', type=int, default=4)
+    parser.add_argument('--decode-workers', type=int, default=2)
+    parser.add_argument('--asr-workers', type=int, default=1)
+    parser.add_argument('--align-workers', type=int, default=1)
+    parser.add_argument('--diarize-workers', type=int, default=1)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--align-cache-gb', type=float, default=4.0, help='memory budget for cached alignment models')
+    parser.add_argument('--group-by-language', action='store_true', help='align queued videos of the same language together')
+    parser.add_argument('--lease-db', default=None, help='lease table shared by worker processes: a SQLite file on local disk for one machine, or a postgresql:// url for several hosts')
+    parser.add_argument('--worker-id', default=None, help='defaults to <hostname>-<pid>')
+    parser.add_argument('--lease-batch', type=int, default=32)
+    parser.add_argument('--lease-seconds', type=float, default=300.0)
+    parser.add_argument('--transcripts-path', default=TRANSCRIPTS_PATH, help='transcript store, on shared storage when workers run on several hosts')
+    args = parser.parse_args()
     dotenv.load_dotenv()
     HF_TOKEN = os.getenv('HF_TOKEN')
-    main()
\ No newline at end of file
+    main(args)
@@ -0,0 +1,28 @@
+import polars as pl
+
+from schema import TRANSCRIPT_SCHEMA
+from store import FragmentStore
+
+# the old single file at ./data/tiktok/transcripts.parquet.zstd is still read as the store's legacy file
+TRANSCRIPTS_PATH = './data/tiktok/transcripts'
+
+
+def transcript_store(path=TRANSCRIPTS_PATH, **kwargs):
+    # fragments are bucketed by video id, so compacting one bucket only rewrites a slice of the transcripts
+    return FragmentStore(path, schema=TRANSCRIPT_SCHEMA, partition_by='id_hash', unique_key='video_id', **kwargs)
+
+
+def scan_transcripts(path=TRANSCRIPTS_PATH, columns=None):
+    # lazy view over every fragment, a video transcribed twice keeps its latest transcript
+    lf = transcript_store(path).scan(columns=columns)
+    if 'video_id' not in lf.collect_schema().names():
+        return lf
+    return lf.unique('video_id', keep='last', maintain_order=True)
+
+
+def transcribed_ids(path=TRANSCRIPTS_PATH):
+    # only the video_id column is read from each fragment
+    lf = transcript_store(path).scan(columns=['video_id'])
+    if 'video_id' not in lf.collect_schema().names():
+        return pl.Series('video_id', [], dtype=pl.UInt64)
+    return lf.unique().collect()['video_id']
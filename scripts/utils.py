@@ -1,7 +1,28 @@
+import asyncio
+import time
+
 import polars as pl
 
-def concat(a_df, b_df):
-    try:
-        return pl.concat([a_df, b_df], how='diagonal_relaxed')
-    except (pl.exceptions.SchemaError, pl.exceptions.PanicException):
-        return pl.DataFrame(a_df.to_dicts() + b_df.to_dicts(), infer_schema_length=len(a_df) + len(b_df))
+from schema import VIDEO_SCHEMA, conform
+
+def concat(a_df, b_df, schema=VIDEO_SCHEMA):
+    # both sides are brought to the canonical schema first, so the concat never has to fall back to python
+    # objects. Columns outside the schema stay top-level columns, callers add their own at times
+    return pl.concat([conform(a_df, schema, keep_unknown=True), conform(b_df, schema, keep_unknown=True)], how='diagonal_relaxed')
+
+class RateLimiter:
+    # spaces out calls so that at most per_minute go through, and never closer than min_interval seconds
+    def __init__(self, per_minute=None, min_interval=0.0):
+        self.interval = max(60.0 / per_minute if per_minute else 0.0, min_interval)
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.interval <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
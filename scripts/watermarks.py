@@ -0,0 +1,102 @@
+import datetime
+import os
+import sqlite3
+
+import polars as pl
+
+WATERMARKS_PATH = './data/watermarks.sqlite'
+
+
+def video_key(video_info):
+    # videos are ordered by createTime, ties broken by id, which also grows with time
+    return int(video_info.get('createTime') or 0), int(video_info.get('id') or 0)
+
+
+def is_known(watermark, video_info):
+    # True for videos no newer than the newest one seen by an earlier crawl
+    if watermark is None or watermark['create_time'] is None:
+        return False
+    return video_key(video_info) <= (watermark['create_time'], int(watermark['id']))
+
+
+class WatermarkStore:
+    # The newest createTime and id seen per entity, where kind is 'hashtag' or 'author', and when it
+    # was last crawled. A re-crawl pages until it reaches videos at or below the watermark. Callers
+    # only advance it once the new videos are saved, so an interrupted crawl fetches them again.
+    def __init__(self, path=WATERMARKS_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS watermarks (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                create_time INTEGER,
+                video_id TEXT,
+                crawled_at TEXT,
+                PRIMARY KEY (kind, name)
+            )
+        ''')
+
+    def _row(self, row):
+        create_time, video_id, crawled_at = row
+        return {
+            'create_time': create_time,
+            'id': video_id,
+            'crawled_at': datetime.datetime.fromisoformat(crawled_at) if crawled_at else None,
+        }
+
+    def get(self, kind, name):
+        row = self.conn.execute(
+            'SELECT create_time, video_id, crawled_at FROM watermarks WHERE kind = ? AND name = ?', (kind, name)
+        ).fetchone()
+        return self._row(row) if row is not None else None
+
+    def all(self, kind):
+        rows = self.conn.execute('SELECT name, create_time, video_id, crawled_at FROM watermarks WHERE kind = ?', (kind,))
+        return {row[0]: self._row(row[1:]) for row in rows}
+
+    def advance(self, kind, name, videos, crawled_at=None):
+        # moves the watermark up to the newest of videos, never back, and records the crawl
+        crawled_at = (crawled_at or datetime.datetime.now()).isoformat()
+        current = self.get(kind, name)
+        newest = max(videos, key=video_key, default=None)
+        if newest is not None and newest.get('createTime') is not None and not is_known(current, newest):
+            create_time, video_id = int(newest['createTime']), str(newest['id'])
+        elif current is not None:
+            create_time, video_id = current['create_time'], current['id']
+        else:
+            create_time, video_id = None, None
+        self.conn.execute('''
+            INSERT INTO watermarks (kind, name, create_time, video_id, crawled_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(kind, name) DO UPDATE SET
+                create_time = excluded.create_time, video_id = excluded.video_id, crawled_at = excluded.crawled_at
+        ''', (kind, name, create_time, video_id, crawled_at))
+
+    def seed(self, kind, df):
+        # watermarks from videos saved before there were any, df has name, createTime and id columns.
+        # crawled_at stays empty, so seeded entities still count as due for a crawl
+        newest = df.drop_nulls('createTime')\
+            .with_columns(pl.col('id').cast(pl.UInt64, strict=False).alias('__id'))\
+            .drop_nulls('__id')\
+            .sort('createTime', '__id')\
+            .group_by('name').last()
+        self.conn.execute('BEGIN')
+        self.conn.executemany('''
+            INSERT INTO watermarks (kind, name, create_time, video_id) VALUES (?, ?, ?, ?)
+            ON CONFLICT(kind, name) DO NOTHING
+        ''', [(kind, row['name'], int(row['createTime']), str(row['id'])) for row in newest.iter_rows(named=True)])
+        self.conn.execute('COMMIT')
+        return len(newest)
+
+    def due(self, kind, names, min_age):
+        # the names not crawled within min_age, so a re-run picks up where an interrupted one stopped
+        watermarks = self.all(kind)
+        cutoff = datetime.datetime.now() - min_age
+        return [
+            name for name in names
+            if name not in watermarks or watermarks[name]['crawled_at'] is None or watermarks[name]['crawled_at'] < cutoff
+        ]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from audio import SAMPLE_RATE, transcribe_packed
+
+
+class FakeModel:
+    # stands in for a whisperx model: every run of non-zero samples is one segment whose text is the
+    # run's value, and clips with values below 0.5 are Romanian
+    def __init__(self):
+        self.calls = []
+
+    def detect_language(self, audio):
+        return 'ro' if audio[0] < 0.5 else 'en'
+
+    def transcribe(self, audio, batch_size, language, chunk_size):
+        self.calls.append(language)
+        speech = np.flatnonzero(audio)
+        runs = np.split(speech, np.flatnonzero(np.diff(speech) > 1) + 1)
+        for before, after in zip(runs, runs[1:]):
+            # VAD would merge two clips with less silence between them than a chunk
+            assert (after[0] - before[-1]) / SAMPLE_RATE > chunk_size
+        return {'segments': [
+            {'start': run[0] / SAMPLE_RATE, 'end': (run[-1] + 1) / SAMPLE_RATE + 0.5, 'text': f"{audio[run[0]]:.1f}"}
+            for run in runs
+        ]}
+
+
+def clip(value, seconds):
+    return np.full(int(seconds * SAMPLE_RATE), value, dtype=np.float32)
+
+
+def test_segments_are_mapped_back_to_their_clips():
+    model = FakeModel()
+    audios = [clip(0.2, 3), clip(0.7, 5), clip(0.3, 1.5), clip(0.9, 2)]
+    results = transcribe_packed(audios, model, batch_size=4, chunk_seconds=10)
+
+    # one call per language, whatever order the clips came in
+    assert model.calls == ['ro', 'en']
+    assert [result['language'] for result in results] == ['ro', 'en', 'ro', 'en']
+    for audio, result in zip(audios, results):
+        [segment] = result['segments']
+        duration = len(audio) / SAMPLE_RATE
+        assert segment['text'] == f"{audio[0]:.1f}"
+        assert segment['start'] == 0.0
+        # a segment running into the silence after its clip is cut at the clip's end
+        assert segment['end'] == duration
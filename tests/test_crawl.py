@@ -0,0 +1,261 @@
+import asyncio
+import http.server
+import json
+import threading
+
+import httpx
+import pytest
+
+import crawl
+from crawl import ApiWrapper, CrawlEngine
+
+
+class FakeSession:
+    # stands in for a PyTok session, the first one opened fails on every fetch
+    opened = 0
+
+    def __init__(self):
+        FakeSession.opened += 1
+        self.broken = FakeSession.opened == 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+async def fetch(api, item):
+    await asyncio.sleep(0)
+    if api.broken:
+        raise RuntimeError('blocked')
+    return [f"{item}.{i}" for i in range(2)] if item.count('.') < 2 else []
+
+
+def test_engine_fans_out_and_restarts_failing_session():
+    FakeSession.opened = 0
+    results = {}
+    engine = None
+
+    def on_result(item, related):
+        results[item] = related
+        for related_item in related:
+            engine.put(related_item)
+
+    engine = CrawlEngine(fetch, on_result, session_factory=FakeSession, num_sessions=2, max_failures=2, restart_delay=0.0)
+    failed = []
+    engine.on_error = lambda item, e: failed.append(item)
+
+    async def run():
+        # frontier.join() returning at all is part of the test
+        await asyncio.wait_for(engine.run(['a', 'b']), timeout=5)
+
+    asyncio.run(run())
+    # the broken session fails max_failures items and is replaced, the items are retried on the others
+    assert engine.num_restarts >= 1
+    assert FakeSession.opened >= 3
+    assert failed == [] and engine.num_failed == 0
+    assert engine.num_retries == 2
+    assert engine.num_fetched == len(results) == 14
+    for item, related in results.items():
+        assert related == ([f"{item}.{i}" for i in range(2)] if item.count('.') < 2 else [])
+        for related_item in related:
+            assert related_item in results or related_item in failed
+    assert set(results) >= {'a', 'b'}
+
+
+def test_item_that_keeps_failing_is_given_up_after_max_retries():
+    attempts = []
+
+    async def fetch(api, item):
+        attempts.append(item)
+        raise RuntimeError('gone')
+
+    engine = CrawlEngine(fetch, lambda item, result: None, session_factory=lambda: FakeSession(), num_sessions=1, max_failures=10, max_retries=2, restart_delay=0.0)
+    failed = []
+    engine.on_error = lambda item, e: failed.append(item)
+    FakeSession.opened = 1
+    asyncio.run(asyncio.wait_for(engine.run(['x']), timeout=5))
+    assert attempts == ['x'] * 3
+    assert failed == ['x'] and engine.num_failed == 1
+
+
+class FakeVideo:
+    def __init__(self, video_id):
+        self.as_dict = {'id': str(video_id), 'createTime': video_id}
+
+
+class FakeApi:
+    # a listing session, the first one opened is blocked after its first video
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    def hashtag(self, name):
+        return self
+
+    async def videos(self, count):
+        for i in range(3):
+            if self.number == 1 and i == 1:
+                raise RuntimeError('captcha')
+            yield FakeVideo(i)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.closed = True
+
+
+class FakeApiWrapper(ApiWrapper):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.opened = []
+
+    async def _open_session(self):
+        self.opened.append(FakeApi(len(self.opened) + 1))
+        return self.opened[-1]
+
+
+def test_api_wrapper_replaces_failed_session():
+    batches = []
+
+    async def run():
+        async with FakeApiWrapper(num_sessions=1, restart_delay=0.0) as api:
+            try:
+                await api.get_hashtag_videos('a', batches.append)
+            except RuntimeError:
+                pass
+            stats = await api.get_hashtag_videos('b', batches.append)
+            return api, stats
+
+    api, stats = asyncio.run(run())
+    first, second = api.opened
+    # the session the first listing failed on is closed and the next listing gets a new one
+    assert first.closed and first not in api.apis
+    assert api.apis == [second]
+    assert api.num_restarts == 1
+    assert stats['videos'] == 3
+    assert batches[-1] == [{'id': str(i), 'createTime': i} for i in range(3)]
+
+
+def test_related_videos_stored_after_the_checkpoint_are_queued_on_resume(tmp_path):
+    from relevance import RelevanceClassifier
+    from scheduler import KeywordPolicy
+    from schema import VIDEO_SCHEMA, normalize
+    from store import FragmentStore
+
+    def videos(ids):
+        return normalize([{'id': str(i), 'desc': 'alegeri', 'author': {'uniqueId': f"a{i}"}, 'stats': {'playCount': i}} for i in ids])
+
+    video_store = FragmentStore(str(tmp_path / 'fetched'), schema=VIDEO_SCHEMA)
+    related_store = FragmentStore(str(tmp_path / 'related'), schema=VIDEO_SCHEMA)
+    frontier_path = str(tmp_path / 'frontier')
+    relevance = RelevanceClassifier(['alegeri'])
+    hashtag_df = videos([1, 2])
+
+    frontier = crawl.related_frontier(frontier_path, KeywordPolicy(), video_store, related_store, hashtag_df, relevance)
+    related_store.append(videos([3]))
+    frontier.push({'id': '3', 'keyword_score': 1})
+    frontier.save(frontier_path)
+    # the crawl stored 4 and 5 and died before the next checkpoint
+    related_store.append(videos([4, 5]))
+
+    frontier = crawl.related_frontier(frontier_path, KeywordPolicy(), video_store, related_store, hashtag_df, relevance)
+    assert sorted(item['id'] for item in frontier.pending()) == ['1', '2', '3', '4', '5']
+    assert all(item['keyword_score'] == 1 for item in frontier.pending())
+
+
+class VideoHandler(http.server.BaseHTTPRequestHandler):
+    # a TikTok stand-in: POST /session hands out a session cookie, GET /video/<id> answers with the
+    # video and its related ids, and every request made with the first session's cookie is blocked
+    def do_POST(self):
+        with self.server.lock:
+            self.server.sessions += 1
+            session_id = self.server.sessions
+        self.send_response(200)
+        self.send_header('Set-Cookie', f"session={session_id}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        cookie = self.headers.get('cookie', '')
+        video_id = self.path.rsplit('/', 1)[-1]
+        if cookie == 'session=1':
+            self.send_response(403)
+            body = b''
+        else:
+            self.send_response(200)
+            # ids are numeric like TikTok's, a video's related ones append a digit to it
+            related = [f"{video_id}{i}" for i in range(1, 3)] if len(video_id) < 3 else []
+            body = json.dumps({'id': video_id, 'related': related}).encode()
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def video_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), VideoHandler)
+    server.sessions, server.lock = 0, threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+class HttpSession:
+    # a session the way the engine sees PyTok: opened, used for many fetches, closed when it's replaced
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=5)
+        (await self.client.post('/session')).raise_for_status()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.aclose()
+
+
+async def fetch_http(api, item):
+    response = await api.client.get(f"/video/{item['id']}")
+    response.raise_for_status()
+    video = response.json()
+    return video, [{'id': related_id} for related_id in video['related']]
+
+
+def test_engine_crawls_a_local_server(video_server):
+    from frontier import Frontier
+
+    base_url = f"http://127.0.0.1:{video_server.server_address[1]}"
+    frontier = Frontier()
+    fetched = []
+
+    def on_result(item, result):
+        video, related = result
+        fetched.append(video['id'])
+        for related_item in related:
+            frontier.push(related_item)
+
+    engine = CrawlEngine(
+        fetch_http,
+        on_result,
+        session_factory=lambda: HttpSession(base_url),
+        num_sessions=2,
+        max_failures=1,
+        restart_delay=0.0,
+        frontier=frontier,
+    )
+    failed = []
+    engine.on_error = lambda item, e: failed.append(item)
+    for video_id in ['1', '2']:
+        frontier.push({'id': video_id})
+    asyncio.run(asyncio.wait_for(engine.run(), timeout=10))
+
+    # the blocked session is replaced, and what failed on it is fetched by another one
+    assert failed == []
+    assert engine.num_restarts >= 1
+    assert video_server.sessions >= 3
+    assert len(fetched) == len(set(fetched)) == 14
+    assert frontier.in_flight == {}
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import http.server
+import logging
+import os
+import re
+import threading
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+download_videos = pytest.importorskip('download_videos')
+
+from manifest import DownloadManifest
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    # serves server.content with Range, If-Range and ETag like the CDN, or with bad_offset set,
+    # answers ranges with a 206 that starts 1000 bytes before the one asked for
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content, etag = server.content, server.etag
+        range_header = self.headers.get('range')
+        if_range = self.headers.get('if-range')
+        match = re.match(r'bytes=(\d+)-', range_header or '')
+        if match is None or (if_range is not None and if_range != etag):
+            self.send_response(200)
+            body = content
+        else:
+            start = max(int(match.group(1)) - 1000, 0) if server.bad_offset else int(match.group(1))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(content)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(content) - 1}/{len(content)}")
+            body = content[start:]
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.content, server.etag, server.bad_offset, server.requests = b'', None, False, []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def download(tmp_path, server, video_id='1'):
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    scraper = download_videos.VideoBytesScraper(logging.getLogger(__name__), str(tmp_path), manifest, request_delay=0, chunk_size=1024)
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await scraper.save_video_bytes(client, video_id, f"http://127.0.0.1:{server.server_port}/video.mp4")
+
+    saved = asyncio.run(run())
+    state = manifest.get(video_id)
+    manifest.close()
+    return saved, state
+
+
+def write_part(tmp_path, content, total_bytes, etag, video_id='1'):
+    with open(os.path.join(tmp_path, f"{video_id}.mp4.part"), 'wb') as f:
+        f.write(content)
+    manifest = DownloadManifest(os.path.join(tmp_path, 'manifest.sqlite'))
+    manifest.mark_started(video_id, total_bytes, etag)
+    manifest.mark_partial(video_id, len(content))
+    manifest.close()
+
+
+def read_video(tmp_path, video_id='1'):
+    with open(os.path.join(tmp_path, f"{video_id}.mp4"), 'rb') as f:
+        return f.read()
+
+
+def test_fresh_download(tmp_path, server):
+    server.content, server.etag = os.urandom(10_000), '"a"'
+    saved, state = download(tmp_path, server)
+    assert saved and read_video(tmp_path) == server.content
+    assert state['state'] == 'complete' and state['sha256'] == hashlib.sha256(server.content).hexdigest()
+
+
+def test_resume_continues_the_same_object(tmp_path, server):
+    server.content, server.etag = os.urandom(10_000), '"a"'
+    write_part(tmp_path, server.content[:4000], len(server.content), '"a"')
+    saved, _ = download(tmp_path, server)
+    assert saved and read_video(tmp_path) == server.content
+    assert server.requests[0]['range'] == 'bytes=4000-'
+    assert server.requests[0]['if-range'] == '"a"'
+
+
+def test_changed_object_is_downloaded_again(tmp_path, server):
+    old = os.urandom(10_000)
+    write_part(tmp_path, old[:4000], len(old), '"old"')
+    server.content, server.etag = os.urandom(12_000), '"new"'
+    saved, state = download(tmp_path, server)
+    assert saved and read_video(tmp_path) == server.content
+    assert state['total_bytes'] == 12_000 and state['etag'] == '"new"'
+
+
+def test_changed_size_without_etag_restarts(tmp_path, server):
+    old = os.urandom(10_000)
+    write_part(tmp_path, old[:4000], len(old), None)
+    server.content = os.urandom(12_000)
+    saved, _ = download(tmp_path, server)
+    assert saved and read_video(tmp_path) == server.content
+    assert [r['range'] for r in server.requests] == ['bytes=4000-', 'bytes=0-']
+
+
+def test_range_at_the_wrong_offset_restarts(tmp_path, server):
+    server.content, server.etag, server.bad_offset = os.urandom(10_000), '"a"', True
+    write_part(tmp_path, server.content[:4000], len(server.content), '"a"')
+    saved, _ = download(tmp_path, server)
+    assert saved and read_video(tmp_path) == server.content
+    assert [r['range'] for r in server.requests] == ['bytes=4000-', 'bytes=0-']
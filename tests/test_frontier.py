@@ -0,0 +1,35 @@
+import asyncio
+
+from frontier import Frontier, PriorityFrontier
+from scheduler import KeywordPolicy
+
+
+def test_in_flight_items_survive_a_crash(tmp_path):
+    async def run():
+        frontier = PriorityFrontier(KeywordPolicy())
+        for i, score in enumerate([1, 3, 2]):
+            frontier.push({'id': str(i), 'keyword_score': score})
+        first = await frontier.get()
+        second = await frontier.get()
+        frontier.finish(first)
+        # the process dies here, with second taken off the queue but never finished
+        frontier.save(tmp_path)
+        return second
+
+    second = asyncio.run(run())
+    frontier = PriorityFrontier.load(tmp_path, policy=KeywordPolicy())
+    assert sorted(item['id'] for item in frontier.pending()) == sorted([second['id'], '0'])
+    assert not frontier.push({'id': '1', 'keyword_score': 3})
+    assert len(frontier.seen) == 3
+
+
+def test_finished_items_are_not_saved(tmp_path):
+    async def run():
+        frontier = Frontier()
+        frontier.push({'id': '1'})
+        frontier.push({'id': '2'})
+        frontier.finish(await frontier.get())
+        frontier.save(tmp_path)
+
+    asyncio.run(run())
+    assert [item['id'] for item in Frontier.load(tmp_path).pending()] == ['2']
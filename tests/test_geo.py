@@ -0,0 +1,70 @@
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+pytest.importorskip('matplotlib')
+
+import polars as pl
+from shapely.geometry import box
+
+import geo
+
+
+@pytest.fixture
+def shapefile(tmp_path):
+    # three square countries, with the extra columns a GADM shapefile carries
+    layer = gpd.GeoDataFrame(
+        {'GID_0': ['ROU', 'MDA', 'BGR'], 'COUNTRY': ['Romania', 'Moldova', 'Bulgaria']},
+        geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(0, -1, 1, 0)],
+        crs='EPSG:4326',
+    )
+    path = str(tmp_path / 'europe.shp')
+    layer.to_file(path)
+    return path
+
+
+def country_df():
+    return pl.DataFrame({
+        'country': ['RO', 'MD', 'XK', 'ZZ', None],
+        'total_videos': [5, 2, 1, 1, 3],
+        'lasconi_videos': [1, 0, 0, 0, 1],
+    })
+
+
+def specs(tmp_path, columns):
+    maps = [{'column': c, 'cmap': 'Reds', 'label': c, 'title': c, 'path': str(tmp_path / f"{c}.png"), 'dpi': 20} for c in columns]
+    return maps + [{'panels': list(maps), 'path': str(tmp_path / 'combined.png'), 'dpi': 20}]
+
+
+def test_render_choropleths(tmp_path, shapefile):
+    cache_dir = str(tmp_path / 'cache')
+    paths = geo.render_choropleths(country_df(), specs(tmp_path, ['total_videos', 'lasconi_videos']), workers=2, shapefile=shapefile, cache_dir=cache_dir)
+    assert paths == [str(tmp_path / f) for f in ['total_videos.png', 'lasconi_videos.png', 'combined.png']]
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+    base = geo.load_base_layer(shapefile, cache_dir)
+    assert list(base.columns) == geo.BASE_COLUMNS
+    assert sorted(base['GID_0']) == ['BGR', 'MDA', 'ROU']
+
+
+def test_stale_cache_is_rebuilt(tmp_path, shapefile):
+    cache_dir = str(tmp_path / 'cache')
+    base = geo.load_base_layer(shapefile, cache_dir)
+    [cache_path] = (tmp_path / 'cache').iterdir()
+    base.rename(columns={'GID_0': 'ISO'}).to_parquet(cache_path)
+    assert list(geo.load_base_layer(shapefile, cache_dir).columns) == geo.BASE_COLUMNS
+
+
+def test_missing_columns_are_reported_before_rendering(tmp_path, shapefile):
+    with pytest.raises(ValueError, match='georgescu_videos'):
+        geo.render_choropleths(country_df(), specs(tmp_path, ['total_videos', 'georgescu_videos']), shapefile=shapefile, cache_dir=str(tmp_path / 'cache'))
+    assert not (tmp_path / 'total_videos.png').exists()
+
+
+def test_shapefile_without_gid_0(tmp_path):
+    layer = gpd.GeoDataFrame({'ISO': ['ROU']}, geometry=[box(0, 0, 1, 1)], crs='EPSG:4326')
+    path = str(tmp_path / 'other.shp')
+    layer.to_file(path)
+    with pytest.raises(ValueError, match='GID_0'):
+        geo.load_base_layer(path, str(tmp_path / 'cache'))
@@ -0,0 +1,104 @@
+import json
+import os
+
+from inventory import MediaInventory
+from stages import LocalSource
+
+PREFIX = 'tiktok/bytes/'
+
+
+class CountingSource(LocalSource):
+    # counts the objects handed out, so a delta refresh can be told apart from a full listing
+    def __init__(self, root):
+        super().__init__(root)
+        self.num_listed = 0
+
+    def list_objects(self, prefix, start_after=None):
+        for obj in super().list_objects(prefix, start_after=start_after):
+            self.num_listed += 1
+            yield obj
+
+
+def write_media(root, video_ids, content=b'video'):
+    os.makedirs(os.path.join(root, PREFIX), exist_ok=True)
+    for video_id in video_ids:
+        with open(os.path.join(root, PREFIX, f"{video_id}.mp4"), 'wb') as f:
+            f.write(content)
+
+
+def keys(video_ids):
+    return sorted(f"{PREFIX}{video_id}.mp4" for video_id in video_ids)
+
+
+def make_inventory(tmp_path, source, **kwargs):
+    return MediaInventory(source, PREFIX, str(tmp_path / 'inventory' / 'media.parquet.zstd'), num_shards=4, num_threads=4, **kwargs)
+
+
+def test_first_refresh_lists_everything(tmp_path):
+    video_ids = [7000000000000000000 + i * 37 for i in range(50)] + [1000 + i for i in range(10)]
+    write_media(tmp_path / 'media', video_ids)
+    inventory = make_inventory(tmp_path, LocalSource(str(tmp_path / 'media')))
+    df = inventory.refresh()
+    assert df['key'].to_list() == keys(video_ids)
+    assert (df['size'] == 5).all()
+    with open(inventory.meta_path) as f:
+        assert 'full_listed_at' in json.load(f)
+    assert inventory.snapshot()['key'].to_list() == keys(video_ids)
+
+
+def test_delta_refresh_only_lists_new_keys(tmp_path):
+    old_ids = [7000000000000000000 + i * 1000 for i in range(100)]
+    write_media(tmp_path / 'media', old_ids)
+    source = CountingSource(str(tmp_path / 'media'))
+    inventory = make_inventory(tmp_path, source)
+    inventory.refresh()
+
+    # newer ids sort after everything already listed
+    new_ids = [7000000000000100000 + i for i in range(5)]
+    write_media(tmp_path / 'media', new_ids)
+    source.num_listed = 0
+    df = inventory.refresh()
+    assert df['key'].to_list() == keys(old_ids + new_ids)
+    # the last range lists its new keys, the others stop at their first key past the range
+    assert source.num_listed < len(old_ids)
+
+
+def test_full_listing_drops_deleted_keys(tmp_path):
+    video_ids = [7000000000000000000 + i for i in range(20)]
+    write_media(tmp_path / 'media', video_ids)
+    inventory = make_inventory(tmp_path, LocalSource(str(tmp_path / 'media')))
+    inventory.refresh()
+    os.remove(tmp_path / 'media' / PREFIX / f"{video_ids[3]}.mp4")
+
+    # a delta refresh never relists what it already has
+    assert len(inventory.refresh()) == 20
+    df = inventory.refresh(full=True)
+    assert df['key'].to_list() == keys(video_ids[:3] + video_ids[4:])
+
+
+def test_snapshot_is_invalidated(tmp_path):
+    video_ids = [7000000000000000000 + i for i in range(20)]
+    write_media(tmp_path / 'media', video_ids)
+    source = CountingSource(str(tmp_path / 'media'))
+    inventory = make_inventory(tmp_path, source)
+    inventory.refresh()
+
+    # a snapshot of another prefix isn't used
+    other = MediaInventory(source, 'tiktok/other/', inventory.snapshot_path)
+    assert len(other.snapshot()) == 0
+
+    # once full_every_hours has passed, the next refresh is a full listing again
+    expired = make_inventory(tmp_path, source, full_every_hours=0.0)
+    with open(expired.meta_path) as f:
+        full_listed_at = json.load(f)['full_listed_at']
+    os.remove(tmp_path / 'media' / PREFIX / f"{video_ids[0]}.mp4")
+    df = expired.refresh()
+    assert df['key'].to_list() == keys(video_ids[1:])
+    with open(expired.meta_path) as f:
+        assert json.load(f)['full_listed_at'] > full_listed_at
+
+    # rewriting a file changes its listed etag and size
+    write_media(tmp_path / 'media', video_ids[1:2], content=b're-encoded video')
+    df = expired.refresh()
+    row = df.filter(df['key'] == keys(video_ids[1:2])[0]).row(0, named=True)
+    assert row['size'] == len(b're-encoded video')
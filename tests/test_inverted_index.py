@@ -0,0 +1,59 @@
+import datetime
+import json
+import os
+
+import polars as pl
+
+from inverted_index import InvertedIndex
+from store import FragmentStore
+
+
+def videos(rows):
+    return pl.DataFrame({
+        'id': [str(video_id) for video_id, _, _, _ in rows],
+        'desc': [desc for _, desc, _, _ in rows],
+        'locationCreated': [country for _, _, country, _ in rows],
+        'createTime': [int(datetime.datetime(2025, 5, day, 12, tzinfo=datetime.timezone.utc).timestamp()) for _, _, _, day in rows],
+    })
+
+
+def test_update_search_daily_and_merge(tmp_path):
+    store = FragmentStore(str(tmp_path / 'videos'), partition_by=None, compact_threshold=None)
+    index = InvertedIndex(store, max_segments=2)
+    store.append(videos([
+        (1, 'Vot pentru Georgescu #alegeri', 'RO', 1),
+        (2, 'Lasconi la București #alegeri', 'RO', 1),
+    ]))
+    assert index.update() == 2
+    store.append(videos([
+        (3, 'georgescu #Alegeri', 'MD', 2),
+        (1, 'Vot pentru Georgescu #alegeri', 'RO', 1),
+    ]))
+    # the refetched video is skipped by id
+    assert index.update() == 1
+    assert index.update() == 0
+
+    assert sorted(index.search('georgescu')) == ['1', '3']
+    assert sorted(index.search('#alegeri', 'georgescu')) == ['1', '3']
+    assert list(index.search('bucuresti')) == ['2']
+    assert list(index.search('nobody')) == []
+    assert index.daily('#alegeri').rows() == [(datetime.date(2025, 5, 1), 2), (datetime.date(2025, 5, 2), 1)]
+    assert index.daily('#alegeri', country='MD').rows() == [(datetime.date(2025, 5, 2), 1)]
+
+    # a third segment goes over max_segments, the merged one answers the same
+    store.append(videos([(4, 'georgescu', 'RO', 3)]))
+    assert index.update() == 1
+    assert len(index.segments) == 1
+    assert sorted(index.search('georgescu')) == ['1', '3', '4']
+    assert index.term_counts().filter(pl.col('term') == 'georgescu')['videos'].item() == 3
+
+    # compaction replaces the fragments, only the ones that exist are remembered
+    store.compact()
+    assert index.update() == 0
+    with open(os.path.join(index.path, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta['fragments'] == [os.path.relpath(f, store.path) for f in store.fragments()]
+    assert len(meta['fragments']) == 1
+
+    reopened = InvertedIndex(store)
+    assert sorted(reopened.search('georgescu')) == ['1', '3', '4']
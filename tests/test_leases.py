@@ -0,0 +1,105 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from leases import open_lease_table
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def location(request, tmp_path):
+    # the Postgres runs need a scratch database, e.g. LEASES_POSTGRES_URL=postgresql://localhost/leases_test
+    if request.param == 'sqlite':
+        return str(tmp_path / 'leases.sqlite')
+    url = os.environ.get('LEASES_POSTGRES_URL')
+    if not url:
+        pytest.skip('LEASES_POSTGRES_URL is not set')
+    psycopg = pytest.importorskip('psycopg')
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute('DROP TABLE IF EXISTS leases')
+    return url
+
+
+def run_worker(path, worker_id, out_path, lease_seconds, crash_after_claim=False):
+    # one transcription worker process: claims batches, writes what it got, then completes them
+    leases = open_lease_table(path, lease_seconds=lease_seconds)
+    for video_ids in leases.leased_batches(worker_id, 7):
+        if crash_after_claim:
+            # dies holding the lease, without completing or failing anything
+            os._exit(1)
+        with open(out_path, 'a') as f:
+            f.write(json.dumps(video_ids) + '\n')
+        time.sleep(0.01)
+        leases.complete(video_ids)
+    leases.close()
+
+
+def start_workers(path, tmp_path, worker_ids, lease_seconds=60, crash_after_claim=False):
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_worker, args=(path, worker_id, str(tmp_path / f"{worker_id}.jsonl"), lease_seconds, crash_after_claim))
+        for worker_id in worker_ids
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    return processes
+
+
+def claimed(tmp_path, worker_ids):
+    video_ids = []
+    for worker_id in worker_ids:
+        out_path = tmp_path / f"{worker_id}.jsonl"
+        if out_path.exists():
+            with open(out_path) as f:
+                video_ids += [video_id for line in f for video_id in json.loads(line)]
+    return video_ids
+
+
+def test_workers_claim_every_video_once(tmp_path, location):
+    leases = open_lease_table(location)
+    leases.add(range(300))
+    worker_ids = [f"worker-{i}" for i in range(5)]
+    processes = start_workers(location, tmp_path, worker_ids)
+    assert all(process.exitcode == 0 for process in processes)
+    video_ids = claimed(tmp_path, worker_ids)
+    assert sorted(video_ids, key=int) == [str(i) for i in range(300)]
+    assert len({worker_id for worker_id in worker_ids if (tmp_path / f"{worker_id}.jsonl").exists()}) > 1
+    assert leases.counts() == {'done': 300}
+    leases.close()
+
+
+def test_crashed_worker_leases_expire(tmp_path, location):
+    leases = open_lease_table(location)
+    leases.add(range(50))
+    [crashed] = start_workers(location, tmp_path, ['crashed'], lease_seconds=1, crash_after_claim=True)
+    assert crashed.exitcode == 1
+    assert leases.counts() == {'leased': 7, 'pending': 43}
+
+    # before the lease runs out the crashed worker's videos aren't handed to anyone
+    start_workers(location, tmp_path, ['early'], lease_seconds=1)
+    assert len(claimed(tmp_path, ['early'])) == 43
+    assert leases.counts() == {'done': 43, 'leased': 7}
+
+    time.sleep(1.5)
+    start_workers(location, tmp_path, ['late'], lease_seconds=1)
+    assert sorted(claimed(tmp_path, ['early', 'late']), key=int) == [str(i) for i in range(50)]
+    assert leases.counts() == {'done': 50}
+    leases.close()
+
+
+def test_heartbeat_keeps_the_lease(location):
+    alive = open_lease_table(location, lease_seconds=0.6)
+    alive.add(range(5))
+    video_ids = alive.claim('alive', 5)
+    alive.start_heartbeat('alive')
+    other = open_lease_table(location, lease_seconds=0.6)
+    time.sleep(1.5)
+    assert other.claim('other', 5) == []
+    alive.close()
+    time.sleep(1.0)
+    assert sorted(other.claim('other', 5)) == sorted(video_ids)
+    other.close()
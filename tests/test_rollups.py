@@ -0,0 +1,50 @@
+import datetime
+
+import polars as pl
+
+from rollups import DailyRollup
+from store import FragmentStore
+
+
+def videos(video_ids, scrape_date, desc='vot #alegeri'):
+    return pl.DataFrame({
+        'id': [str(i) for i in video_ids],
+        'desc': [desc] * len(video_ids),
+        'locationCreated': ['RO'] * len(video_ids),
+        'createTime': [1746057600] * len(video_ids),
+        'author': [{'uniqueId': f"author{i}"} for i in video_ids],
+        'stats': [{'playCount': 10, 'diggCount': 1, 'commentCount': 0, 'shareCount': 0, 'collectCount': 0}] * len(video_ids),
+        'scrape_date': pl.Series([scrape_date] * len(video_ids), dtype=pl.Datetime('us')),
+    })
+
+
+def total_videos(rollup):
+    return rollup.daily()['videos'].sum()
+
+
+def test_late_fragments_and_missing_scrape_dates_are_counted(tmp_path):
+    store = FragmentStore(str(tmp_path / 'videos'), compact_threshold=None)
+    rollup = DailyRollup(store, terms=['vot'])
+    store.append(videos(range(5), datetime.datetime(2025, 5, 2, 12)))
+    assert rollup.update() == 5
+
+    # a crawler flushing the rows it scraped earlier only now, and rows from before scrape_date existed
+    store.append(videos(range(5, 8), datetime.datetime(2025, 5, 1, 9)))
+    store.append(videos(range(8, 10), None))
+    assert rollup.update() == 5
+    assert total_videos(rollup) == 10
+    assert rollup.update() == 0
+
+    # refetched videos and compacted fragments hold rows that are already counted
+    store.append(videos(range(3), datetime.datetime(2025, 5, 3)))
+    store.compact()
+    assert rollup.update() == 0
+    assert total_videos(rollup) == 10
+    assert rollup.daily(term='vot')['videos'].sum() == 10
+    assert rollup.daily(term='#alegeri')['videos'].sum() == 10
+
+    # a reopened rollup picks up where the last one stopped
+    store.append(videos(range(10, 12), datetime.datetime(2025, 4, 30)))
+    rollup = DailyRollup(store, terms=['vot'])
+    assert rollup.update() == 2
+    assert total_videos(rollup) == 12
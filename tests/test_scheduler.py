@@ -0,0 +1,40 @@
+from frontier import PriorityFrontier
+from scheduler import CrawlMetrics, NoveltyPolicy, WeightedPolicy, summarize_metrics
+
+
+def test_partial_window_is_written_on_close(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    metrics = CrawlMetrics('related_romania', 'keyword', path, window=4)
+    for num_discovered in [1, 0, 2, 1, 3, 1]:
+        metrics.record(num_discovered)
+    metrics.close()
+    metrics = CrawlMetrics('related_election', 'keyword', path, window=4)
+    metrics.record(5)
+    metrics.close()
+
+    summary = summarize_metrics(path)
+    assert summary.select('crawler', 'policy', 'fetches', 'discovered').rows() == [
+        ('related_election', 'keyword', 1, 5),
+        ('related_romania', 'keyword', 6, 8),
+    ]
+    assert summarize_metrics(path, crawler='related_romania')['fetches'].to_list() == [6]
+
+
+def test_novelty_scores_survive_a_reload(tmp_path):
+    policy = NoveltyPolicy()
+    items = [{'id': str(i), 'author_id': 'a' if i < 3 else 'b'} for i in range(4)]
+    scores = []
+    for item in items:
+        policy.observe(item)
+        scores.append(policy.score(item))
+    # scoring again doesn't count an item twice
+    assert [policy.score(item) for item in items] == scores == [1, 1 / 2, 1 / 3, 1]
+
+    frontier = PriorityFrontier(WeightedPolicy())
+    for item in [{'id': str(i), 'author_id': 'a'} for i in range(3)]:
+        frontier.push(item)
+    frontier.save(tmp_path)
+    frontier = PriorityFrontier.load(tmp_path, policy=WeightedPolicy())
+    assert sorted(item['author_rank'] for item in frontier.pending()) == [1, 2, 3]
+    frontier.push({'id': '9', 'author_id': 'a'})
+    assert max(item['author_rank'] for item in frontier.pending()) == 4
@@ -0,0 +1,41 @@
+import polars as pl
+import pytest
+
+from schema import conform, normalize
+from utils import concat
+
+
+def test_boolean_strings_are_parsed():
+    df = normalize([{'id': '1', 'isAd': 'false', 'duetEnabled': 'True', 'stitchEnabled': 1, 'shareEnabled': 'maybe'}])
+    assert df.select('isAd', 'duetEnabled', 'stitchEnabled', 'shareEnabled').row(0) == (False, True, True, None)
+    conformed = conform(pl.DataFrame({'id': ['1', '2', '3'], 'isAd': ['false', ' TRUE ', 'x']}))
+    assert conformed['isAd'].to_list() == [False, True, None]
+
+
+def test_concat_keeps_unknown_columns():
+    a = pl.DataFrame({'id': ['1'], 'score': [1.5]})
+    b = pl.DataFrame({'id': ['2'], 'other': ['x']})
+    df = concat(a, b)
+    assert df['score'].to_list() == [1.5, None]
+    assert df['other'].to_list() == [None, 'x']
+    assert df['extra'].null_count() == 2
+
+
+def test_fragments_carry_the_schema_version(tmp_path):
+    from schema import SCHEMA_VERSION, SCHEMA_VERSION_KEY, VIDEO_SCHEMA
+    from store import FragmentStore
+
+    store = FragmentStore(str(tmp_path / 'videos'), schema=VIDEO_SCHEMA, partition_by=None, compact_threshold=None)
+    [path] = store.append(normalize([{'id': '1', 'desc': 'a'}]))
+    assert pl.read_parquet_metadata(path)[SCHEMA_VERSION_KEY] == str(SCHEMA_VERSION)
+
+    # fragments from before versioning are read as before
+    pl.DataFrame({'id': ['2'], 'desc': ['b']}).write_parquet(tmp_path / 'videos' / 'all' / 'part-old.parquet.zstd')
+    assert sorted(store.read(columns=['id'])['id'].to_list()) == ['1', '2']
+
+    # one from newer code isn't silently conformed to an older schema
+    pl.DataFrame({'id': ['3']}).write_parquet(tmp_path / 'videos' / 'all' / 'part-new.parquet.zstd', metadata={SCHEMA_VERSION_KEY: str(SCHEMA_VERSION + 1)})
+    with pytest.raises(ValueError, match='newer'):
+        store.read()
+    with pytest.raises(ValueError, match='newer'):
+        store.compact()
@@ -0,0 +1,97 @@
+import ast
+import glob
+import os
+import threading
+import time
+
+from stages import LocalSource, Pipeline, Stage, make_source
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'scripts')
+
+
+def write_media(root, video_ids):
+    os.makedirs(os.path.join(root, 'tiktok', 'bytes'))
+    for video_id in video_ids:
+        with open(os.path.join(root, 'tiktok', 'bytes', f"{video_id}.mp4"), 'wb') as f:
+            f.write(f"video {video_id}".encode())
+
+
+def test_local_source_lists_and_reads(tmp_path):
+    write_media(tmp_path, [3, 1, 2])
+    source = make_source('local', str(tmp_path))
+    assert isinstance(source, LocalSource)
+    keys = [obj['key'] for obj in source.list_objects('tiktok/bytes/')]
+    assert keys == ['tiktok/bytes/1.mp4', 'tiktok/bytes/2.mp4', 'tiktok/bytes/3.mp4']
+    assert [obj['key'] for obj in source.list_objects('tiktok/bytes/', start_after='tiktok/bytes/1.mp4')] == keys[1:]
+    assert source.read('tiktok/bytes/2.mp4') == b'video 2'
+
+
+def test_pipeline_over_local_source(tmp_path):
+    # the transcribe.py stages with the models swapped for string work
+    video_ids = list(range(20))
+    write_media(tmp_path, video_ids)
+    source = LocalSource(str(tmp_path))
+    written = []
+    dropped = []
+    max_in_decode = 0
+
+    def fetch_stage(video_data):
+        return {**video_data, 'video_bytes': source.read(video_data['key'])}
+
+    def decode_stage(video_data):
+        nonlocal max_in_decode
+        max_in_decode = max(max_in_decode, decode.queue.qsize())
+        # stands in for an undecodable file
+        if video_data['video_id'] == 7:
+            return None
+        return {**video_data, 'audio': video_data.pop('video_bytes').decode()}
+
+    def asr_stage(video_data):
+        time.sleep(0.005)
+        if video_data['video_id'] == 11:
+            raise RuntimeError('out of memory')
+        return {**video_data, 'result': video_data['audio'].upper()}
+
+    def write_stage(video_data):
+        written.append(video_data)
+        return video_data
+
+    decode = Stage('decode', decode_stage, num_workers=2, queue_size=2)
+    pipeline = Pipeline([
+        Stage('fetch', fetch_stage, num_workers=3, queue_size=2),
+        decode,
+        Stage('asr', asr_stage, num_workers=2, queue_size=2),
+        Stage('write', write_stage, num_workers=1, queue_size=2),
+    ], on_drop=lambda stage_name, video_data: dropped.append((stage_name, video_data['video_id'])))
+    items = [{'video_id': i, 'key': f"tiktok/bytes/{i}.mp4"} for i in video_ids]
+    thread = threading.Thread(target=pipeline.run, args=(items,))
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+    assert sorted(d['video_id'] for d in written) == [i for i in video_ids if i not in (7, 11)]
+    assert all(d['result'] == f"VIDEO {d['video_id']}" for d in written)
+    assert sorted(dropped) == [('asr', 11), ('decode', 7)]
+    assert max_in_decode <= 2
+    report = {row['stage']: row for row in pipeline.report().to_dicts()}
+    assert report['fetch']['processed'] == 20
+    assert report['decode']['dropped'] == 1
+    assert report['asr']['errors'] == 1
+
+
+def test_scripts_do_not_bind_a_name_to_two_imports():
+    # transcribe.py once imported stages.Pipeline over pyannote's Pipeline, the scripts can't all
+    # be imported here, so the imports are checked statically
+    for path in glob.glob(os.path.join(SCRIPTS_DIR, '*.py')):
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        bound = {}
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names = [(alias.asname or alias.name.split('.')[0], alias.name) for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                names = [(alias.asname or alias.name, f"{node.module}.{alias.name}") for alias in node.names]
+            else:
+                continue
+            for name, source in names:
+                assert bound.setdefault(name, source) == source, f"{os.path.basename(path)}: {name} is both {bound[name]} and {source}"
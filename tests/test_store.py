@@ -0,0 +1,38 @@
+import os
+
+import polars as pl
+import pytest
+
+from store import FragmentStore
+
+
+def rows(ids, version):
+    return pl.DataFrame({'id': [str(i) for i in ids], 'version': [version] * len(ids)})
+
+
+def test_compact_folds_in_the_legacy_file(tmp_path):
+    store = FragmentStore(str(tmp_path / 'videos'), partition_by='id_hash', num_buckets=2, compact_threshold=None)
+    rows([1, 2, 3], 'legacy').write_parquet(store.legacy_path)
+    store.append(rows([2], 'new'))
+    assert store.fragments()[0] == store.legacy_path
+
+    store.compact()
+    assert not os.path.exists(store.legacy_path)
+    assert all(os.path.basename(f).startswith('compacted-') for f in store.fragments())
+    # the legacy rows are the oldest, a newer copy of a row wins
+    assert sorted(store.read().rows()) == [('1', 'legacy'), ('2', 'new'), ('3', 'legacy')]
+
+
+def test_read_retries_after_a_concurrent_compaction(tmp_path):
+    store = FragmentStore(str(tmp_path / 'videos'), partition_by=None, compact_threshold=None)
+    store.append(rows([1], 'a'))
+    store.append(rows([2], 'a'))
+    # another process lists the fragments, then this one compacts them away
+    stale = store.scan()
+    store.compact()
+    with pytest.raises(FileNotFoundError):
+        stale.collect()
+
+    scans = [stale]
+    store.scan = lambda columns=None: scans.pop() if scans else FragmentStore.scan(store, columns)
+    assert sorted(store.read()['id']) == ['1', '2']